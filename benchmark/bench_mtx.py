@@ -0,0 +1,91 @@
+"""Matrix Market reading throughput of load_data.read_mtx and scipy.io.mmread
+
+Synthetic gene-by-cell count matrices with 1e6 to 1e9 non-zero entries
+are written to a temporary directory (roughly 15 bytes per entry, so the
+largest file takes about 15 GB) and read with both readers.
+
+    python benchmark/bench_mtx.py --max-nnz 1e8 --jobs 8
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.io
+
+from orangecontrib.single_cell.widgets.load_data import read_mtx
+
+N_GENES = 30000
+DENSITY = 0.1
+WRITE_CHUNK = 10 ** 7
+
+
+def write_mtx(file_name, nnz, seed=0):
+    n_cells = int(np.ceil(nnz / (N_GENES * DENSITY)))
+    rstate = np.random.RandomState(seed)
+    with open(file_name, "w") as f:
+        f.write("%%MatrixMarket matrix coordinate integer general\n%\n")
+        f.write("{} {} {}\n".format(N_GENES, n_cells, nnz))
+        for start in range(0, nnz, WRITE_CHUNK):
+            n = min(WRITE_CHUNK, nnz - start)
+            pd.DataFrame({
+                "gene": rstate.randint(1, N_GENES + 1, n),
+                "cell": rstate.randint(1, n_cells + 1, n),
+                "count": rstate.geometric(0.3, n),
+            }).to_csv(f, sep=" ", header=False, index=False)
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-nnz", type=float, default=1e6)
+    parser.add_argument("--max-nnz", type=float, default=1e9)
+    parser.add_argument("--mmread-max-nnz", type=float, default=1e8,
+                        help="skip scipy.io.mmread for larger files")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--dir", default=None,
+                        help="directory for the synthetic files")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(dir=args.dir)
+    print("{:>12} {:>10} {:>14} {:>14} {:>8}".format(
+        "nnz", "size [MB]", "read_mtx [/s]", "mmread [/s]", "speedup"))
+    try:
+        nnz = int(args.min_nnz)
+        while nnz <= args.max_nnz:
+            file_name = os.path.join(tmp_dir, "matrix.mtx")
+            write_mtx(file_name, nnz)
+            size = os.path.getsize(file_name) / 2 ** 20
+
+            t_fast = measure(
+                lambda: read_mtx(file_name, n_jobs=args.jobs), args.repeat)
+            if nnz <= args.mmread_max_nnz:
+                t_scipy = measure(
+                    lambda: scipy.io.mmread(file_name).tocsr(), args.repeat)
+                scipy_rate = "{:14.3g}".format(nnz / t_scipy)
+                speedup = "{:8.1f}".format(t_scipy / t_fast)
+            else:
+                scipy_rate, speedup = "{:>14}".format("-"), "{:>8}".format("-")
+            print("{:12.0e} {:10.0f} {:14.3g} {} {}".format(
+                nnz, size, nnz / t_fast, scipy_rate, speedup))
+
+            os.remove(file_name)
+            nnz *= 10
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Reading of gene-by-cell text files with load_data.read_transposed and
+with pandas followed by a transposition
+
+A synthetic count file with genes in rows and cells in columns (20k x 100k
+by default, about 4 GB at the default density) is written to a temporary
+directory and read into a cell-by-gene matrix with both readers.
+
+    python benchmark/bench_transposed.py --genes 20000 --cells 100000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from orangecontrib.single_cell.widgets.load_data import read_transposed
+
+CHUNK_SIZE = 10000
+
+
+def write_count_file(file_name, n_genes, n_cells, density, seed=0):
+    rstate = np.random.RandomState(seed)
+    fmt = "\t".join(["%d"] * n_cells)
+    with open(file_name, "w") as f:
+        f.write("\t".join(["gene"] + ["cell{}".format(i)
+                                      for i in range(n_cells)]) + "\n")
+        for i in range(n_genes):
+            counts = rstate.geometric(0.3, n_cells)
+            counts[rstate.uniform(size=n_cells) >= density] = 0
+            f.write("gene{}\t".format(i) + fmt % tuple(counts) + "\n")
+
+
+def read_pandas(file_name, sparse):
+    if not sparse:
+        df = pd.read_csv(file_name, sep="\t", index_col=0)
+        return df.values.T
+    blocks = []
+    for chunk in pd.read_csv(file_name, sep="\t", index_col=0,
+                             chunksize=CHUNK_SIZE):
+        blocks.append(sp.csr_matrix(chunk.values, dtype=float))
+    return sp.vstack(blocks, format="csr").T.tocsr()
+
+
+def read_direct(file_name, sparse):
+    with open(file_name, "rb") as f:
+        return read_transposed(f, "\t", sparse=sparse)[0]
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--genes", type=int, default=20000)
+    parser.add_argument("--cells", type=int, default=100000)
+    parser.add_argument("--density", type=float, default=0.1)
+    parser.add_argument("--dense", action="store_true",
+                        help="read into dense arrays")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--dir", default=None,
+                        help="directory for the synthetic file")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        file_name = os.path.join(tmp_dir, "data.count")
+        write_count_file(file_name, args.genes, args.cells, args.density)
+        size = os.path.getsize(file_name) / 2 ** 20
+        sparse = not args.dense
+
+        t_direct = measure(lambda: read_direct(file_name, sparse),
+                           args.repeat)
+        t_pandas = measure(lambda: read_pandas(file_name, sparse),
+                           args.repeat)
+        print("{} x {} ({:.0f} MB, {})".format(
+            args.genes, args.cells, size, "sparse" if sparse else "dense"))
+        print("{:>18} {:10.1f} s".format("read_transposed", t_direct))
+        print("{:>18} {:10.1f} s".format("pandas + .T", t_pandas))
+        print("{:>18} {:10.1f}".format("speedup", t_pandas / t_direct))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+BGZF files
+
+BGZF files (written, for instance, by bgzip) are series of gzip members
+with at most 64 KB of uncompressed data each. They can be read as any
+gzip file, but their blocks can also be located and decompressed
+independently.
+"""
+import io
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MAGIC = b"\x1f\x8b\x08\x04"
+# largest amount of data in a block written by bgzip
+BLOCK_DATA_SIZE = 0xff00
+# empty block which marks the end of file
+EOF_BLOCK = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def block_size(data, pos=0):
+    """Size of the block which starts at pos
+
+    :param data: bytes
+    :param pos: int
+    :return: int or None if there is no (complete) block header at pos
+    """
+    if data[pos:pos + 4] != MAGIC or len(data) < pos + 12:
+        return None
+    extra_end = pos + 12 + struct.unpack_from("<H", data, pos + 10)[0]
+    if len(data) < extra_end:
+        return None
+    i = pos + 12
+    while i + 4 <= extra_end:
+        tag = bytes(data[i:i + 2])
+        length = struct.unpack_from("<H", data, i + 2)[0]
+        if tag == b"BC" and length == 2:
+            return struct.unpack_from("<H", data, i + 4)[0] + 1
+        i += 4 + length
+    return None
+
+
+def decompress_block(block):
+    """Decompress a single block
+
+    The data is checked against the CRC32 and the size in the footer.
+
+    :param block: bytes or memoryview
+    :return: bytes
+    """
+    xlen = struct.unpack_from("<H", block, 10)[0]
+    data = zlib.decompress(block[12 + xlen:-8], -15)
+    crc, size = struct.unpack_from("<II", block, len(block) - 8)
+    if zlib.crc32(data) & 0xffffffff != crc or len(data) & 0xffffffff != size:
+        raise ValueError("Corrupted BGZF block")
+    return data
+
+
+def compress(data, size=BLOCK_DATA_SIZE, level=6):
+    """Compress data into BGZF blocks, followed by the end-of-file block
+
+    :param data: bytes
+    :param size: int, size of uncompressed data per block
+    :param level: int, compression level
+    :return: bytes
+    """
+    blocks = []
+    for start in range(0, len(data), size):
+        part = data[start:start + size]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(part) + compressor.flush()
+        header = struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6,
+                             66, 67, 2, len(deflated) + 25)
+        blocks += [header, deflated,
+                   struct.pack("<II", zlib.crc32(part), len(part))]
+    return b"".join(blocks) + EOF_BLOCK
+
+
+def is_bgzf(file_name):
+    """Return True if the file starts with a BGZF block"""
+    try:
+        with open(file_name, "rb") as f:
+            header = f.read(64)
+    except OSError:
+        return False
+    return block_size(header) is not None
+
+
+def read_block(f, offset):
+    """Decompress the block at the given offset
+
+    :param f: file opened in binary mode
+    :param offset: int
+    :return: tuple (data, offset of the next block or None at the end)
+    """
+    f.seek(offset)
+    header = f.read(12)
+    if len(header) < 12:
+        return b"", None
+    header += f.read(struct.unpack_from("<H", header, 10)[0])
+    size = block_size(header)
+    if size is None:
+        raise ValueError("Not a BGZF block at {}".format(offset))
+    block = header + f.read(size - len(header))
+    return decompress_block(block), offset + size
+
+
+def read_chunk(f, begin, end):
+    """Decompress the data between virtual offsets begin and end
+
+    A virtual offset is the offset of a block << 16 | offset within the
+    decompressed block.
+
+    :param f: file opened in binary mode
+    :param begin: int
+    :param end: int
+    :return: bytes
+    """
+    cbegin, ubegin = begin >> 16, begin & 0xffff
+    cend, uend = end >> 16, end & 0xffff
+    parts = []
+    offset = cbegin
+    while offset is not None and offset <= cend:
+        data, next_offset = read_block(f, offset)
+        parts.append(data[ubegin if offset == cbegin else 0:
+                          uend if offset == cend else len(data)])
+        offset = next_offset
+    return b"".join(parts)
+
+
+def find_block(f, offset, size=2 ** 17):
+    """Offset of the first block which starts within size bytes after
+    offset, or None
+
+    A candidate header is accepted if another block (or the end of data)
+    follows it, so a header-like sequence within compressed data is
+    unlikely to be taken for a block.
+    """
+    f.seek(offset)
+    data = f.read(size)
+    pos = data.find(MAGIC)
+    while pos >= 0:
+        n = block_size(data, pos)
+        if n is not None and (
+                pos + n >= len(data) or data[pos + n:pos + n + 4] == MAGIC):
+            return offset + pos
+        pos = data.find(MAGIC, pos + 1)
+    return None
+
+
+def read_index(file_name):
+    """Read the block index (.gzi, written by bgzip -i) of a file
+
+    :param file_name: str, name of the compressed file
+    :return: np.ndarray with compressed and uncompressed offsets of
+        blocks, or None if the file has no index
+    """
+    try:
+        with open(file_name + ".gzi", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    n = struct.unpack_from("<Q", data)[0]
+    offsets = np.frombuffer(data, dtype="<u8", count=2 * n, offset=8)
+    return np.vstack((np.zeros((1, 2), dtype=np.uint64),
+                      offsets.reshape(-1, 2)))
+
+
+def uncompressed_size(file_name):
+    """Size of the decompressed file if it has a block index, else None"""
+    index = read_index(file_name)
+    if index is None:
+        return None
+    with open(file_name, "rb") as f:
+        data, _ = read_block(f, int(index[-1, 0]))
+    return int(index[-1, 1]) + len(data)
+
+
+def split_blocks(data):
+    """Split data into complete blocks
+
+    :param data: bytes
+    :return: tuple (list of (begin, end) of blocks, end of the last block)
+    """
+    blocks, pos = [], 0
+    while True:
+        size = block_size(data, pos)
+        if size is None or pos + size > len(data):
+            return blocks, pos
+        blocks.append((pos, pos + size))
+        pos += size
+
+
+def _decompress_blocks(data, blocks):
+    view = memoryview(data)
+    return b"".join(decompress_block(view[b:e]) for b, e in blocks)
+
+
+class BlockReader(io.RawIOBase):
+    """Binary stream of the decompressed data of a BGZF file
+
+    Blocks are read and decompressed one at a time, when they are needed,
+    which suits reading just the beginning of a file (e.g. a header).
+    """
+    def __init__(self, file_name):
+        super().__init__()
+        self._file = open(file_name, "rb")
+        self._offset = 0
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self._buffer):
+            if self._offset is None:
+                return 0
+            data, self._offset = read_block(self._file, self._offset)
+            self._buffer = memoryview(data)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class BgzfReader(io.RawIOBase):
+    """Binary stream of the decompressed data of a BGZF file
+
+    Whole blocks are read in batches of about batch_size compressed bytes
+    and decompressed in a pool of threads (zlib releases the GIL). At most
+    2 * n_jobs batches are decompressed ahead of the reader; batches are
+    returned in order.
+
+    The callback is called with the fraction of the compressed file read
+    by the reader.
+    """
+    def __init__(self, file_name, callback=None, n_jobs=None,
+                 batch_size=2 ** 20):
+        super().__init__()
+        self._file = open(file_name, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size or 1
+        self._callback = callback
+        self._batch_size = batch_size
+        self._n_jobs = n_jobs or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self._n_jobs)
+        self._pending = deque()
+        self._rest = b""
+        self._buffer = memoryview(b"")
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _submit(self):
+        data = self._rest
+        while True:
+            more = self._file.read(self._batch_size)
+            data += more
+            blocks, end = split_blocks(data)
+            if blocks or not more:
+                break
+        if not blocks:
+            self._eof = True
+            if data:
+                raise ValueError("Truncated or invalid BGZF data")
+            return
+        self._rest = data[end:]
+        position = self._file.tell() - len(self._rest)
+        self._pending.append(
+            (self._executor.submit(_decompress_blocks, data, blocks),
+             position))
+
+    def readinto(self, b):
+        while not len(self._buffer):
+            while not self._eof and len(self._pending) < 2 * self._n_jobs:
+                self._submit()
+            if not self._pending:
+                return 0
+            future, position = self._pending.popleft()
+            self._buffer = memoryview(future.result())
+            if self._callback is not None:
+                self._callback(min(position / self._size, 1))
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            for future, _ in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._file.close()
+        super().close()
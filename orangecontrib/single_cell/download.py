@@ -0,0 +1,269 @@
+"""
+Resumable downloads
+
+Files are downloaded into a partial file (<name>.part) in chunks of
+CHUNK_SIZE bytes. A journal next to it (<name>.part.json) records the
+validator (ETag or Last-Modified) of the remote file and the SHA-1 digest
+of every completed chunk. An interrupted download continues with the
+missing chunks; chunks whose data no longer matches their digest are
+downloaded again. Chunks are requested in parallel when the server accepts
+range requests; otherwise the file is downloaded in a single stream.
+
+The chunk digests are computed from the received data, so they only
+detect changes of the partial file on the local disk; a changed remote
+file is detected through its validator. Data corrupted in transfer is
+detected only when the MD5 checksum of the file is known: it is given by
+the caller or sent by the server (as Content-MD5 or as an ETag in the
+form of an MD5 digest, as e.g. S3 does), and the complete file is checked
+against it.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.request import Request, urlopen
+
+CHUNK_SIZE = 2 ** 23
+BLOCK_SIZE = 2 ** 16
+TIMEOUT = 30
+# interval (in seconds) of progress reports while chunks are downloaded
+POLL_INTERVAL = 0.1
+
+
+def _header_md5(headers):
+    """MD5 digest (hex) of the content, if the headers provide it"""
+    content_md5 = headers.get("Content-MD5")
+    if content_md5:
+        try:
+            return binascii.hexlify(
+                base64.b64decode(content_md5, validate=True)).decode()
+        except (binascii.Error, ValueError):
+            pass
+    match = re.fullmatch(r'"([0-9a-fA-F]{32})"', headers.get("ETag") or "")
+    return match.group(1).lower() if match else None
+
+
+def remote_file(url, timeout=TIMEOUT):
+    """Size, validator, range support and MD5 digest of a remote file
+
+    :param url: str
+    :param timeout: float
+    :return: tuple (int or None, str or None, bool, str or None)
+    """
+    with urlopen(Request(url, method="HEAD"), timeout=timeout) as response:
+        headers = response.headers
+    size = headers.get("Content-Length")
+    validator = headers.get("ETag") or headers.get("Last-Modified")
+    ranges = headers.get("Accept-Ranges", "").lower() == "bytes"
+    return (int(size) if size is not None else None), validator, ranges, \
+        _header_md5(headers)
+
+
+def read_journal(file_name):
+    """Journal of a partial download or None if there is none"""
+    try:
+        with open(file_name) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_journal(file_name, journal):
+    """Write the journal, replacing the old one at once"""
+    with open(file_name + ".tmp", "w") as f:
+        json.dump(journal, f)
+    os.replace(file_name + ".tmp", file_name)
+
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _chunk_range(i, chunk_size, size):
+    return i * chunk_size, min((i + 1) * chunk_size, size)
+
+
+def intact_chunks(part_name, journal):
+    """Chunks of the partial file which still match their digests in the
+    journal, i.e. have not changed since they were written
+
+    :param part_name: str
+    :param journal: dict
+    :return: dict of digests by chunk index (as str)
+    """
+    intact = {}
+    try:
+        f = open(part_name, "rb")
+    except OSError:
+        return intact
+    with f:
+        for key, digest in journal["chunks"].items():
+            begin, end = _chunk_range(int(key), journal["chunk_size"],
+                                      journal["size"])
+            f.seek(begin)
+            if _digest(f.read(end - begin)) == digest:
+                intact[key] = digest
+    return intact
+
+
+def file_md5(file_name):
+    """MD5 digest (hex) of a file"""
+    md5 = hashlib.md5()
+    with open(file_name, "rb") as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b""):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def _fetch_chunk(url, part_name, begin, end, validator, timeout, stop,
+                 received):
+    """Download a range of the file; stop if `stop` is set
+
+    :param stop: threading.Event
+    :param received: list, to which the sizes of received blocks are added
+    """
+    headers = {"Range": "bytes={}-{}".format(begin, end - 1)}
+    if validator is not None:
+        headers["If-Range"] = validator
+    blocks = []
+    with urlopen(Request(url, headers=headers), timeout=timeout) as response:
+        if response.status != 206:
+            raise OSError("{} changed or does not support ranges"
+                          .format(url))
+        while not stop.is_set():
+            block = response.read(BLOCK_SIZE)
+            if not block:
+                break
+            blocks.append(block)
+            received.append(len(block))
+    if stop.is_set():
+        raise KeyboardInterrupt()
+    data = b"".join(blocks)
+    if len(data) != end - begin:
+        raise OSError("Incomplete range {}-{} of {}".format(begin, end, url))
+    with open(part_name, "r+b") as f:
+        f.seek(begin)
+        f.write(data)
+    return _digest(data)
+
+
+def _download_stream(url, part_name, size, callback, timeout):
+    with urlopen(url, timeout=timeout) as response, \
+            open(part_name, "wb") as f:
+        done = 0
+        while True:
+            data = response.read(2 ** 16)
+            if not data:
+                break
+            f.write(data)
+            done += len(data)
+            # without the size, progress is unknown but the callback can
+            # still stop the download
+            if callback is not None:
+                callback(min(done / size, 1) if size else None)
+
+
+def _download_chunks(url, part_name, journal_name, journal, chunks,
+                     validator, n_jobs, callback, timeout):
+    """Download chunks in parallel and record them in the journal
+
+    The callback is polled while chunks are downloading, so the download
+    stops soon after it raises; the running requests stop at their next
+    block, and the requests which have not started are cancelled.
+    """
+    size, chunk_size = journal["size"], journal["chunk_size"]
+    stop = threading.Event()
+    received = []
+    done = size - sum(
+        end - begin for begin, end in
+        (_chunk_range(i, chunk_size, size) for i in chunks))
+    executor = ThreadPoolExecutor(max_workers=n_jobs)
+    pending = {}
+    try:
+        for i in chunks:
+            begin, end = _chunk_range(i, chunk_size, size)
+            pending[executor.submit(_fetch_chunk, url, part_name, begin, end,
+                                    validator, timeout, stop, received)] = i
+        while pending:
+            finished, _ = wait(pending, timeout=POLL_INTERVAL,
+                               return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = pending.pop(future)
+                journal["chunks"][str(i)] = future.result()
+                write_journal(journal_name, journal)
+            if callback is not None:
+                callback(min((done + sum(received)) / size, 1))
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        # requests which have not started are not sent
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def download(url, file_name, chunk_size=CHUNK_SIZE, n_jobs=4,
+             callback=None, timeout=TIMEOUT, md5=None):
+    """Download url into file_name, resuming an interrupted download
+
+    The callback is called with the fraction of the file downloaded, or
+    with None if the size of the file is unknown, at least every
+    POLL_INTERVAL seconds while data is arriving; an exception raised by
+    the callback stops the download, which can be resumed later.
+
+    The downloaded file is checked against `md5` or, if it is not given,
+    against the MD5 digest sent by the server. If it does not match, the
+    partial download is removed and OSError is raised.
+
+    :param url: str
+    :param file_name: str
+    :param chunk_size: int
+    :param n_jobs: int, number of parallel range requests
+    :param callback: callable
+    :param timeout: float
+    :param md5: str or None, expected MD5 digest (hex) of the file
+    :return: str, file_name
+    """
+    part_name = file_name + ".part"
+    journal_name = part_name + ".json"
+    size, validator, ranges, remote_md5 = remote_file(url, timeout)
+    md5 = (md5 or remote_md5 or "").lower() or None
+    if size is None or not ranges:
+        _download_stream(url, part_name, size, callback, timeout)
+    else:
+        identity = {"url": url, "size": size, "validator": validator,
+                    "chunk_size": chunk_size}
+        journal = read_journal(journal_name)
+        if journal is None or \
+                any(journal.get(k) != v for k, v in identity.items()):
+            journal = dict(identity, chunks={})
+        journal["chunks"] = intact_chunks(part_name, journal)
+        if not journal["chunks"] or not os.path.exists(part_name):
+            with open(part_name, "wb"):
+                pass
+        os.truncate(part_name, size)
+        write_journal(journal_name, journal)
+
+        n_chunks = (size + chunk_size - 1) // chunk_size
+        missing = [i for i in range(n_chunks)
+                   if str(i) not in journal["chunks"]]
+        _download_chunks(url, part_name, journal_name, journal, missing,
+                         validator, n_jobs, callback, timeout)
+        if os.path.getsize(part_name) != size:
+            raise OSError("Size of the downloaded {} does not match"
+                          .format(url))
+    if md5 is not None and file_md5(part_name) != md5:
+        os.remove(part_name)
+        if os.path.exists(journal_name):
+            os.remove(journal_name)
+        raise OSError("Checksum of the downloaded {} does not match"
+                      .format(url))
+    os.replace(part_name, file_name)
+    if os.path.exists(journal_name):
+        os.remove(journal_name)
+    return file_name
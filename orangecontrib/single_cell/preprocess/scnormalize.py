@@ -99,8 +99,12 @@ class ScNormalizeModel:
                     Columns are genes and rows are cells.
         :return: Data table with normalized values.
         """
-        # Result in expected number of reads
-        Xeq = data.X.copy()
+        # Result in expected number of reads; keep single precision
+        # (integer counts become float32) instead of upcasting
+        dtype = data.X.dtype
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float32
+        Xeq = data.X.astype(dtype)
         n = Xeq.shape[0]
 
         # Normalize cell profiles
@@ -122,21 +126,22 @@ class ScNormalizeModel:
                 inxs = np.logical_not(np.isnan(vals))
                 factors[inxs] = vals[inxs]
 
-            Xd = sp.dia_matrix((factors.ravel(), 0), shape=(n, n), dtype=float)
+            Xd = sp.dia_matrix((factors.ravel(), 0), shape=(n, n), dtype=dtype)
             Xeq = Xd.dot(Xeq)
 
         # Log transform log(1 + x)
         if self.log_base is not None:
+            scale = 1 / float(np.log(self.log_base))
             if sp.isspmatrix(Xeq):
-                Xeq = Xeq.log1p() / np.log(self.log_base)
+                Xeq = Xeq.log1p() * scale
             else:
-                Xeq = np.log(1 + Xeq) / np.log(self.log_base)
+                Xeq = np.log1p(Xeq) * scale
 
         # Binary transform;
         # potential change to sparsity structure;
         if self.bin_thresh is not None:
             if sp.isspmatrix(Xeq):
-                Xeq.data = (Xeq.data > self.bin_thresh).astype(int)
+                Xeq.data = (Xeq.data > self.bin_thresh).astype(dtype)
                 Xeq.eliminate_zeros()
             else:
                 Xeq = (Xeq > self.bin_thresh)
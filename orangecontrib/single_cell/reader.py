@@ -1,63 +1,443 @@
+import io
+import re
+import csv
+import gzip
+import time
+import struct
+
+from itertools import chain
+from typing import Dict, List
+
 import numpy as np
-import vcf
+import pandas as pd
+import scipy.sparse as sp
 
 from Orange.data import DiscreteVariable, Domain, StringVariable, Table
 
+from orangecontrib.single_cell import bgzf
+
+#: genotype code of a call with a missing allele
+MISSING = -1
+
+#: number of set bits of bytes
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+VCF_COLUMNS = ["CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+               "FORMAT"]
+
+
+def open_vcf(filename, parallel=True):
+    """Open (gzipped) VCF file in text mode
+
+    BGZF-compressed files are decompressed in parallel, or one block at a
+    time if only the beginning of the file is read.
+
+    :param filename: str
+    :param parallel: bool, decompress batches of blocks ahead of the reader
+    """
+    if bgzf.is_bgzf(filename):
+        raw = bgzf.BgzfReader(filename) if parallel \
+            else bgzf.BlockReader(filename)
+        return io.TextIOWrapper(io.BufferedReader(raw))
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rt")
+    return open(filename, "r")
+
+
+def read_vcf_header(f):
+    """Read meta-information lines and the header line
+
+    :param f: file opened in text mode
+    :return: list of sample names
+    """
+    for line in f:
+        if line.startswith("##"):
+            continue
+        if line.startswith("#CHROM"):
+            return line.rstrip("\r\n").split("\t")[len(VCF_COLUMNS):]
+        break
+    raise ValueError("Missing VCF header line")
+
+
+def parse_region(region):
+    """Parse a region, e.g. "chr17", "chr17:7500000" or
+    "chr17:7,500,000-7,600,000" (1-based, inclusive)
+
+    :param region: str
+    :return: tuple (name, begin, end), 0-based and half-open
+    """
+    match = re.match(r"^(.+?)(?::([\d,]+)(?:-([\d,]+))?)?$",
+                     region.strip())
+    if match is None:
+        raise ValueError("Invalid region: {}".format(region))
+    name, begin, end = match.groups()
+    begin = int(begin.replace(",", "")) - 1 if begin else 0
+    end = int(end.replace(",", "")) if end else TabixIndex.MAX_POSITION
+    return name, max(begin, 0), end
+
+
+def reg2bins(begin, end):
+    """Bins of the binning scheme which overlap [begin, end)"""
+    end -= 1
+    bins = [0]
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(offset + (begin >> shift),
+                          offset + (end >> shift) + 1))
+    return bins
+
+
+class TabixIndex:
+    """Tabix index (.tbi) of a bgzip-compressed file
+
+    The index maps reference sequences to bins of chunks, given by virtual
+    offsets (offset of a BGZF block << 16 | offset within the block).
+    """
+    MAX_POSITION = 1 << 29
+
+    def __init__(self, file_name):
+        with gzip.open(file_name, "rb") as f:
+            data = f.read()
+        if data[:4] != b"TBI\x01":
+            raise ValueError("{} is not a tabix index".format(file_name))
+        n_ref = struct.unpack_from("<i", data, 4)[0]
+        l_nm = struct.unpack_from("<i", data, 32)[0]
+        pos = 36 + l_nm
+        names = data[36:pos].split(b"\0")[:n_ref]
+        self.names = {name.decode(): i for i, name in enumerate(names)}
+        self.bins = []  # type: List[Dict[int, np.ndarray]]
+        self.linear = []  # type: List[np.ndarray]
+        for _ in range(n_ref):
+            n_bin = struct.unpack_from("<i", data, pos)[0]
+            pos += 4
+            bins = {}
+            for _ in range(n_bin):
+                bin_, n_chunk = struct.unpack_from("<Ii", data, pos)
+                pos += 8
+                bins[bin_] = np.frombuffer(
+                    data, dtype="<u8", count=2 * n_chunk, offset=pos
+                ).reshape(-1, 2)
+                pos += 16 * n_chunk
+            n_intv = struct.unpack_from("<i", data, pos)[0]
+            pos += 4
+            self.bins.append(bins)
+            self.linear.append(
+                np.frombuffer(data, dtype="<u8", count=n_intv, offset=pos))
+            pos += 8 * n_intv
+
+    def chunks(self, name, begin, end):
+        """Chunks which may contain records of name overlapping
+        [begin, end)
+
+        :return: list of tuples (begin, end) of virtual offsets
+        """
+        if name not in self.names:
+            return []
+        ref = self.names[name]
+        linear = self.linear[ref]
+        min_offset = 0
+        if len(linear):
+            min_offset = linear[min(begin >> 14, len(linear) - 1)]
+        bins = self.bins[ref]
+        return [(int(b), int(e)) for bin_ in reg2bins(begin, end)
+                if bin_ in bins for b, e in bins[bin_] if e > min_offset]
+
+
+def merge_chunks(chunks):
+    """Sorted chunks with overlapping ones merged"""
+    merged = []
+    for begin, end in sorted(chunks):
+        if merged and begin <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+class _ChunksFile(io.RawIOBase):
+    """Readable binary stream of an iterable of bytes"""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def read_regions(filename, regions):
+    """Records of a bgzip-compressed, tabix-indexed VCF file which overlap
+    the given regions
+
+    Only the BGZF blocks of chunks covering the regions are decompressed.
+
+    :param filename: str
+    :param regions: list of tuples (name, begin, end), 0-based, half-open
+    :return: iterator of bytes with VCF lines
+    """
+    index = TabixIndex(filename + ".tbi")
+    chunks = merge_chunks(chain.from_iterable(
+        index.chunks(*region) for region in regions))
+    by_name = {}
+    for name, begin, end in regions:
+        by_name.setdefault(name.encode(), []).append((begin, end))
+    with open(filename, "rb") as f:
+        for begin, end in chunks:
+            lines = bgzf.read_chunk(f, begin, end).splitlines(True)
+            yield b"".join(
+                line for line in lines if _overlaps(line, by_name))
+
+
+def _overlaps(line, regions):
+    fields = line.split(b"\t", 4)
+    if len(fields) < 5 or line.startswith(b"#"):
+        return False
+    chrom, pos, _, ref, _ = fields
+    begin = int(pos) - 1
+    end = begin + max(len(ref), 1)
+    return any(b < end and begin < e for b, e in regions.get(chrom, ()))
+
+
+def genotype_codes(gt):
+    """Number of non-reference alleles of genotype calls
+
+    :param gt: pd.Series of str, e.g. "0/1", "1|2" or "./."
+    :return: np.ndarray of int8, MISSING for calls with missing alleles
+    """
+    alleles = gt.str.split(r"[/|]", expand=True)
+    present = alleles.notnull()
+    missing = gt.isnull().values | \
+        ((alleles == ".") | (alleles == "")).any(axis=1).values
+    codes = ((alleles != "0") & present).sum(axis=1).values
+    codes = np.clip(codes, 0, 127).astype(np.int8)
+    codes[missing] = MISSING
+    return codes
+
+
+def genotype_quality(gq):
+    """Genotype qualities clipped to [0, 255]; missing values are 0
+
+    :param gq: pd.Series of str
+    :return: np.ndarray of uint8
+    """
+    values = pd.to_numeric(gq, errors="coerce").values
+    return np.clip(np.nan_to_num(values), 0, 255).astype(np.uint8)
+
+
+def _grow(array, n, capacity):
+    """Copy of array with the first n rows and room for capacity rows"""
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:n] = array[:n]
+    return grown
+
+
+def parse_samples(formats, samples):
+    """Genotype codes and qualities of a block of records
+
+    Records are grouped by their FORMAT and the sample fields of each group
+    are split at once.
+
+    :param formats: np.ndarray of str, FORMAT fields of records
+    :param samples: np.ndarray of str, sample fields (records x samples)
+    :return: tuple (np.ndarray of int8, np.ndarray of uint8)
+    """
+    gt = np.full(samples.shape, MISSING, dtype=np.int8)
+    gq = np.zeros(samples.shape, dtype=np.uint8)
+    for fmt in pd.unique(formats):
+        rows = np.flatnonzero(formats == fmt)
+        keys = str(fmt).split(":")
+        fields = pd.Series(samples[rows].ravel()).str.split(":", expand=True)
+        shape = (len(rows), samples.shape[1])
+        if "GT" in keys and keys.index("GT") < fields.shape[1]:
+            gt[rows] = genotype_codes(
+                fields[keys.index("GT")]).reshape(shape)
+        if "GQ" in keys and keys.index("GQ") < fields.shape[1]:
+            gq[rows] = genotype_quality(
+                fields[keys.index("GQ")]).reshape(shape)
+    return gt, gq
+
 
 class VariantData:
-    def __init__(self, filename):
-        reader = vcf.Reader(open(filename, "r"))
-        records = [r for r in reader]
+    """Genotypes of samples, read from a VCF file
 
-        self.samples = np.array(reader.samples)
+    Records are parsed in blocks of BLOCK_SIZE into genotype codes and
+    qualities. Calls with non-reference alleles and missing calls are
+    stored bit-packed along samples (gt_bits, missing_bits) and genotype
+    qualities as uint8 (gq), in arrays of variants x samples.
+    """
+    BLOCK_SIZE = 1000
+    # number of variants unpacked at once in get_data
+    UNPACK_SIZE = 8192
 
-        self.gq = np.array([[s.data.GQ for s in r.samples] for r in records],
-                           dtype="f")
-        self.gq = np.nan_to_num(self.gq)
+    def __init__(self, filename, region=None):
+        """
+        :param filename: VCF file, optionally gzipped
+        :param region: region (e.g. "chr17:7,500,000-7,600,000") or a list
+            of regions; only records overlapping them are read from a
+            bgzip-compressed file with a tabix index (filename.tbi)
+        """
+        start = time.perf_counter()
+        # with regions, only the header is read from the start of the file
+        with open_vcf(filename, parallel=region is None) as f:
+            self.samples = np.array(read_vcf_header(f))
+            if region is None:
+                self._read_records(f)
+        if region is not None:
+            if isinstance(region, str):
+                region = [region]
+            lines = read_regions(filename, [parse_region(r) for r in region])
+            with io.TextIOWrapper(io.BufferedReader(_ChunksFile(lines))) as f:
+                self._read_records(f)
+        self.elapsed = time.perf_counter() - start
+        self._variables = None
 
-        gt = np.array([[s.data.GT for s in r.samples] for r in records])
-        self.gt = gt != "0/0"
-        self.records = records
+    def _read_records(self, f):
+        n_samples = len(self.samples)
+        n_bytes = (n_samples + 7) // 8
+        capacity = self.BLOCK_SIZE
+        gt = np.empty((capacity, n_bytes), dtype=np.uint8)
+        missing = np.empty((capacity, n_bytes), dtype=np.uint8)
+        gq = np.empty((capacity, n_samples), dtype=np.uint8)
+        info = []
+        n = 0
+        try:
+            reader = pd.read_csv(
+                f, sep="\t", header=None, dtype=str, na_filter=False,
+                names=VCF_COLUMNS + list(self.samples),
+                quoting=csv.QUOTE_NONE, chunksize=self.BLOCK_SIZE)
+        except pd.errors.EmptyDataError:
+            reader = []
+        for block in reader:
+            if n + len(block) > capacity:
+                capacity = max(2 * capacity, n + len(block))
+                gt = _grow(gt, n, capacity)
+                missing = _grow(missing, n, capacity)
+                gq = _grow(gq, n, capacity)
+            samples = block.iloc[:, len(VCF_COLUMNS):].values
+            codes, gq[n:n + len(block)] = parse_samples(
+                block["FORMAT"].values, samples)
+            gt[n:n + len(block)] = np.packbits(codes > 0, axis=1)
+            missing[n:n + len(block)] = np.packbits(codes == MISSING, axis=1)
+            info.append(block[["CHROM", "POS", "REF", "ALT"]])
+            n += len(block)
 
-        self.variables = [
-            DiscreteVariable("%s-%s" % (r.CHROM, r.POS), values=["0", "1"])
-            for r in self.records
-        ]
+        self.gt_bits = gt[:n].copy() if n < capacity else gt
+        self.missing_bits = missing[:n].copy() if n < capacity else missing
+        self.gq = gq[:n].copy() if n < capacity else gq
+        # bits of samples (without the padding of the last byte)
+        self._sample_bits = np.packbits(np.ones(n_samples, dtype=bool))
+        info = pd.concat(info) if info else \
+            pd.DataFrame(columns=["CHROM", "POS", "REF", "ALT"])
+        self.chrom = info["CHROM"].values
+        self.pos = info["POS"].values.astype(int)
+        self.ref = info["REF"].values
+        self.alt = info["ALT"].values
 
-        for v, r in zip(self.variables, records):
-            v.attributes["CHROM"] = str(r.CHROM)
-            v.attributes["POS"] = str(r.POS)
-            v.attributes["REF"] = str(r.REF)
-            v.attributes["ALT"] = "".join(str(s) for s in r.ALT)
+    @property
+    def n_variants(self):
+        return len(self.gt_bits)
+
+    @property
+    def gt(self):
+        """Genotype codes: 1 for calls with non-reference alleles, 0 for
+        reference calls and MISSING for missing calls
+
+        :return: np.ndarray of int8 (variants x samples)
+        """
+        n = len(self.samples)
+        gt = np.unpackbits(self.gt_bits, axis=1, count=n).view(np.int8)
+        gt[np.unpackbits(self.missing_bits, axis=1, count=n) == 1] = MISSING
+        return gt
+
+    @property
+    def throughput(self):
+        """Number of variants read per second"""
+        return self.n_variants / self.elapsed if self.elapsed else np.inf
+
+    @property
+    def variables(self):
+        if self._variables is None:
+            self._variables = [self._variable(i)
+                               for i in range(self.n_variants)]
+        return self._variables
+
+    def _variable(self, i):
+        var = DiscreteVariable("%s-%s" % (self.chrom[i], self.pos[i]),
+                               values=["0", "1"])
+        var.attributes["CHROM"] = str(self.chrom[i])
+        var.attributes["POS"] = str(self.pos[i])
+        var.attributes["REF"] = str(self.ref[i])
+        var.attributes["ALT"] = str(self.alt[i]).replace(",", "")
+        return var
 
     def info(self):
         print("Samples: %d" % len(self.samples))
         unique_samples = set(s[:-2] for s in self.samples)
         print("Unique samples: %d" % len(unique_samples))
-        print("Variants: %d" % len(self.records))
+        print("Variants: %d (%.0f variants/s)" %
+              (self.n_variants, self.throughput))
 
     def get_data(self, quality=None, frequency=None):
         """Orange data table with genotypes above quality and frequency
-        threshold."""
+        threshold.
 
-        X = self.gt.astype(dtype="float", copy=True)
+        Filters are computed on packed genotypes. Table is sparse: calls
+        with non-reference alleles are 1, reference calls are (implicit)
+        zeros and missing or low-quality calls are missing values.
+        """
+        called = ~self.missing_bits & self._sample_bits
         if quality is not None:
-            X[self.gq < quality] = np.nan
-        selected = ~np.isnan(X).all(axis=1)
+            called &= ~np.packbits(self.gq < quality, axis=1)
+        variant = self.gt_bits & called
+        selected = called.any(axis=1)
         if frequency is not None:
-            selected &= np.nansum(X, axis=1) >= frequency
-        X = X[selected].T
+            selected &= POPCOUNT[variant].sum(axis=1) >= frequency
+        selected = np.flatnonzero(selected)
+        X = self._sparse_calls(variant[selected], ~called[selected])
 
-        variables = tuple(np.array(self.variables)[selected])
+        if self._variables is None:
+            variables = tuple(self._variable(i) for i in selected)
+        else:
+            variables = tuple(np.array(self._variables)[selected])
         metas = [StringVariable(s) for s in ["sample", "id"]]
-        M = np.empty((len(X), 2), dtype="object")
+        M = np.empty((X.shape[0], 2), dtype="object")
         M[:, 0] = self.samples
-        M[:, 1] = np.arange(1, len(X) + 1)
+        M[:, 1] = np.arange(1, X.shape[0] + 1)
         domain = Domain(variables, [], metas=metas)
-        data = Table(domain, X, Y=None, metas=M)
+        data = Table.from_numpy(domain, X, None, M)
 
         return data
 
+    def _sparse_calls(self, variant, uncalled):
+        """Samples x variants matrix with ones for set bits of variant
+        and nans for set bits of uncalled"""
+        n = len(self.samples)
+        rows, cols, values = [], [], []
+        for start in range(0, len(variant), self.UNPACK_SIZE):
+            end = start + self.UNPACK_SIZE
+            for bits, value in ((variant, 1.), (uncalled, np.nan)):
+                v, s = np.nonzero(
+                    np.unpackbits(bits[start:end], axis=1, count=n))
+                rows.append(s)
+                cols.append(v + start)
+                values.append(np.full(len(v), value))
+        if not rows:
+            return sp.csr_matrix((n, len(variant)))
+        return sp.csr_matrix(
+            (np.concatenate(values),
+             (np.concatenate(rows), np.concatenate(cols))),
+            shape=(n, len(variant)))
+
 if __name__ == "__main__":
     variants = VariantData("cells.vcf")
+    variants.info()
     data = variants.get_data(30, 30)
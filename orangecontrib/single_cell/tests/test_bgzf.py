@@ -0,0 +1,89 @@
+import io
+import os
+import gzip
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from orangecontrib.single_cell import bgzf
+
+
+class TestBgzf(unittest.TestCase):
+    def setUp(self):
+        rstate = np.random.RandomState(0)
+        self.data = "\n".join(
+            "\t".join(map(str, row))
+            for row in rstate.randint(0, 100, (2000, 30))).encode()
+        self.compressed = bgzf.compress(self.data, size=1000)
+        fd, self.file_name = tempfile.mkstemp(suffix=".gz")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.compressed)
+
+    def tearDown(self):
+        for name in (self.file_name, self.file_name + ".gzi"):
+            if os.path.exists(name):
+                os.remove(name)
+
+    def test_reader(self):
+        self.assertEqual(gzip.decompress(self.compressed), self.data)
+        self.assertTrue(bgzf.is_bgzf(self.file_name))
+
+        progress = []
+        with bgzf.BgzfReader(self.file_name, progress.append, n_jobs=2,
+                             batch_size=3000) as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 1)
+
+        with io.BufferedReader(bgzf.BlockReader(self.file_name)) as f:
+            self.assertEqual(f.read(1500), self.data[:1500])
+            self.assertEqual(f.read(), self.data[1500:])
+
+        with open(self.file_name, "wb") as f:
+            f.write(gzip.compress(self.data))
+        self.assertFalse(bgzf.is_bgzf(self.file_name))
+
+    def test_random_access(self):
+        blocks, _ = bgzf.split_blocks(self.compressed)
+        offsets = [b for b, _ in blocks]
+        with open(self.file_name + ".gzi", "wb") as f:
+            f.write(struct.pack("<Q", len(offsets) - 2))
+            for i, offset in enumerate(offsets[1:-1], start=1):
+                f.write(struct.pack("<QQ", offset, 1000 * i))
+        self.assertEqual(bgzf.uncompressed_size(self.file_name),
+                         len(self.data))
+
+        with open(self.file_name, "rb") as f:
+            offset = bgzf.find_block(f, offsets[3] - 5)
+            self.assertEqual(offset, offsets[3])
+            data, next_offset = bgzf.read_block(f, offset)
+            self.assertEqual(data, self.data[3000:4000])
+            self.assertEqual(next_offset, offsets[4])
+            self.assertEqual(
+                bgzf.read_chunk(f, offsets[1] << 16 | 500,
+                                offsets[3] << 16 | 20),
+                self.data[1500:3020])
+
+    def test_corrupted_block(self):
+        blocks, _ = bgzf.split_blocks(self.compressed)
+        begin, end = blocks[2]
+        block = self.compressed[begin:end]
+        self.assertEqual(bgzf.decompress_block(block), self.data[2000:3000])
+
+        crc = struct.unpack_from("<I", block, len(block) - 8)[0]
+        bad_crc = block[:-8] + struct.pack("<I", crc ^ 1) + block[-4:]
+        self.assertRaises(ValueError, bgzf.decompress_block, bad_crc)
+        bad_size = block[:-4] + struct.pack("<I", 999)
+        self.assertRaises(ValueError, bgzf.decompress_block, bad_size)
+
+        with open(self.file_name, "wb") as f:
+            f.write(self.compressed[:begin] + bad_crc
+                    + self.compressed[end:])
+        with bgzf.BgzfReader(self.file_name, n_jobs=2) as f:
+            self.assertRaises(ValueError, f.read)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from orangecontrib.single_cell.download import download, read_journal
+
+CONTENT = bytes(range(256)) * 40
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT, with range requests unless ranges is False and with
+    its length unless length is False; ranges starting at offsets in fail
+    are answered with an error and ranges are sent in two halves, delay
+    seconds apart"""
+    ranges = True
+    length = True
+    etag = '"v1"'
+    content_md5 = None
+    delay = 0
+    fail = set()
+    requested = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_content_headers(self, length):
+        if self.length:
+            self.send_header("Content-Length", str(length))
+        self.send_header("ETag", self.etag)
+        if self.content_md5 is not None:
+            self.send_header("Content-MD5", self.content_md5)
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_content_headers(len(CONTENT))
+
+    def do_GET(self):
+        match = re.match(r"bytes=(\d+)-(\d+)",
+                         self.headers.get("Range") or "")
+        if not self.ranges or match is None:
+            self.send_response(200)
+            self.send_content_headers(len(CONTENT))
+            self.wfile.write(CONTENT)
+            return
+        begin, end = int(match.group(1)), int(match.group(2)) + 1
+        self.requested.append(begin)
+        if begin in self.fail:
+            self.send_error(503)
+            return
+        self.send_response(206)
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(
+            begin, end - 1, len(CONTENT)))
+        self.send_content_headers(end - begin)
+        middle = (begin + end) // 2
+        self.wfile.write(CONTENT[begin:middle])
+        self.wfile.flush()
+        time.sleep(self.delay)
+        self.wfile.write(CONTENT[middle:end])
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        RangeHandler.ranges = True
+        RangeHandler.length = True
+        RangeHandler.etag = '"v1"'
+        RangeHandler.content_md5 = None
+        RangeHandler.delay = 0
+        RangeHandler.fail = set()
+        RangeHandler.requested = []
+        self.server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{}/data.pickle".format(
+            self.server.server_port)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.tmp_dir, "data.pickle")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self):
+        with open(self.file_name, "rb") as f:
+            return f.read()
+
+    def test_resume(self):
+        # a single job, so no requests are left running after the failure
+        RangeHandler.fail = {3000}
+        with self.assertRaises(OSError):
+            download(self.url, self.file_name, chunk_size=1000, n_jobs=1)
+        journal = read_journal(self.file_name + ".part.json")
+        self.assertNotIn("3", journal["chunks"])
+        self.assertFalse(os.path.exists(self.file_name))
+
+        # corrupt a downloaded chunk; it is downloaded again
+        with open(self.file_name + ".part", "r+b") as f:
+            f.seek(1000)
+            f.write(b"x")
+        RangeHandler.fail = set()
+        RangeHandler.requested = []
+        progress = []
+        download(self.url, self.file_name, chunk_size=1000, n_jobs=3,
+                 callback=progress.append)
+        self.assertEqual(self.read(), CONTENT)
+        self.assertIn(1000, RangeHandler.requested)
+        self.assertIn(3000, RangeHandler.requested)
+        self.assertNotIn(0, RangeHandler.requested)
+        self.assertNotIn(2000, RangeHandler.requested)
+        self.assertEqual(progress[-1], 1)
+        self.assertFalse(os.path.exists(self.file_name + ".part"))
+        self.assertFalse(os.path.exists(self.file_name + ".part.json"))
+
+    def test_without_ranges(self):
+        RangeHandler.ranges = False
+        download(self.url, self.file_name, chunk_size=1000)
+        self.assertEqual(self.read(), CONTENT)
+        self.assertEqual(RangeHandler.requested, [])
+
+    def test_unknown_size(self):
+        RangeHandler.length = False
+        progress = []
+        download(self.url, self.file_name, callback=progress.append)
+        self.assertEqual(self.read(), CONTENT)
+        self.assertTrue(progress)
+        self.assertTrue(all(p is None for p in progress))
+
+        def interrupt(_):
+            raise KeyboardInterrupt()
+        os.remove(self.file_name)
+        with self.assertRaises(KeyboardInterrupt):
+            download(self.url, self.file_name, callback=interrupt)
+        self.assertFalse(os.path.exists(self.file_name))
+
+    def test_checksum(self):
+        md5 = hashlib.md5(CONTENT)
+        RangeHandler.content_md5 = base64.b64encode(md5.digest()).decode()
+        download(self.url, self.file_name, chunk_size=1000)
+        self.assertEqual(self.read(), CONTENT)
+
+        os.remove(self.file_name)
+        RangeHandler.content_md5 = None
+        RangeHandler.etag = '"{}"'.format(md5.hexdigest())
+        download(self.url, self.file_name, chunk_size=1000)
+        self.assertEqual(self.read(), CONTENT)
+
+        os.remove(self.file_name)
+        RangeHandler.etag = '"v1"'
+        with self.assertRaises(OSError):
+            download(self.url, self.file_name, chunk_size=1000,
+                     md5=hashlib.md5(b"other").hexdigest())
+        self.assertFalse(os.path.exists(self.file_name))
+        self.assertFalse(os.path.exists(self.file_name + ".part"))
+        self.assertFalse(os.path.exists(self.file_name + ".part.json"))
+
+    def test_cancel_within_chunk(self):
+        RangeHandler.delay = 2
+
+        def interrupt(_):
+            raise KeyboardInterrupt()
+        start = time.time()
+        with self.assertRaises(KeyboardInterrupt):
+            download(self.url, self.file_name, chunk_size=len(CONTENT),
+                     callback=interrupt)
+        self.assertLess(time.time() - start, 1)
+        self.assertFalse(os.path.exists(self.file_name))
+
+
+if __name__ == "__main__":
+    unittest.main()
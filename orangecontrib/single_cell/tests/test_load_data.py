@@ -1,12 +1,44 @@
+import io
 import os
+import gzip
+import pickle
+import queue
+import shutil
+import tempfile
+import threading
 import unittest
+from unittest.mock import patch
 
 import numpy as np
 import numpy.testing as npt
 import pandas as pd
+import scipy.io
+import scipy.sparse as sp
 
+from Orange.data import (
+    ContinuousVariable, DiscreteVariable, Domain, StringVariable, Table
+)
+from Orange.data.io import FileFormat
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from orangecontrib.single_cell import bgzf
+from orangecontrib.single_cell.tests.utils import (  # pylint: disable=unused-import
+    setUpModule, tearDownModule
+)
 from orangecontrib.single_cell.widgets.load_data import (
-    MtxLoader, CountLoader, Loader, PickleLoader, get_data_loader, Concatenate
+    MtxLoader, CountLoader, Loader, PickleLoader, get_data_loader, Concatenate,
+    read_mtx, DataCache, sample_mask, H5Loader, AnnDataLoader, LoomLoader,
+    read_transposed, ParquetLoader, write_parquet, NpzLoader, write_npz,
+    load_to_file, table_from_file, read_head
 )
 
 
@@ -61,6 +93,20 @@ class TestLoadData(unittest.TestCase):
         self.assertEqual(loader.n_cols, None)
         self.assertEqual(loader.sparsity, None)
 
+    def test_load_data_pickle_callback(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/data.pkl")
+        finished = []
+        data = PickleLoader(file_name)(callback=finished.append)
+        self.assertIsNotNone(data)
+        self.assertTrue(finished)
+        self.assertEqual(finished[-1], 1)
+
+        def stop(_):
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            PickleLoader(file_name)(callback=stop)
+
     def test_file_summary_gz(self):
         file_name = os.path.join(os.path.dirname(__file__),
                                  "data/data.txt.gz")
@@ -70,6 +116,99 @@ class TestLoadData(unittest.TestCase):
         self.assertEqual(loader.n_cols, 15)
         self.assertEqual(round(loader.sparsity, 2), 0.86)
 
+    def test_file_summary_approximate(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(tmp_dir, "data.tab")
+            X = np.random.RandomState(0).randint(0, 3, (5000, 20))
+            df = pd.DataFrame(X, columns=["c{}".format(i) for i in range(20)])
+            df.to_csv(file_name, sep="\t")
+            with patch.object(Loader, "PROBE_BLOCK_SIZE", 2 ** 10):
+                loader = Loader(file_name)
+            self.assertTrue(loader.approximate)
+            self.assertEqual(loader.n_cols, 21)
+            self.assertAlmostEqual(loader.n_rows, 5000, delta=250)
+            self.assertAlmostEqual(loader.sparsity, 1 / 3, delta=0.05)
+
+            loader.count_rows().result(timeout=10)
+            self.assertFalse(loader.approximate)
+            self.assertEqual(loader.n_rows, 5000)
+
+            copied = pickle.loads(pickle.dumps(loader))
+            self.assertFalse(copied.approximate)
+            self.assertEqual(copied.n_rows, 5000)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_sample_rows_approximate(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(tmp_dir, "data.tab")
+            X = np.random.RandomState(0).randint(0, 3, (5000, 20))
+            df = pd.DataFrame(X, columns=["c{}".format(i) for i in range(20)])
+            df.to_csv(file_name, sep="\t")
+            expected = sample_mask(5001, 30, np.random.RandomState(0x667))
+            for transposed, sparse in ((False, False), (False, True),
+                                       (True, False)):
+                with patch.object(Loader, "PROBE_BLOCK_SIZE", 2 ** 10):
+                    loader = Loader(file_name)
+                self.assertTrue(loader.approximate)
+                loader.header_rows_count = 1
+                loader.header_cols_count = 1
+                loader.transposed = transposed
+                loader.sparse = sparse
+                loader.use_cache = False
+                if transposed:
+                    loader.sample_cols_enabled = True
+                    loader.sample_cols_p = 30
+                else:
+                    loader.sample_rows_enabled = True
+                    loader.sample_rows_p = 30
+                with patch("orangecontrib.single_cell.widgets.load_data"
+                           ".count_lines") as count_lines, \
+                        patch("pandas.read_csv",
+                              wraps=pd.read_csv) as read_csv:
+                    data = loader()
+                count_lines.assert_not_called()
+                # rows are not skipped by a callable called for each line
+                self.assertFalse(any(
+                    callable(call[1].get("skiprows"))
+                    for call in read_csv.call_args_list))
+                self.assertFalse(loader.approximate)
+                self.assertEqual(loader.n_rows, 5000)
+                mask = loader._use_cols_mask if transposed \
+                    else loader._use_rows_mask
+                npt.assert_array_equal(mask, expected)
+                values = data.X.toarray() if sp.issparse(data.X) else data.X
+                values = values.T if transposed else values
+                npt.assert_array_equal(values, X[expected[1:]])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_file_summary_wide_rows(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            X = np.random.RandomState(0).randint(0, 3, (300, 600))
+            X[:, ::2] = 0
+            df = pd.DataFrame(X, columns=["c{}".format(i) for i in range(600)])
+            file_name = os.path.join(tmp_dir, "data.tab")
+            df.to_csv(file_name, sep="\t")
+            with open(file_name, "rb") as f, \
+                    gzip.open(file_name + ".gz", "wb") as out:
+                out.write(f.read())
+            # lines are longer than the blocks
+            with patch.object(Loader, "PROBE_BLOCK_SIZE", 2 ** 9), \
+                    patch.object(Loader, "PROBE_BLOCKS", 4):
+                for name in (file_name, file_name + ".gz"):
+                    loader = Loader(name)
+                    self.assertTrue(loader.approximate)
+                    self.assertEqual(loader.n_cols, 601)
+                    self.assertAlmostEqual(loader.n_rows, 300, delta=30)
+                    self.assertAlmostEqual(loader.sparsity, 2 / 3,
+                                           delta=0.1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_load_data_mtx(self):
         file_name = os.path.join(os.path.dirname(__file__),
                                  "data/10x/mm10/matrix.mtx")
@@ -81,8 +220,510 @@ class TestLoadData(unittest.TestCase):
             if i == 0:
                 continue
             array[series.iloc[1] - 1, series.iloc[0] - 1] = series.iloc[2]
+        self.assertTrue(sp.isspmatrix_csr(X))
+        npt.assert_array_equal(X.toarray(), array)
+
+        loader.sparse = False
+        attrs, X, meta_df, meta_df_index = loader._load_data()
+        self.assertIsInstance(X, np.ndarray)
         npt.assert_array_equal(X, array)
 
+    def test_read_mtx(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/10x/mm10/matrix.mtx")
+        expected = scipy.io.mmread(file_name).toarray()
+        X = read_mtx(file_name, n_jobs=2, block_size=8)
+        self.assertTrue(sp.isspmatrix_csr(X))
+        npt.assert_array_equal(X.toarray(), expected)
+        X = read_mtx(file_name, transpose=True)
+        npt.assert_array_equal(X.toarray(), expected.T)
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gz_name = os.path.join(tmp_dir, "matrix.mtx.gz")
+            with open(file_name, "rb") as f_in, \
+                    gzip.open(gz_name, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            npt.assert_array_equal(read_mtx(gz_name).toarray(), expected)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_read_transposed(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/lib.cell.count")
+        df = pd.read_csv(file_name, sep="\t", index_col=0)
+        for sparse in (True, False):
+            with open(file_name, "rb") as f:
+                X, genes, cells = read_transposed(f, "\t", sparse=sparse)
+            self.assertEqual(sp.isspmatrix_csr(X), sparse)
+            npt.assert_array_equal(X.toarray() if sparse else X, df.values.T)
+            npt.assert_array_equal(genes, df.index)
+            npt.assert_array_equal(cells, df.columns)
+
+        rows_mask = np.array([True, False, True] * 40)
+        with open(file_name, "rb") as f:
+            X, genes, cells = read_transposed(
+                f, "\t", rows_mask, np.array([0, 2, 5]))
+        df = df.iloc[rows_mask[1:len(df) + 1], [1, 4]]
+        npt.assert_array_equal(X.toarray(), df.values.T)
+        npt.assert_array_equal(genes, df.index)
+        npt.assert_array_equal(cells, df.columns)
+
+        text = 'gene,c1,c2,c3\n"A,1",1,NA,2\nB,,3,0\n"C",0,0,1'
+        for sparse in (True, False):
+            X, genes, cells = read_transposed(
+                io.BytesIO(text.encode()), ",", sparse=sparse)
+            X = X.toarray() if sparse else X
+            npt.assert_array_equal(X, [[1, np.nan, 0], [np.nan, 3, 0],
+                                       [2, 0, 1]])
+            self.assertEqual(list(genes), ["A,1", "B", "C"])
+            self.assertEqual(list(cells), ["c1", "c2", "c3"])
+
+    def test_load_data_bgzf(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/lib.cell.count")
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            compressed = os.path.join(tmp_dir, "lib.cell.count.gz")
+            with open(file_name, "rb") as f, open(compressed, "wb") as out:
+                out.write(bgzf.compress(f.read(), size=100))
+            loader = get_data_loader(compressed)
+            loader.use_cache = loader.sparse = False
+            self.assertEqual(loader.n_rows, 10)
+            data = loader()
+            plain = CountLoader(file_name)
+            plain.use_cache = plain.sparse = False
+            npt.assert_array_equal(data.X, plain().X)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_load_data_progress(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/data.txt.gz")
+        loader = Loader(file_name)
+        loader.header_rows_count = 1
+        loader.header_cols_count = 1
+        loader.transposed = False
+        loader.use_cache = False
+        progress = []
+        data = loader(callback=progress.append)
+        self.assertIsNotNone(data)
+        self.assertEqual(progress[-1], 1)
+        self.assertEqual(progress, sorted(progress))
+
+        def interrupt(_):
+            raise KeyboardInterrupt()
+        self.assertRaises(KeyboardInterrupt, loader, callback=interrupt)
+
+    def test_load_to_file(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/data.txt.gz")
+        loader = Loader(file_name)
+        loader.header_rows_count = 1
+        loader.header_cols_count = 1
+        loader.transposed = False
+        loader.use_cache = False
+        expected = loader()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            stop, progress = threading.Event(), queue.Queue()
+            parts, errors = load_to_file(loader, tmp_dir, stop, progress, 3)
+            self.assertFalse(any(errors.values()))
+            data = table_from_file(*parts)
+            npt.assert_array_equal(data.X.toarray(), expected.X.toarray())
+            reported = []
+            while not progress.empty():
+                reported.append(progress.get())
+            self.assertTrue(reported)
+            self.assertEqual({key for key, _ in reported}, {3})
+            self.assertEqual(reported[-1][1], 1)
+
+            stop.set()
+            self.assertRaises(KeyboardInterrupt, load_to_file, loader,
+                              tmp_dir, stop, progress, 3)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_preview(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/data.txt.gz")
+        preview = Loader(file_name).preview(n_rows=5, n_cols=4)
+        self.assertEqual(preview.header_rows_count, 1)
+        self.assertEqual(preview.header_cols_count, 1)
+        self.assertIsNone(preview.transposed)
+        self.assertEqual(preview.table.X.shape, (4, 3))
+        self.assertEqual(preview.table.domain.attributes[0].name,
+                         "A1-P1-DG_S156_L001_R1_001")
+        self.assertEqual(preview.table.metas[0, 0], "Itm2a")
+
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/lib.cell.count")
+        loader = Loader(file_name)
+        with patch("orangecontrib.single_cell.widgets.load_data.read_head",
+                   wraps=read_head) as head:
+            preview = loader.preview()
+            self.assertTrue(preview.transposed)
+            loader.transposed = False
+            self.assertEqual(len(loader.preview().table), 10)
+            head.assert_called_once()
+
+    def test_load_data_sparse(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/DATA_MATRIX_LOG_TPM.txt")
+        loader = Loader(file_name)
+        loader.header_rows_count = 1
+        loader.header_cols_count = 1
+        loader.transposed = False
+        loader.use_cache = False
+        # a few lines per block
+        loader.CHUNK_BYTES = 3 * 8 * loader.n_cols
+        self.assertEqual(loader._chunk_rows(loader.n_cols), 3)
+        self.assertTrue(loader.is_sparse())
+        sparse_data = loader()
+        self.assertTrue(sp.issparse(sparse_data.X))
+
+        loader.sparse = False
+        dense_data = loader()
+        self.assertFalse(sp.issparse(dense_data.X))
+        npt.assert_array_equal(sparse_data.X.toarray(), dense_data.X)
+        npt.assert_array_equal(sparse_data.metas, dense_data.metas)
+        self.assertEqual(sparse_data.domain, dense_data.domain)
+
+    def test_load_data_precision(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/10x/mm10/matrix.mtx")
+        loader = MtxLoader(file_name)
+        loader.use_cache = False
+        data = loader()
+        loader.precision = Loader.INTEGER
+        # negative values fall back to single precision
+        counts = loader()
+        self.assertEqual(counts.X.dtype, np.float32)
+        npt.assert_array_equal(counts.X.toarray(), data.X.toarray())
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(tmp_dir, "matrix.mtx")
+            for max_count, dtype in ((65535, np.uint16),
+                                     (70000, np.uint32)):
+                X = np.array([[0, 1, 2], [3, 0, max_count]])
+                scipy.io.mmwrite(file_name, sp.coo_matrix(X),
+                                 field="integer")
+                loader = MtxLoader(file_name)
+                loader.use_cache = False
+                loader.sparse = True
+                loader.precision = Loader.INTEGER
+                counts = loader()
+                self.assertEqual(counts.X.dtype, dtype)
+                npt.assert_array_equal(counts.X.toarray(), X.T)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/DATA_MATRIX_LOG_TPM.txt")
+        loader = Loader(file_name)
+        loader.use_cache = False
+        loader.header_rows_count = 1
+        loader.header_cols_count = 1
+        loader.transposed = False
+        loader.precision = Loader.INTEGER
+        # non-integer values fall back to single precision
+        self.assertEqual(loader().X.dtype, np.float32)
+        loader.precision = Loader.FLOAT32
+        self.assertEqual(loader().X.dtype, np.float32)
+
+        loader.sparse = False
+        self.assertEqual(loader().X.dtype, np.float64)
+
+    def test_sample_mask(self):
+        mask = sample_mask(1000, 30, np.random.RandomState(0))
+        rstate = np.random.RandomState(0)
+        expected = [i < 4 or rstate.uniform(0, 100) <= 30
+                    for i in range(1000)]
+        npt.assert_array_equal(mask, expected)
+
+    @unittest.skipIf(h5py is None, "h5py is not installed")
+    def test_load_data_h5(self):
+        genes_cells = np.random.RandomState(0).poisson(
+            0.3, (20, 30)).astype(float)
+        csc = sp.csc_matrix(genes_cells)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(tmp_dir, "filtered_feature_bc_matrix.h5")
+            with h5py.File(file_name, "w") as f:
+                group = f.create_group("matrix")
+                group["data"] = csc.data
+                group["indices"] = csc.indices
+                group["indptr"] = csc.indptr
+                group["shape"] = csc.shape
+                group["barcodes"] = [
+                    "BC{}-1".format(i).encode() for i in range(30)]
+                features = group.create_group("features")
+                features["id"] = ["ENSG{}".format(i).encode()
+                                  for i in range(20)]
+                features["name"] = ["G{}".format(i).encode()
+                                    for i in range(20)]
+
+            loader = get_data_loader(file_name)
+            self.assertIsInstance(loader, H5Loader)
+            self.assertEqual(loader.n_genes, 20)
+            self.assertEqual(loader.n_cells, 30)
+            data = loader()
+            npt.assert_array_equal(data.X.toarray(), genes_cells.T)
+            self.assertEqual(data.domain.attributes[1].name, "ENSG1")
+            self.assertEqual(data.domain.attributes[1].attributes["Gene"],
+                             "G1")
+            self.assertEqual(data.metas[2, 0], "BC2-1")
+
+            loader.sample_rows_enabled = True
+            loader.sample_rows_p = 50
+            loader.sample_cols_enabled = True
+            loader.sample_cols_p = 50
+            sampled = loader()
+            cells = np.flatnonzero(loader._use_rows_mask)
+            genes = np.flatnonzero(loader._use_cols_mask)
+            self.assertLess(len(sampled), 30)
+            npt.assert_array_equal(sampled.X.toarray(),
+                                   genes_cells[np.ix_(genes, cells)].T)
+            npt.assert_array_equal(
+                sampled.metas[:, 0], ["BC{}-1".format(i) for i in cells])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipIf(h5py is None, "h5py is not installed")
+    def test_load_data_h5ad_loom(self):
+        cells_genes = np.random.RandomState(0).poisson(
+            0.3, (30, 20)).astype(float)
+        csr = sp.csr_matrix(cells_genes)
+        cell_names = np.array(["c{}".format(i).encode() for i in range(30)])
+        gene_names = np.array(["g{}".format(i).encode() for i in range(20)])
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            h5ad_name = os.path.join(tmp_dir, "data.h5ad")
+            with h5py.File(h5ad_name, "w") as f:
+                X = f.create_group("X")
+                X.attrs["encoding-type"] = "csr_matrix"
+                X.attrs["shape"] = csr.shape
+                X["data"], X["indices"], X["indptr"] = \
+                    csr.data, csr.indices, csr.indptr
+                obs = f.create_group("obs")
+                obs.attrs["_index"] = "_index"
+                obs["_index"] = cell_names
+                obs["n_counts"] = cells_genes.sum(axis=1)
+                cluster = obs.create_group("cluster")
+                cluster["codes"] = np.arange(30) % 2
+                cluster["categories"] = [b"a", b"b"]
+                var = f.create_group("var")
+                var.attrs["_index"] = "_index"
+                var["_index"] = gene_names
+
+            loom_name = os.path.join(tmp_dir, "data.loom")
+            with h5py.File(loom_name, "w") as f:
+                f["matrix"] = cells_genes.T
+                f.create_group("row_attrs")["Gene"] = gene_names
+                f.create_group("col_attrs")["CellID"] = cell_names
+
+            for file_name, cls in ((h5ad_name, AnnDataLoader),
+                                   (loom_name, LoomLoader)):
+                loader = get_data_loader(file_name)
+                self.assertIsInstance(loader, cls)
+                self.assertEqual(loader.n_cells, 30)
+                self.assertEqual(loader.n_genes, 20)
+                data = loader()
+                X = data.X.toarray() if sp.issparse(data.X) else data.X
+                npt.assert_array_equal(X, cells_genes)
+                self.assertEqual(data.domain.attributes[3].name, "g3")
+                self.assertEqual(data.metas[5, 0], "c5")
+
+                loader.sample_rows_enabled = True
+                loader.sample_rows_p = 50
+                loader.sample_cols_enabled = True
+                loader.sample_cols_p = 50
+                sampled = loader()
+                cells = np.flatnonzero(loader._use_rows_mask)
+                genes = np.flatnonzero(loader._use_cols_mask)
+                X = sampled.X.toarray() if sp.issparse(sampled.X) \
+                    else sampled.X
+                npt.assert_array_equal(X, cells_genes[np.ix_(cells, genes)])
+
+            data = AnnDataLoader(h5ad_name)()
+            cluster = data.domain["cluster"]
+            self.assertEqual(cluster.values, ["a", "b"])
+            npt.assert_array_equal(
+                data.get_column_view(cluster)[0].astype(float),
+                np.arange(30) % 2)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_load_data_parquet(self):
+        cells_genes = np.random.RandomState(0).poisson(
+            0.3, (30, 20)).astype(float)
+        domain = Domain(
+            [ContinuousVariable("g{}".format(i)) for i in range(20)],
+            metas=[StringVariable("cell"),
+                   DiscreteVariable("cluster", values=["a", "b"])])
+        M = np.array([["c{}".format(i), i % 2] for i in range(30)],
+                     dtype=object)
+        table = Table.from_numpy(domain, sp.csr_matrix(cells_genes), None, M)
+        table.domain.attributes[3].attributes["Gene"] = "G3"
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(tmp_dir, "data.parquet")
+            write_parquet(file_name, table, row_group_size=8)
+            loader = get_data_loader(file_name)
+            self.assertIsInstance(loader, ParquetLoader)
+            self.assertEqual(loader.n_cells, 30)
+            self.assertEqual(loader.n_genes, 20)
+            data = loader()
+            npt.assert_array_equal(data.X, cells_genes)
+            self.assertEqual(data.domain.attributes[3].attributes["Gene"],
+                             "G3")
+            self.assertEqual(data.metas[5, 0], "c5")
+
+            loader.sparse = True
+            sparse_data = loader()
+            self.assertTrue(sp.issparse(sparse_data.X))
+            npt.assert_array_equal(sparse_data.X.toarray(), cells_genes)
+            npt.assert_array_equal(sparse_data.metas, data.metas)
+            loader.sparse = None
+
+            self.assertEqual(data.domain["cluster"].values, ["a", "b"])
+            npt.assert_array_equal(data.metas[:, 1].astype(float),
+                                   np.arange(30) % 2)
+
+            loader.sample_rows_enabled = True
+            loader.sample_rows_p = 20
+            loader.sample_cols_enabled = True
+            loader.sample_cols_p = 50
+            sampled = loader()
+            cells = np.flatnonzero(loader._use_rows_mask)
+            genes = np.flatnonzero(loader._use_cols_mask)
+            npt.assert_array_equal(sampled.X,
+                                   cells_genes[np.ix_(cells, genes)])
+            npt.assert_array_equal(sampled.metas[:, 0],
+                                   ["c{}".format(i) for i in cells])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_file_formats(self):
+        readers = FileFormat.readers
+        self.assertEqual(".parquet" in readers, pyarrow is not None)
+        self.assertNotIn(".npz", readers)
+
+    def test_load_data_npz(self):
+        cells_genes = np.random.RandomState(0).poisson(
+            0.3, (30, 20)).astype(float)
+        domain = Domain(
+            [ContinuousVariable("g{}".format(i)) for i in range(20)],
+            DiscreteVariable("cluster", values=["a", "b"]),
+            [StringVariable("cell")])
+        M = np.array([["c{}".format(i)] for i in range(30)], dtype=object)
+        for X in (cells_genes, sp.csr_matrix(cells_genes)):
+            table = Table.from_numpy(domain, X, np.arange(30) % 2, M)
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                file_name = os.path.join(tmp_dir, "data.npz")
+                write_npz(file_name, table)
+                loader = get_data_loader(file_name)
+                self.assertIsInstance(loader, NpzLoader)
+                self.assertEqual(loader.n_cells, 30)
+                self.assertEqual(loader.n_genes, 20)
+                loader.memory_map = True
+                data = loader()
+                self.assertEqual(sp.issparse(data.X), sp.issparse(X))
+                X_ = data.X.toarray() if sp.issparse(data.X) else data.X
+                npt.assert_array_equal(X_, cells_genes)
+                npt.assert_array_equal(data.Y, np.arange(30) % 2)
+                self.assertEqual(data.metas[5, 0], "c5")
+
+                loader.sample_rows_enabled = True
+                loader.sample_rows_p = 50
+                loader.sample_cols_enabled = True
+                loader.sample_cols_p = 50
+                sampled = loader()
+                cells = np.flatnonzero(loader._use_rows_mask)
+                genes = np.flatnonzero(loader._use_cols_mask)
+                X_ = sampled.X.toarray() if sp.issparse(sampled.X) \
+                    else sampled.X
+                npt.assert_array_equal(X_, cells_genes[np.ix_(cells, genes)])
+                npt.assert_array_equal(sampled.metas[:, 0],
+                                       ["c{}".format(i) for i in cells])
+
+                loader.sparse = not sp.issparse(X)
+                converted = loader()
+                self.assertEqual(sp.issparse(converted.X), loader.sparse)
+                del data, sampled, converted
+            finally:
+                shutil.rmtree(tmp_dir)
+
+        # a dense sparse matrix stays sparse unless requested otherwise
+        table = Table.from_numpy(domain, sp.csr_matrix(cells_genes + 1),
+                                 np.arange(30) % 2, M)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(tmp_dir, "data.npz")
+            write_npz(file_name, table)
+            loader = NpzLoader(file_name)
+            self.assertFalse(loader.is_sparse())
+            self.assertTrue(sp.issparse(loader().X))
+
+            # precision is applied before the table is built
+            loader.precision = Loader.FLOAT32
+            with patch("orangecontrib.single_cell.widgets.load_data."
+                       "Table.from_numpy", wraps=Table.from_numpy) as fn:
+                data = loader()
+            self.assertEqual(fn.call_args[0][1].dtype, np.float32)
+            self.assertEqual(data.X.dtype, np.float32)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_annotations_join(self):
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(tmp_dir, "lib.cell.count")
+            shutil.copy(os.path.join(data_dir, "lib.cell.count"), file_name)
+            meta = pd.read_csv(os.path.join(data_dir, "lib.cell.meta"),
+                               sep="\t")
+            # annotations in reversed order with an additional cell
+            meta = pd.concat(
+                [meta, meta.iloc[:1].assign(**{"cell id": "c99"})])
+            meta.iloc[::-1].to_csv(os.path.join(tmp_dir, "lib.cell.meta"),
+                                   sep="\t", index=False)
+
+            loader = CountLoader(file_name)
+            loader.use_cache = False
+            data = loader()
+            self.assertEqual(loader.errors["row_annot_mismatch"], ())
+            self.assertEqual(len(data), 10)
+            column = data.domain["cell id"]
+            npt.assert_array_equal(data.get_column_view(column)[0],
+                                   ["c{}".format(i) for i in range(10)])
+            column = data.domain["barcode"]
+            npt.assert_array_equal(data.get_column_view(column)[0],
+                                   meta["barcode"].values[:10])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_compact_metas(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/lib.cell.count")
+        loader = CountLoader(file_name)
+        loader.use_cache = False
+        data = loader()
+        loader.compact_metas = True
+        compact = loader()
+        self.assertEqual([var.name for var in data.domain.metas],
+                         [var.name for var in compact.domain.metas])
+        self.assertTrue(compact.domain["machine id"].is_discrete)
+        self.assertTrue(compact.domain["cell id"].is_string)
+        for var in data.domain.metas:
+            npt.assert_array_equal(
+                [str(v) for v in data.get_column_view(var.name)[0]],
+                [compact.domain[var.name].str_val(v)
+                 for v in compact.get_column_view(var.name)[0]])
+
     def test_n_genes_n_cells(self):
         file_name = os.path.join(os.path.dirname(__file__),
                                  "data/10x/hg19/matrix.mtx")
@@ -105,6 +746,175 @@ class TestLoadData(unittest.TestCase):
         self.assertIsInstance(copied, Loader)
         self.assertTrue(copied.sample_rows_enabled)
 
+    def test_unpickle_old_loader(self):
+        loader = MtxLoader(os.path.join(os.path.dirname(__file__),
+                                        "data/10x/hg19/matrix.mtx"))
+        # the state of a loader pickled before attributes were added
+        state = loader.__getstate__()
+        state["n_rows"] = state.pop("_n_rows")
+        for name in ("sparse", "use_cache", "memory_map", "precision",
+                     "compact_metas", "_preview_head", "_approximate",
+                     "_n_rows_future"):
+            del state[name]
+        unpickled = MtxLoader.__new__(MtxLoader)
+        unpickled.__setstate__(state)
+        self.assertIsNone(unpickled.sparse)
+        self.assertTrue(unpickled.use_cache)
+        self.assertIsNone(unpickled.memory_map)
+        self.assertEqual(unpickled.is_sparse(), loader.is_sparse())
+        self.assertEqual(unpickled.is_memory_mapped(),
+                         loader.is_memory_mapped())
+        copied = unpickled.copy()
+        self.assertEqual(copied.n_rows, loader.n_rows)
+        self.assertIsNotNone(copied())
+
+
+class TestDataCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = DataCache(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_loader_cache(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/lib.cell.count")
+        with patch("orangecontrib.single_cell.widgets.load_data.data_cache",
+                   return_value=self.cache):
+            loader = CountLoader(file_name)
+            data = loader()
+            self.assertEqual(len(os.listdir(self.tmp_dir)), 1)
+            with patch.object(CountLoader, "_load_data",
+                              side_effect=AssertionError):
+                cached = loader()
+            self.assertIsNotNone(cached)
+
+            loader.sample_rows_enabled = True
+            loader.sample_rows_p = 50
+            loader()
+            self.assertEqual(len(os.listdir(self.tmp_dir)), 2)
+
+        self.assertEqual(cached.domain, data.domain)
+        npt.assert_array_equal(cached.X.toarray(), data.X.toarray())
+        npt.assert_array_equal(cached.metas, data.metas)
+
+    def test_loader_cache_evicts(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/lib.cell.count")
+
+        def entry_sizes():
+            return [sum(os.path.getsize(os.path.join(path, f))
+                        for f in os.listdir(path))
+                    for path in (os.path.join(self.tmp_dir, name)
+                                 for name in os.listdir(self.tmp_dir))]
+
+        with patch("orangecontrib.single_cell.widgets.load_data.data_cache",
+                   return_value=self.cache):
+            full = CountLoader(file_name)
+            full()
+            # room for one entry, but not for two
+            self.cache.max_size = 1.5 * sum(entry_sizes())
+
+            sampled = CountLoader(file_name)
+            sampled.sample_rows_enabled = True
+            sampled.sample_rows_p = 50
+            sampled()
+            # the least recently used entry has been removed
+            self.assertEqual(len(entry_sizes()), 1)
+            self.assertLessEqual(sum(entry_sizes()), self.cache.max_size)
+            with patch.object(CountLoader, "_load_data",
+                              side_effect=AssertionError):
+                self.assertIsNotNone(sampled())
+            with patch.object(CountLoader, "_load_data",
+                              wraps=full._load_data) as load:
+                full()
+            load.assert_called_once()
+
+    def test_memory_map(self):
+        X = np.arange(12, dtype=float).reshape(3, 4)
+        self.cache.put("dense", X, {})
+        mapped, _ = self.cache.get("dense", mmap_mode="r")
+        self.assertIsInstance(mapped, np.memmap)
+        npt.assert_array_equal(mapped, X)
+
+        self.cache.put("sparse", sp.csr_matrix(X), {})
+        mapped, _ = self.cache.get("sparse", mmap_mode="r")
+        self.assertTrue(sp.isspmatrix_csr(mapped))
+        self.assertFalse(mapped.data.flags.owndata)
+        npt.assert_array_equal(mapped.toarray(), X)
+
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/lib.cell.count")
+        with patch("orangecontrib.single_cell.widgets.load_data.data_cache",
+                   return_value=self.cache):
+            loader = CountLoader(file_name)
+            loader.use_cache = False
+            loader.memory_map = True
+            data = loader()
+            self.assertEqual(len(os.listdir(self.tmp_dir)), 3)
+            npt.assert_array_equal(loader()[:, :3].X.toarray(),
+                                   data[:, :3].X.toarray())
+
+    def test_memory_map_dense(self):
+        # integer counts are parsed into an int64 array
+        file_name = os.path.join(self.tmp_dir, "counts.tab")
+        X = np.random.RandomState(0).randint(0, 3, (10, 5))
+        pd.DataFrame(X).to_csv(file_name, sep="\t")
+        cache = DataCache(os.path.join(self.tmp_dir, "cache"))
+        with patch("orangecontrib.single_cell.widgets.load_data.data_cache",
+                   return_value=cache):
+            loader = Loader(file_name)
+            loader.header_rows_count = 1
+            loader.header_cols_count = 1
+            loader.transposed = False
+            loader.sparse = False
+            loader.memory_map = True
+            for _ in range(2):  # parsed, then read from the cache
+                data = loader()
+                self.assertEqual(data.X.dtype, np.float64)
+                base = data.X
+                while base is not None and not isinstance(base, np.memmap):
+                    base = base.base
+                self.assertIsInstance(base, np.memmap)
+                self.assertTrue(np.shares_memory(data.X, base))
+                npt.assert_array_equal(data.X, X)
+
+    def test_put_stopped(self):
+        def stop(_):
+            raise KeyboardInterrupt
+
+        for X in (np.zeros((100, 100)), sp.eye(100, format="csr")):
+            with self.assertRaises(KeyboardInterrupt):
+                self.cache.put("a", X, {}, callback=stop)
+            self.assertEqual(os.listdir(self.tmp_dir), [])
+
+        finished = []
+        self.cache.put("a", np.zeros((100, 100)), {},
+                       callback=finished.append)
+        self.assertEqual(finished[-1], 1)
+        self.assertIsNotNone(self.cache.get("a"))
+
+    def test_key_version(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 "data/lib.cell.count")
+        key = DataCache.key(file_name, ())
+        self.assertEqual(DataCache.key(file_name, ()), key)
+        with patch.object(DataCache, "FORMAT_VERSION",
+                          DataCache.FORMAT_VERSION + 1):
+            self.assertNotEqual(DataCache.key(file_name, ()), key)
+
+    def test_evict(self):
+        X = np.zeros((100, 100))
+        self.cache.max_size = X.nbytes * 1.5
+        self.cache.put("a", X, {})
+        os.utime(os.path.join(self.tmp_dir, "a"), (0, 0))
+        self.cache.put("b", X, {})
+        self.assertIsNone(self.cache.get("a"))
+        X_b, state = self.cache.get("b")
+        npt.assert_array_equal(X_b, X)
+        self.assertEqual(state, {})
+
 
 class TestConcatenate(unittest.TestCase):
     def test_concatenate_intersection(self):
@@ -135,3 +945,77 @@ class TestConcatenate(unittest.TestCase):
         self.assertEqual(2 * len(data1) + len(data2), len(concat_data))
         self.assertEqual(len(concat_data.domain.attributes), 8)
         self.assertEqual(len(concat_data.domain.metas), 2)
+
+    def test_concatenate_disjoint_sparse(self):
+        tables = []
+        for k in range(2):
+            attrs = [ContinuousVariable("g{}_{}".format(k, j))
+                     for j in range(50)]
+            X = sp.random(20, 50, density=0.1, format="csr",
+                          random_state=k)
+            tables.append(Table.from_numpy(Domain(attrs), X))
+        data = Concatenate.concatenate(
+            Concatenate.UNION, ((tables[0], "a"), (tables[1], "b")))
+        self.assertTrue(sp.issparse(data.X))
+        self.assertEqual(data.X.shape, (40, 100))
+        # missing genes do not add entries
+        self.assertEqual(data.X.nnz, sum(t.X.nnz for t in tables))
+        masks = data.attributes[Concatenate.MISSING_GENES]
+        self.assertEqual(sorted(masks), ["a", "b"])
+        self.assertEqual(masks["a"].sum(), 50)
+
+        dense = Concatenate.concatenate(
+            Concatenate.UNION,
+            [(Table.from_numpy(table.domain, table.X.toarray()), name)
+             for table, name in zip(tables, "ab")])
+        self.assertEqual(np.isnan(dense.X).sum(), 2 * 20 * 50)
+        self.assertNotIn(Concatenate.MISSING_GENES, dense.attributes)
+
+    def test_concatenate_discrete_metas(self):
+        attrs = [ContinuousVariable("g")]
+        tables = []
+        for values, codes in ((["a", "b"], [0, 1]), (["b", "c"], [1, 0])):
+            cluster = DiscreteVariable("cluster", values=values)
+            kind = DiscreteVariable("kind", values=["x"]) if not tables \
+                else StringVariable("kind")
+            M = np.array([[c, 0 if not tables else "y"] for c in codes],
+                         dtype=object)
+            tables.append(Table.from_numpy(
+                Domain(attrs, metas=[cluster, kind]), np.zeros((2, 1)),
+                None, M))
+        data = Concatenate.concatenate(
+            Concatenate.UNION, ((tables[0], "1"), (tables[1], "2")))
+        cluster, kind = data.domain["cluster"], data.domain["kind"]
+        self.assertEqual(list(cluster.values), ["a", "b", "c"])
+        self.assertEqual([cluster.str_val(v) for v in
+                          data.get_column_view(cluster)[0].astype(float)],
+                         ["a", "b", "c", "b"])
+        self.assertTrue(kind.is_string)
+        self.assertEqual(list(data.get_column_view(kind)[0]),
+                         ["x", "x", "y", "y"])
+
+    def test_concatenate_values(self):
+        data1 = MtxLoader(os.path.join(os.path.dirname(__file__),
+                                       "data/10x/hg19/matrix.mtx"))()
+        data2 = MtxLoader(os.path.join(os.path.dirname(__file__),
+                                       "data/10x/mm10/matrix.mtx"))()
+        concat_data = Concatenate.concatenate(
+            Concatenate.UNION, ((data1, "1"), (data2, "2")))
+        self.assertTrue(sp.issparse(concat_data.X))
+        for i, data in enumerate((data1, data2)):
+            rows = slice(i * len(data1), i * len(data1) + len(data))
+            X = concat_data.X[rows].toarray()
+            columns = [concat_data.domain.index(var)
+                       for var in data.domain.attributes]
+            npt.assert_array_equal(X[:, columns], data.X.toarray())
+            # genes missing from a sample are implicit zeros and masked
+            masks = concat_data.attributes[Concatenate.MISSING_GENES]
+            mask = masks[str(i + 1)]
+            npt.assert_array_equal(
+                np.flatnonzero(mask),
+                np.setdiff1d(np.arange(X.shape[1]), columns))
+            self.assertTrue(mask.any())
+            npt.assert_array_equal(X[:, mask], 0)
+            source = concat_data.domain["source"]
+            npt.assert_array_equal(
+                concat_data.get_column_view(source)[0][rows].astype(float), i)
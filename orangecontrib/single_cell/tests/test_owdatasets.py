@@ -1,6 +1,21 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from unittest.mock import patch, Mock
 
-from orangecontrib.single_cell.widgets.owscdatasets import OWscDataSets
+import numpy as np
+import numpy.testing as npt
+
+from AnyQt.QtTest import QTest
+
+from Orange.data import ContinuousVariable, Domain, Table
+
+from orangecontrib.single_cell.widgets.owscdatasets import (
+    OWscDataSets, open_dataset, binary_path
+)
 from Orange.widgets.tests.base import WidgetTest
 
 
@@ -9,6 +24,64 @@ class TestOWscDataSets(WidgetTest):
     def test_widget_setup(self):
         self.widget = self.create_widget(OWscDataSets)
 
+    def test_open_dataset(self):
+        domain = Domain([ContinuousVariable("g{}".format(i))
+                         for i in range(5)])
+        X = np.random.RandomState(0).poisson(1, (10, 5)).astype(float)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "data.pickle")
+            Table.from_numpy(domain, X).save(path)
+            data = open_dataset(path, "9606")
+            self.assertTrue(os.path.exists(binary_path(path)))
+            mapped = open_dataset(path, "9606")
+            npt.assert_array_equal(mapped.X, X)
+            self.assertEqual(mapped.attributes, data.attributes)
+            del mapped
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_open_dataset_without_copy(self):
+        domain = Domain([ContinuousVariable("g{}".format(i))
+                         for i in range(5)])
+        X = np.random.RandomState(0).poisson(1, (10, 5)).astype(float)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "data.pickle")
+            Table.from_numpy(domain, X).save(path)
+            with patch("orangecontrib.single_cell.widgets.owscdatasets."
+                       "write_npz", side_effect=ValueError):
+                data = open_dataset(path, "9606")
+            npt.assert_array_equal(data.X, X)
+            self.assertEqual(os.listdir(tmp_dir), ["data.pickle"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_cancel_does_not_wait(self):
+        self.widget = self.create_widget(OWscDataSets)
+        release = threading.Event()
+        data = Table.from_numpy(
+            Domain([ContinuousVariable("a")]), np.zeros((1, 1)))
+
+        def open_dataset_(*_):
+            # a conversion which does not call the callback
+            release.wait(10)
+            return data
+
+        with patch("orangecontrib.single_cell.widgets.owscdatasets."
+                   "open_dataset", open_dataset_), \
+                patch.object(OWscDataSets, "selected_dataset",
+                             return_value=Mock(taxid="9606")):
+            self.widget.load_and_output("data.pickle")
+            start = time.time()
+            self.widget.cancel()
+            self.assertLess(time.time() - start, 1)
+            self.assertIsNone(self.widget._task)
+            self.widget.Outputs.data.send(None)
+            release.set()
+            QTest.qWait(100)
+        self.assertIsNone(self.get_output(self.widget.Outputs.data))
+
 
 if __name__ == '__main__':
     unittest.main()
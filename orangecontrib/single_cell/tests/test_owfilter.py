@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse as sp
 
 import Orange.data
 from Orange.widgets.tests.base import WidgetTest
@@ -106,3 +107,34 @@ class TestOWFilterCells(WidgetTest):
 
         self.send_signal(self.widget.Inputs.data, None)
         self.assertIsNone(self.get_output(self.widget.Outputs.data))
+
+    def test_sparse_counts(self):
+        domain = Orange.data.Domain(
+            [Orange.data.ContinuousVariable("A{}".format(i))
+             for i in range(3)]
+        )
+        X = sp.csr_matrix(np.array([[0, 0, 0],
+                                    [0, 0, 1],
+                                    [0, 1, 2],
+                                    [1, 2, 3]], dtype=np.uint16))
+        data = Orange.data.Table.from_numpy(domain, X)
+        self.send_signal(self.widget.Inputs.data, data)
+        self.widget.limit_lower = 2
+        self.widget.commit()
+        out = self.get_output(self.widget.Outputs.data)
+        self.assertEqual(len(out), 2)
+        self.assertTrue(sp.issparse(out.X))
+        self.assertEqual(out.X.dtype, np.uint16)
+
+        self.widget.set_filter_type(OWFilter.Data)
+        self.widget.limit_lower = 2
+        self.widget.commit()
+        out = self.get_output(self.widget.Outputs.data)
+        self.assertEqual(out.X.dtype, np.uint16)
+        np.testing.assert_array_equal(
+            out.X.toarray(),
+            [[0, 0, 0],
+             [0, 0, 0],
+             [0, 0, 2],
+             [0, 2, 3]]
+        )
@@ -1,12 +1,22 @@
 import os
+import threading
+import time
+from unittest.mock import patch
 
 import numpy as np
 import numpy.testing as npt
 import pandas as pd
+import scipy.sparse as sp
 
-from Orange.data import ContinuousVariable
+from AnyQt.QtTest import QTest
+
+from Orange.data import ContinuousVariable, Domain, Table
 from Orange.widgets.tests.base import WidgetTest
 
+from orangecontrib.single_cell.tests.utils import (  # pylint: disable=unused-import
+    setUpModule, tearDownModule
+)
+from orangecontrib.single_cell.widgets.load_data import Loader, read_head
 from orangecontrib.single_cell.widgets.owloaddata import OWLoadData
 
 
@@ -57,7 +67,7 @@ class TestOWLoadData(WidgetTest):
     def test_load_data_mtx(self):
         file_name_mtx = os.path.join(self._path, "10x/hg19/matrix.mtx")
         self.widget.set_current_path(file_name_mtx)
-        self.widget.commit()
+        self._commit_and_wait()
         data = self.get_output("Data")
         file_name = os.path.join(self._path, "10x/hg19/genes.tsv")
         df = pd.read_csv(file_name, sep="\t", header=None)
@@ -75,7 +85,7 @@ class TestOWLoadData(WidgetTest):
         self.widget.sample_cols_cb.setChecked(True)
         self.widget.set_sample_rows_p(10)
         self.widget.set_sample_cols_p(10)
-        self.widget.commit()
+        self._commit_and_wait()
         data = self.get_output("Data")
         file_name = os.path.join(self._path, "10x/mm10/genes.tsv")
         df = pd.read_csv(file_name, sep="\t", header=None, skiprows=[4])
@@ -93,7 +103,7 @@ class TestOWLoadData(WidgetTest):
     def test_load_data_broad(self):
         file_name = os.path.join(self._path, "DATA_MATRIX_LOG_TPM.txt")
         self.widget.set_current_path(file_name)
-        self.widget.commit()
+        self._commit_and_wait()
         data = self.get_output("Data")
         df = pd.read_csv(file_name, header=0, sep="\t", index_col=0)
         self._test_load_data_attributes(data.domain.attributes, df)
@@ -103,7 +113,7 @@ class TestOWLoadData(WidgetTest):
     def test_load_data_compressed(self):
         file_name = os.path.join(self._path, "data.txt.gz")
         self.widget.set_current_path(file_name)
-        self.widget.commit()
+        self._commit_and_wait()
         data = self.get_output("Data")
         df = pd.read_csv(file_name, header=0, sep="\t", index_col=0)
         self._test_load_data_attributes(data.domain.attributes, df)
@@ -113,7 +123,7 @@ class TestOWLoadData(WidgetTest):
     def test_load_data_pickle(self):
         file_name = os.path.join(self._path, "data.pkl")
         self.widget.set_current_path(file_name)
-        self.widget.commit()
+        self._commit_and_wait()
         data = self.get_output("Data")
         file_name = os.path.join(self._path, "data.txt.gz")
         df = pd.read_csv(file_name, header=0, sep="\t", index_col=0)
@@ -128,7 +138,7 @@ class TestOWLoadData(WidgetTest):
         self.widget.sample_cols_cb.setChecked(True)
         self.widget.set_sample_rows_p(40)
         self.widget.set_sample_cols_p(60)
-        self.widget.commit()
+        self._commit_and_wait()
         data = self.get_output("Data")
         df = pd.read_csv(
             file_name, header=0, sep="\t", index_col=0,
@@ -140,7 +150,7 @@ class TestOWLoadData(WidgetTest):
     def test_load_data_hhmi(self):
         file_name = os.path.join(self._path, "lib.cell.count")
         self.widget.set_current_path(file_name)
-        self.widget.commit()
+        self._commit_and_wait()
         data = self.get_output("Data")
         df = pd.read_csv(file_name, header=0, sep="\t", index_col=0)
         self._test_load_data_attributes(data.domain.attributes, df)
@@ -156,7 +166,7 @@ class TestOWLoadData(WidgetTest):
         self.widget.sample_cols_cb.setChecked(True)
         self.widget.set_sample_rows_p(40)
         self.widget.set_sample_cols_p(60)
-        self.widget.commit()
+        self._commit_and_wait()
         data = self.get_output("Data")
         df = pd.read_csv(
             file_name, header=0, sep="\t", index_col=0,
@@ -172,16 +182,83 @@ class TestOWLoadData(WidgetTest):
         file_name = os.path.join(self._path, "DATA_MATRIX_LOG_TPM.txt")
         self.widget.set_current_path(file_name)
         self.widget.set_header_rows_count(0)
-        self.widget.commit()
+        self._commit_and_wait()
         self.assertTrue(self.widget.Error.inadequate_headers.is_shown())
         self.widget.set_header_cols_count(0)
-        self.widget.commit()
+        self._commit_and_wait()
         self.assertTrue(self.widget.Error.inadequate_headers.is_shown())
         self.widget.set_header_rows_count(1)
         self.widget.set_header_cols_count(1)
-        self.widget.commit()
+        self._commit_and_wait()
         self.assertFalse(self.widget.Error.inadequate_headers.is_shown())
 
+    def test_cancel_load(self):
+        file_name = os.path.join(self._path, "DATA_MATRIX_LOG_TPM.txt")
+        self.widget.set_current_path(file_name)
+        self._commit_and_wait()
+        data = self.get_output("Data")
+        self.assertIsNotNone(data)
+
+        self.widget.commit()
+        self.widget.set_header_rows_count(0)
+        self.assertIsNone(self.widget._task)
+        QTest.qWait(50)
+        self.assertIs(self.get_output("Data"), data)
+        self.assertTrue(self.widget.Information.modified.is_shown())
+
+    def test_cancel_does_not_wait(self):
+        file_name = os.path.join(self._path, "DATA_MATRIX_LOG_TPM.txt")
+        self.widget.set_current_path(file_name)
+        release = threading.Event()
+        data = Table.from_numpy(
+            Domain([ContinuousVariable("a")]), np.zeros((1, 1)))
+
+        def load(*_, **__):
+            # a phase which does not call the callback
+            release.wait(10)
+            return data
+
+        with patch.object(Loader, "__call__", load):
+            self.widget.commit()
+            start = time.time()
+            self.widget.cancel()
+            self.assertLess(time.time() - start, 1)
+            self.assertIsNone(self.widget._task)
+            release.set()
+            QTest.qWait(100)
+        self.assertIsNone(self.get_output("Data"))
+
+    def test_preview(self):
+        file_name = os.path.join(self._path, "DATA_MATRIX_LOG_TPM.txt")
+        with patch("orangecontrib.single_cell.widgets.load_data.read_head",
+                   wraps=read_head) as head:
+            self.widget.set_current_path(file_name)
+            self._wait_for_preview()
+            model = self.widget.preview_view.model()
+            self.assertTrue(self.widget.preview_view.isVisibleTo(self.widget))
+            self.assertEqual(model.rowCount(), 10)
+            self.widget.set_header_rows_count(0)
+            self.assertEqual(model.rowCount(), 10)
+            head.assert_called_once()
+
+        self.widget.set_current_path(
+            os.path.join(self._path, "10x/mm10/matrix.mtx"))
+        self._wait_for_preview()
+        self.assertGreater(model.rowCount(), 0)
+
+    def _wait_for_preview(self, timeout=10):
+        deadline = time.time() + timeout
+        while self.widget._preview_watchers and time.time() < deadline:
+            QTest.qWait(10)
+        self.assertEqual(self.widget._preview_watchers, [])
+
+    def _commit_and_wait(self, timeout=10):
+        self.widget.commit()
+        deadline = time.time() + timeout
+        while self.widget._task is not None and time.time() < deadline:
+            QTest.qWait(10)
+        self.assertIsNone(self.widget._task)
+
     def _check_headers_and_row_labels_box(self, values):
         self.assertEqual(self.widget.header_rows_spin.value(), values[0])
         self.assertEqual(self.widget.header_rows_spin.isEnabled(), values[1])
@@ -220,6 +297,8 @@ class TestOWLoadData(WidgetTest):
             self.assertDictEqual(attribute.attributes, {})
 
     def _test_load_data_x(self, x, df):
+        if sp.issparse(x):
+            x = x.toarray()
         npt.assert_array_equal(x, df.values.T)
 
     def _test_load_data_metas(self, metas, df):
@@ -238,7 +317,8 @@ class TestOWLoadData(WidgetTest):
             if i == 0:
                 continue
             array[series.iloc[1] - 1, series.iloc[0] - 1] = series.iloc[2]
-        npt.assert_array_equal(x, array)
+        self.assertTrue(sp.issparse(x))
+        npt.assert_array_equal(x.toarray(), array)
 
     def _test_load_data_broad_metas(self, metas, data_frame):
         npt.assert_array_equal(metas.flatten(), data_frame.columns.values)
@@ -1,11 +1,17 @@
 import os
+import time
+from unittest.mock import patch
 
 import numpy.testing as npt
 from AnyQt.QtCore import Qt, QMimeData, QUrl, QPoint
 from AnyQt.QtGui import QDropEvent
+from AnyQt.QtTest import QTest
 
 from Orange.widgets.tests.base import WidgetTest
 
+from orangecontrib.single_cell.tests.utils import (  # pylint: disable=unused-import
+    setUpModule, tearDownModule
+)
 from orangecontrib.single_cell.widgets.owmultisample import OWMultiSample
 
 
@@ -23,6 +29,14 @@ class TestOWMultiSample(WidgetTest):
         model.item(0).setCheckState(True)
         model.item(1).setCheckState(True)
         self.widget.commit()
+        self.wait_until_loaded()
+
+    def wait_until_loaded(self, widget=None):
+        widget = widget or self.widget
+        deadline = time.time() + 30
+        while widget._OWMultiSample__task is not None and \
+                time.time() < deadline:
+            QTest.qWait(50)
 
     def test_load_samples(self):
         self.assertEqual(self.widget.view.model().rowCount(), 2)
@@ -33,28 +47,52 @@ class TestOWMultiSample(WidgetTest):
         self.assertEqual(len(concatenated_data), 11)
         self.assertEqual(len(domain.attributes), 1)
         self.assertEqual(len(domain.metas), 2)
+        self.assertFalse(self.widget.Warning.missing_genes_zero.is_shown())
 
     def test_concatenate_union_mtx(self):
         self.widget.controls.output_type.buttons[1].click()
+        self.wait_until_loaded()
         concatenated_data = self.get_output("Data")
         domain = concatenated_data.domain
         self.assertEqual(len(concatenated_data), 11)
         self.assertEqual(len(domain.attributes), 8)
         self.assertEqual(len(domain.metas), 2)
+        self.assertTrue(self.widget.Warning.missing_genes_zero.is_shown())
         self.assertTrue(all(
             [list(attr.attributes.keys()) == ["Id", "Gene"]
              for attr in domain.attributes]
         ))
 
+    def test_load_in_background(self):
+        self.widget.Outputs.data.send(None)
+        self.widget.commit()
+        self.assertIsNone(self.get_output("Data"))
+        self.wait_until_loaded()
+        self.assertIsNotNone(self.get_output("Data"))
+
+    def test_parallel_load(self):
+        expected = self.get_output("Data")
+        with patch.object(OWMultiSample, "PARALLEL_MIN_SIZE", 0):
+            self.widget.Outputs.data.send(None)
+            self.widget.commit()
+            self.wait_until_loaded()
+        data = self.get_output("Data")
+        self.assertIsNotNone(data)
+        self.assertEqual(data.domain, expected.domain)
+        npt.assert_array_equal(data.X.toarray(), expected.X.toarray())
+        npt.assert_array_equal(data.metas, expected.metas)
+
     def test_settings(self):
         self.widget.saveSettings()
         widget = self.create_widget(
             OWMultiSample, reset_default_settings=False
         )
+        self.wait_until_loaded(widget)
         self.assertEqual(widget.view.model().rowCount(), 2)
         self.assertIsNotNone(self.get_output("Data", widget))
         npt.assert_array_equal(
-            self.get_output("Data").X, self.get_output("Data", widget).X
+            self.get_output("Data").X.toarray(),
+            self.get_output("Data", widget).X.toarray()
         )
 
     def test_drop_sample(self):
@@ -0,0 +1,123 @@
+import os
+import gzip
+import struct
+import zlib
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import numpy.testing as npt
+import scipy.sparse as sp
+
+from orangecontrib.single_cell.reader import VariantData, MISSING
+
+VCF = """\
+##fileformat=VCFv4.2
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype Quality">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tc1-1\tc2-1\tc3-1
+1\t100\t.\tA\tG\t50\tPASS\t.\tGT:GQ\t0/0:40\t0/1:20\t1/1:99
+1\t200\t.\tC\tT,G\t50\tPASS\t.\tGT:AD:GQ\t1/2:3,4:35\t./.\t0|1:.
+2\t300\t.\tG\tA\t50\tPASS\t.\tGQ:GT\t10:0/0\t30:0/0\t300:1/0
+"""
+
+
+def bgzf_block(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    size = 18 + len(compressed) + 8
+    header = struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6,
+                         66, 67, 2, size - 1)
+    return header + compressed + struct.pack("<II", zlib.crc32(data),
+                                             len(data))
+
+
+def write_indexed_vcf(file_name, text):
+    """Write each chromosome into its own BGZF block and index the blocks
+    with a single chunk in the root bin"""
+    lines = text.encode().splitlines(True)
+    blocks = [b"".join(l for l in lines if l.startswith(b"#"))]
+    names = []
+    for line in lines:
+        name = line.split(b"\t")[0]
+        if line.startswith(b"#"):
+            continue
+        if name not in names:
+            names.append(name)
+            blocks.append(b"")
+        blocks[-1] += line
+    blocks = [bgzf_block(block) for block in blocks + [b""]]
+    offsets = np.cumsum([0] + [len(block) for block in blocks])
+    with open(file_name, "wb") as f:
+        f.write(b"".join(blocks))
+
+    names = b"".join(name + b"\0" for name in names)
+    index = b"TBI\x01" + struct.pack("<8i", len(offsets) - 3, 2, 1, 2, 0,
+                                      ord("#"), 0, len(names)) + names
+    for begin, end in zip(offsets[1:-2], offsets[2:-1]):
+        index += struct.pack("<iIiQQi", 1, 0, 1, int(begin) << 16,
+                             int(end) << 16, 0)
+    with gzip.open(file_name + ".tbi", "wb") as f:
+        f.write(index)
+
+
+class TestVariantData(unittest.TestCase):
+    def setUp(self):
+        fd, self.file_name = tempfile.mkstemp(suffix=".vcf")
+        with os.fdopen(fd, "w") as f:
+            f.write(VCF)
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def test_read(self):
+        with patch.object(VariantData, "BLOCK_SIZE", 2):
+            variants = VariantData(self.file_name)
+        npt.assert_array_equal(variants.samples, ["c1-1", "c2-1", "c3-1"])
+        self.assertEqual(variants.gt_bits.shape, (3, 1))
+        self.assertEqual(variants.gt.dtype, np.int8)
+        self.assertEqual(variants.gq.dtype, np.uint8)
+        npt.assert_array_equal(
+            variants.gt, [[0, 1, 1], [1, MISSING, 1], [0, 0, 1]])
+        npt.assert_array_equal(
+            variants.gq, [[40, 20, 99], [35, 0, 0], [10, 30, 255]])
+        npt.assert_array_equal(variants.pos, [100, 200, 300])
+        self.assertGreater(variants.throughput, 0)
+
+        data = variants.get_data(quality=15)
+        self.assertEqual(len(data), 3)
+        self.assertEqual([var.name for var in data.domain.attributes],
+                         ["1-100", "1-200", "2-300"])
+        self.assertEqual(data.domain[1].attributes["ALT"], "TG")
+        self.assertTrue(sp.issparse(data.X))
+        npt.assert_array_equal(
+            data.X.toarray(),
+            [[0, 1, np.nan], [1, np.nan, 0], [1, np.nan, 1]])
+
+        data = variants.get_data(quality=15, frequency=2)
+        self.assertEqual([var.name for var in data.domain.attributes],
+                         ["1-100"])
+
+    def test_region(self):
+        file_name = self.file_name + ".gz"
+        write_indexed_vcf(file_name, VCF)
+        try:
+            with patch("orangecontrib.single_cell.bgzf.BgzfReader",
+                       side_effect=AssertionError):
+                variants = VariantData(file_name, region="1")
+            npt.assert_array_equal(variants.pos, [100, 200])
+            npt.assert_array_equal(variants.samples,
+                                   ["c1-1", "c2-1", "c3-1"])
+            variants = VariantData(file_name, region="1:150-250")
+            npt.assert_array_equal(variants.pos, [200])
+            npt.assert_array_equal(variants.gt, [[1, MISSING, 1]])
+            variants = VariantData(file_name, region=["1:1-150", "2", "3"])
+            npt.assert_array_equal(variants.pos, [100, 300])
+        finally:
+            os.remove(file_name)
+            os.remove(file_name + ".tbi")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+"""Helpers shared by the tests"""
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from orangecontrib.single_cell.widgets.load_data import DataCache
+
+_cache_dir = None
+_cache_patch = None
+
+
+def setUpModule():
+    """Keep files parsed by the tests of a module out of the user's cache
+
+    Test modules import this function (and tearDownModule) as their own.
+    """
+    global _cache_dir, _cache_patch
+    _cache_dir = tempfile.mkdtemp()
+    _cache_patch = patch(
+        "orangecontrib.single_cell.widgets.load_data.data_cache",
+        return_value=DataCache(_cache_dir))
+    _cache_patch.start()
+
+
+def tearDownModule():
+    _cache_patch.stop()
+    shutil.rmtree(_cache_dir)
@@ -1,17 +1,53 @@
 import os
+import io
+import bz2
 import csv
+import gzip
+import json
+import lzma
+import pickle
 import random
-from itertools import chain
-from typing import Dict, Tuple
+import re
+import zlib
+import shutil
+import struct
+import sys
+import hashlib
+import tempfile
+import threading
+import zipfile
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import chain, compress
+from typing import Dict, Tuple, Optional
 
 import numpy as np
 import pandas as pd
 import scipy.io
+import scipy.sparse as sp
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 from Orange.data import (
     ContinuousVariable, DiscreteVariable, StringVariable, Domain, Table
 )
-from Orange.data.io import Compression, open_compressed, PickleReader
+from Orange.data.io import (
+    Compression, FileFormat, open_compressed
+)
+from Orange.misc.environ import cache_dir
+
+from orangecontrib.single_cell import bgzf
 
 
 def separator_from_filename(file_name):
@@ -23,6 +59,1320 @@ def separator_from_filename(file_name):
     return "," if os.path.splitext(file_name)[1] == ".csv" else "\t"
 
 
+class _ProgressFile(io.RawIOBase):
+    """Binary file which reports the fraction of its bytes read so far"""
+    def __init__(self, file_name, callback):
+        super().__init__()
+        self._file = open(file_name, "rb", buffering=0)
+        self._size = os.fstat(self._file.fileno()).st_size or 1
+        self._callback = callback
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self._file.readinto(b)
+        self._callback(min(self._file.tell() / self._size, 1))
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+_DECOMPRESSED_FILES = {
+    Compression.GZIP: lambda f: gzip.GzipFile(fileobj=f, mode="rb"),
+    Compression.BZIP2: bz2.BZ2File,
+    Compression.XZ: lzma.LZMAFile,
+}
+
+
+@contextmanager
+def open_with_progress(file_name, callback=None):
+    """Open a (compressed) file for reading in binary mode
+
+    The callback is called with the fraction of the file on disk which
+    has been read; for compressed files, this is the fraction of the
+    compressed data. BGZF files are decompressed in a pool of threads.
+
+    :param file_name: str
+    :param callback: callable(float) or None
+    """
+    ext = os.path.splitext(file_name)[1]
+    if ext == Compression.GZIP and bgzf.is_bgzf(file_name):
+        with io.BufferedReader(bgzf.BgzfReader(file_name, callback)) as f:
+            yield f
+        return
+    if callback is None:
+        with open_compressed(file_name, "rb") as f:
+            yield f
+        return
+    with io.BufferedReader(_ProgressFile(file_name, callback)) as raw:
+        if ext in _DECOMPRESSED_FILES:
+            with _DECOMPRESSED_FILES[ext](raw) as f:
+                yield f
+        else:
+            yield raw
+
+
+def read_mtx(file_name, transpose=False, n_jobs=None, block_size=2 ** 24,
+             callback=None):
+    """Read Matrix Market file into a sparse matrix
+
+    Coordinate entries are split into blocks of whole lines which are
+    parsed in a pool of threads (pandas' tokenizer releases the GIL) and
+    written straight into preallocated COO arrays. Matrices other than
+    general real, integer or pattern coordinate matrices are read with
+    scipy.io.mmread.
+
+    :param file_name: str
+    :param transpose: bool, swap rows and columns while reading
+    :param n_jobs: int, number of parsing threads (default: cpu count)
+    :param block_size: int, approximate size of a block in bytes
+    :param callback: callable(float), called with the fraction of file read
+    :return: sp.csr_matrix
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    with open_with_progress(file_name, callback) as f:
+        header = _read_mtx_header(f)
+        if header is not None:
+            shape, nnz, field = header
+            rows, cols, data = _read_mtx_entries(
+                f, nnz, field, max(shape), n_jobs, block_size, callback)
+    if header is None:
+        with open_with_progress(file_name, callback) as f:
+            X = scipy.io.mmread(f)
+        return sp.csr_matrix(X.T if transpose else X)
+
+    if transpose:
+        rows, cols, shape = cols, rows, shape[::-1]
+    return sp.coo_matrix((data, (rows, cols)), shape=shape).tocsr()
+
+
+def _read_mtx_header(f):
+    """Read Matrix Market banner, comments and size line
+
+    :param f: file opened in binary mode
+    :return: tuple ((n_rows, n_cols), nnz, field) or None if the
+        matrix is not a general real, integer or pattern coordinate one
+    """
+    banner = f.readline().decode("latin-1").lower().split()
+    if len(banner) != 5 or banner[0] != "%%matrixmarket":
+        raise ValueError("Not a Matrix Market file")
+    _, obj, fmt, field, symmetry = banner
+    if obj != "matrix" or fmt != "coordinate" or symmetry != "general" \
+            or field not in ("real", "integer", "pattern"):
+        return None
+
+    line = f.readline()
+    while line.startswith(b"%") or not line.strip():
+        if not line:
+            raise ValueError("Missing Matrix Market size line")
+        line = f.readline()
+    n_rows, n_cols, nnz = map(int, line.split())
+    return (n_rows, n_cols), nnz, field
+
+
+def _read_mtx_entries(f, nnz, field, max_dim, n_jobs, block_size,
+                      callback=None):
+    index_dtype = np.int32 if max_dim < 2 ** 31 else np.int64
+    rows = np.empty(nnz, dtype=index_dtype)
+    cols = np.empty(nnz, dtype=index_dtype)
+    pattern = field == "pattern"
+    data = np.ones(nnz) if pattern else np.empty(nnz)
+    n_fields = 2 if pattern else 3
+    offset = 0
+
+    def store(entries):
+        nonlocal offset
+        end = offset + len(entries)
+        if end > nnz:
+            raise ValueError("More entries than declared in the header")
+        rows[offset:end] = entries[:, 0] - 1
+        cols[offset:end] = entries[:, 1] - 1
+        if not pattern:
+            data[offset:end] = entries[:, 2]
+        offset = end
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        try:
+            for block in _iter_line_blocks(f, block_size):
+                pending.append(
+                    executor.submit(_parse_mtx_block, block, n_fields))
+                # keep a bounded number of blocks in memory
+                if len(pending) > 2 * n_jobs:
+                    store(pending.popleft().result())
+            while pending:
+                # the whole file has been read; the callback may still
+                # stop parsing
+                if callback is not None:
+                    callback(1)
+                store(pending.popleft().result())
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    if offset != nnz:
+        raise ValueError("Expected {} entries, got {}".format(nnz, offset))
+    return rows, cols, data
+
+
+def _iter_line_blocks(f, block_size):
+    """Yield chunks of approximately block_size bytes ending with a newline
+    """
+    rest = b""
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        block = rest + block
+        end = block.rfind(b"\n") + 1
+        rest, block = block[end:], block[:end]
+        if block:
+            yield block
+    if rest.strip():
+        yield rest
+
+
+def _parse_mtx_block(block, n_fields):
+    try:
+        entries = pd.read_csv(
+            io.BytesIO(block), sep=r"\s+", header=None, dtype=np.float64,
+            comment="%", engine="c"
+        ).values
+    except pd.errors.EmptyDataError:
+        return np.empty((0, n_fields))
+    if entries.shape[1] != n_fields:
+        raise ValueError("Expected {} values per line, got {}"
+                         .format(n_fields, entries.shape[1]))
+    return entries
+
+
+def read_transposed(f, separator, rows_mask=None, use_cols=None,
+                    sparse=True, block_size=2 ** 24):
+    """Read a file with one header row and one column of row labels,
+    with genes in rows, into a matrix with cells in rows
+
+    File rows are parsed with pandas in blocks of about block_size bytes
+    and stored as columns of the result: sparse blocks are stacked into a
+    matrix whose transpose is returned as CSR; dense blocks are stacked
+    into an array whose transpose is returned as a column-major view. No
+    (transposed) DataFrame of the whole file is built.
+
+    :param f: file opened in binary mode
+    :param separator: str
+    :param rows_mask: np.ndarray, mask of file lines to read, or a
+        RowSampler which draws the mask as lines are read
+    :param use_cols: np.ndarray, indices of file columns to read,
+        including the label column (or None)
+    :param sparse: bool
+    :param block_size: int, number of bytes parsed at once
+    :return: tuple (X, gene labels, cell labels)
+    """
+    header = next(csv.reader([f.readline().decode("utf-8")],
+                             delimiter=separator), [])
+    cells = n_fields = None
+    genes, blocks = [], []
+    # lines[0] is the line at index start of the file (the header is 0)
+    lines, n_bytes, start = [], 0, 1
+
+    def parse():
+        rows = lines
+        if rows_mask is not None:
+            rows = compress(rows, _lines_mask(rows_mask, start, len(rows)))
+        rows = [line for line in rows if line.strip(b"\r\n")]
+        if rows:
+            labels, values = _parse_rows(rows, separator, n_fields, use_cols)
+            genes.extend(labels)
+            blocks.append(sp.csr_matrix(values) if sparse else values)
+
+    for line in f:
+        if cells is None and line.strip(b"\r\n"):
+            n_fields = len(next(csv.reader(
+                [line.decode("utf-8").rstrip("\r\n")],
+                delimiter=separator)))
+            if n_fields == len(header) + 1:
+                # header without a name of the label column
+                header = [""] + header
+            n_fields = len(header)
+            if use_cols is None:
+                use_cols = np.arange(n_fields)
+            cells = _mangle_duplicates(
+                [header[j] or "Unnamed: {}".format(j) for j in use_cols[1:]])
+        if not line.endswith(b"\n"):
+            line += b"\n"
+        lines.append(line)
+        n_bytes += len(line)
+        if n_bytes >= block_size:
+            parse()
+            lines, n_bytes, start = [], 0, start + len(lines)
+    if lines:
+        parse()
+
+    if cells is None:
+        cells = _mangle_duplicates(header[1:])
+    shape = (len(genes), len(cells))
+    if sparse:
+        X = sp.vstack(blocks, format="csr") if blocks \
+            else sp.csr_matrix(shape)
+        X = X.T.tocsr()
+    else:
+        X = np.vstack(blocks).T if blocks else np.empty(shape).T
+    return X, _infer_index(genes), pd.Index(cells)
+
+
+def _parse_rows(lines, separator, n_fields, use_cols):
+    """Labels and values of lines with a label followed by values
+
+    Quoted fields are unquoted; empty and non-numeric values are missing.
+
+    :return: tuple (list of str, np.ndarray)
+    """
+    df = pd.read_csv(io.BytesIO(b"".join(lines)), sep=separator,
+                     header=None, names=range(n_fields),
+                     usecols=list(use_cols), dtype={0: str},
+                     keep_default_na=False,
+                     skip_blank_lines=False)
+    values = df.iloc[:, 1:]
+    if any(dtype.kind not in "biuf" for dtype in values.dtypes):
+        values = values.apply(pd.to_numeric, errors="coerce")
+    return list(df.iloc[:, 0]), values.values.astype(float)
+
+
+def _infer_index(labels):
+    """Index of labels, numeric if all labels are numbers (as in pandas)"""
+    try:
+        return pd.Index(pd.to_numeric(labels))
+    except (ValueError, TypeError):
+        return pd.Index(labels)
+
+
+def _mangle_duplicates(names):
+    """Rename duplicated names to name.1, name.2, ... (as in pandas)"""
+    counts = {}
+    mangled = []
+    for name in names:
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = "{}.{}".format(name, count)
+            count = counts.get(name, 0)
+        mangled.append(name)
+        counts[name] = count + 1
+    return mangled
+
+
+def read_h5_columns(data, indices, indptr, columns, chunk_size=2 ** 22,
+                    callback=None):
+    """Read columns of a CSC matrix stored in HDF5 datasets
+
+    Runs of consecutive columns are read with slices of at most chunk_size
+    entries, so the entries of other columns are never read.
+
+    :param data: h5py.Dataset
+    :param indices: h5py.Dataset
+    :param indptr: np.ndarray
+    :param columns: np.ndarray, sorted column indices
+    :param chunk_size: int
+    :param callback: callable(float), called with the fraction of entries read
+    :return: tuple (np.ndarray, np.ndarray, np.ndarray), data, indices and
+        indptr of a CSR matrix whose rows are the columns
+    """
+    starts, ends = indptr[columns], indptr[columns + 1]
+    out_indptr = np.zeros(len(columns) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=out_indptr[1:])
+    out_data = np.empty(out_indptr[-1], dtype=data.dtype)
+    out_indices = np.empty(out_indptr[-1], dtype=indices.dtype)
+
+    breaks = np.flatnonzero(np.diff(columns) != 1) + 1
+    runs = zip(np.r_[0, breaks], np.r_[breaks, len(columns)]) \
+        if len(columns) else []
+    for first, last in runs:
+        lo, hi = starts[first], ends[last - 1]
+        offset = out_indptr[first] - lo
+        for start in range(lo, hi, chunk_size):
+            end = min(start + chunk_size, hi)
+            out_data[start + offset:end + offset] = data[start:end]
+            out_indices[start + offset:end + offset] = indices[start:end]
+            if callback is not None:
+                callback((end + offset) / max(out_indptr[-1], 1))
+    return out_data, out_indices, out_indptr
+
+
+def _h5_matrix_group(f):
+    """Return the group of a 10x HDF5 file which holds the matrix"""
+    if "matrix" in f:
+        return f["matrix"]
+    # Cell Ranger 2 stores a matrix for each genome
+    for group in f.values():
+        if isinstance(group, h5py.Group) and "indptr" in group:
+            return group
+    raise ValueError("No gene-barcode matrix found")
+
+
+def _h5_strings(dataset):
+    return np.array([value.decode("utf-8") if isinstance(value, bytes)
+                     else str(value) for value in dataset[:]], dtype=object)
+
+
+def _h5_attr(node, *names, default=None):
+    """Return the first of the given HDF5 attributes found, decoded"""
+    for name in names:
+        if name in node.attrs:
+            value = node.attrs[name]
+            return value.decode("utf-8") if isinstance(value, bytes) \
+                else value
+    return default
+
+
+def read_h5_matrix(node, rows, cols=None, sparse=True, chunk_bytes=2 ** 26,
+                   callback=None):
+    """Read the given rows and columns of a matrix stored in HDF5
+
+    The matrix is either a dense dataset, which is read in chunks of rows
+    of about chunk_bytes bytes, or a group with data, indices and indptr
+    of a CSR or CSC matrix (AnnData's encodings).
+
+    :param node: h5py.Dataset or h5py.Group
+    :param rows: np.ndarray, sorted row indices
+    :param cols: np.ndarray, sorted column indices, or None for all
+    :param sparse: bool, return a CSR matrix instead of an array
+    :param chunk_bytes: int
+    :param callback: callable(float), called with the fraction of rows read
+    :return: sp.csr_matrix or np.ndarray
+    """
+    if isinstance(node, h5py.Group):
+        fmt = _h5_attr(node, "encoding-type", "h5sparse_format",
+                       default="csr")
+        shape = tuple(_h5_attr(node, "shape", "h5sparse_shape"))
+        indptr = node["indptr"][:]
+        if fmt.startswith("csc"):
+            columns = np.arange(shape[1]) if cols is None else cols
+            data, indices, indptr = read_h5_columns(
+                node["data"], node["indices"], indptr, columns,
+                callback=callback)
+            X = sp.csr_matrix((data, indices, indptr),
+                              shape=(len(columns), shape[0]))
+            X = X.T.tocsr()[rows]
+        else:
+            data, indices, indptr = read_h5_columns(
+                node["data"], node["indices"], indptr, rows,
+                callback=callback)
+            X = sp.csr_matrix((data, indices, indptr),
+                              shape=(len(rows), shape[1]))
+            if cols is not None:
+                X = X[:, cols]
+        X = X.astype(float)
+        return X if sparse else X.toarray()
+
+    n_cols = node.shape[1] if cols is None else len(cols)
+    step = max(1, chunk_bytes // max(1, node.shape[1] * node.dtype.itemsize))
+    blocks = []
+    for start in range(0, len(rows), step):
+        chunk = rows[start:start + step]
+        if chunk[-1] - chunk[0] + 1 == len(chunk):
+            block = node[chunk[0]:chunk[-1] + 1]
+        else:
+            block = node[chunk]
+        if cols is not None:
+            block = block[:, cols]
+        block = block.astype(float)
+        blocks.append(sp.csr_matrix(block) if sparse else block)
+        if callback is not None:
+            callback(min(start + step, len(rows)) / len(rows))
+    if not blocks:
+        return sp.csr_matrix((0, n_cols)) if sparse else np.empty((0, n_cols))
+    return sp.vstack(blocks, format="csr") if sparse else np.vstack(blocks)
+
+
+def read_h5_frame(node):
+    """Read a data frame (AnnData's obs or var) stored in HDF5
+
+    Categorical columns are returned as tuples (codes, categories).
+
+    :param node: h5py.Group (AnnData >= 0.7) or compound h5py.Dataset
+    :return: tuple (str, np.ndarray, dict), name and values of the index
+        and the remaining columns
+    """
+    columns = {}
+    if isinstance(node, h5py.Dataset):
+        frame = node[:]
+        names = frame.dtype.names
+        index_name = "index" if "index" in names else names[0]
+        uns = node.file.get("uns", {})
+        for name in names:
+            if name == index_name:
+                continue
+            if name + "_categories" in uns:
+                columns[name] = (
+                    frame[name], _h5_strings(uns[name + "_categories"]))
+            else:
+                columns[name] = frame[name]
+        return index_name, _h5_strings(frame[index_name]), columns
+
+    index_name = _h5_attr(node, "_index", default="_index")
+    order = _h5_attr(node, "column-order", default=[])
+    if not len(order):
+        order = [name for name in node if name not in
+                 (index_name, "__categories")]
+    for name in order:
+        name = name.decode("utf-8") if isinstance(name, bytes) else name
+        item = node[name]
+        if isinstance(item, h5py.Group):
+            # AnnData >= 0.8
+            columns[name] = (item["codes"][:], _h5_strings(item["categories"]))
+        elif "categories" in item.attrs:
+            # AnnData 0.7 stores a reference to categories
+            categories = node.file[item.attrs["categories"]]
+            columns[name] = (item[:], _h5_strings(categories))
+        else:
+            columns[name] = item[:]
+    return index_name, _h5_strings(node[index_name]), columns
+
+
+def _frame_metas(index_name, index, columns, rows):
+    """Meta variables and values of the given rows of a data frame"""
+    metas = [StringVariable.make(str(index_name).strip("_") or "Index")]
+    values = [index[rows]]
+    for name, column in columns.items():
+        if isinstance(column, tuple):
+            codes, categories = column
+            var = DiscreteVariable(name, values=[str(c) for c in categories])
+            col = codes[rows].astype(float)
+            col[col < 0] = np.nan
+        elif column.dtype.kind in "biuf":
+            var = ContinuousVariable.make(name)
+            col = column[rows].astype(float)
+        else:
+            var = StringVariable.make(name)
+            col = np.array([v.decode("utf-8") if isinstance(v, bytes)
+                            else str(v) for v in column[rows]], dtype=object)
+        metas.append(var)
+        values.append(col)
+    return metas, np.column_stack(values).astype(object) if values else None
+
+
+def compact_meta_column(name, values, max_categories):
+    """Meta variable and values of a column with shared values
+
+    Columns with at most max_categories distinct values (which repeat)
+    become DiscreteVariable with float codes; others become StringVariable
+    whose equal values are a single (interned) str object.
+
+    :param name: str
+    :param values: np.ndarray
+    :param max_categories: int
+    :return: tuple (Variable, np.ndarray)
+    """
+    series = pd.Series(values)
+    missing = series.isnull().values
+    codes = np.full(len(series), -1, dtype=np.intp)
+    codes[~missing], uniques = pd.factorize(
+        series[~missing].astype(str).values, sort=True)
+    if len(uniques) <= max_categories and len(uniques) < len(series):
+        var = DiscreteVariable(name, values=list(uniques))
+        col = codes.astype(float)
+        col[missing] = np.nan
+        return var, col
+    lookup = np.empty(len(uniques) + 1, dtype=object)
+    lookup[:-1] = [sys.intern(u) for u in uniques]
+    lookup[-1] = StringVariable.Unknown
+    return StringVariable.make(name), lookup[codes]
+
+
+def _frame_attributes(names, columns, cols):
+    """Attributes with annotations from the given rows of a data frame"""
+    attrs = [ContinuousVariable.make(str(name)) for name in names[cols]]
+    for key, column in columns.items():
+        if isinstance(column, tuple):
+            codes, categories = column
+            values = [str(categories[c]) if c >= 0 else ""
+                      for c in codes[cols]]
+        else:
+            values = [v.decode("utf-8") if isinstance(v, bytes) else str(v)
+                      for v in column[cols]]
+        for var, value in zip(attrs, values):
+            var.attributes[key] = value
+    return attrs
+
+
+#: key of the schema metadata with roles and annotations of variables
+PARQUET_METADATA = b"orange.domain"
+
+
+def write_parquet(file_name, data, row_group_size=2 ** 16):
+    """Write a table into a Parquet file
+
+    Attributes are written as numeric columns of the table's dtype, and
+    class variables and metas as numeric, string or dictionary-encoded
+    (discrete) columns; roles and annotations of variables are kept in the
+    schema's metadata. Sparse data is densified one column of a row group
+    at a time.
+
+    :param file_name: str
+    :param data: Table
+    :param row_group_size: int, number of rows per row group
+    """
+    if pq is None:
+        raise ImportError("Writing Parquet files requires pyarrow")
+    domain = data.domain
+    roles = [(var, "attribute") for var in domain.attributes] + \
+        [(var, "class") for var in domain.class_vars] + \
+        [(var, "meta") for var in domain.metas]
+    columns = [[var.name, role, dict(var.attributes)] for var, role in roles]
+    metadata = json.dumps(columns, default=_json_value).encode("utf-8")
+    x_type = pa.from_numpy_dtype(data.X.dtype)
+    schema = pa.schema(
+        [pa.field(var.name, x_type) for var in domain.attributes] +
+        [pa.field(var.name, _arrow_type(var)) for var, _ in
+         roles[len(domain.attributes):]],
+        metadata={PARQUET_METADATA: metadata})
+    with pq.ParquetWriter(file_name, schema) as writer:
+        for start in range(0, len(data), row_group_size):
+            part = data[start:start + row_group_size]
+            arrays = [pa.array(column, type=x_type)
+                      for column in _matrix_columns(part.X)]
+            arrays += [_arrow_array(var, part.get_column_view(var)[0])
+                       for var, _ in roles[len(domain.attributes):]]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def _matrix_columns(X):
+    """Columns of a (sparse) matrix as dense arrays, one at a time"""
+    if not sp.issparse(X):
+        for i in range(X.shape[1]):
+            yield X[:, i]
+        return
+    X = X.tocsc()
+    for i in range(X.shape[1]):
+        column = np.zeros(X.shape[0], dtype=X.dtype)
+        begin, end = X.indptr[i], X.indptr[i + 1]
+        column[X.indices[begin:end]] = X.data[begin:end]
+        yield column
+
+
+def _arrow_matrix(table, names, sparse):
+    """Matrix with the given numeric columns of an Arrow table
+
+    A sparse matrix is assembled from non-zero values of each column, so
+    the dense matrix is never allocated.
+
+    :param table: pa.Table
+    :param names: list of str
+    :param sparse: bool
+    :return: np.ndarray or sp.csr_matrix
+    """
+    if not sparse:
+        X = np.empty((table.num_rows, len(names)))
+        for i, name in enumerate(names):
+            X[:, i] = table.column(name).to_numpy()
+        return X
+    data, indices, indptr = [], [], [0]
+    for name in names:
+        column = table.column(name).to_numpy()
+        nonzero = np.flatnonzero(column)
+        data.append(column[nonzero].astype(float))
+        indices.append(nonzero)
+        indptr.append(indptr[-1] + len(nonzero))
+    return sp.csc_matrix(
+        (np.concatenate(data) if data else np.empty(0),
+         np.concatenate(indices) if indices else np.empty(0, dtype=int),
+         indptr), shape=(table.num_rows, len(names))).tocsr()
+
+
+def _json_value(value):
+    return value.item() if isinstance(value, np.generic) else str(value)
+
+
+def _arrow_type(var):
+    if var.is_discrete:
+        return pa.dictionary(pa.int32(), pa.string())
+    if var.is_string:
+        return pa.string()
+    return pa.float64()
+
+
+def _arrow_array(var, values):
+    """Arrow array with values of a variable"""
+    if var.is_discrete:
+        values = values.astype(float)
+        missing = np.isnan(values)
+        codes = pa.array(np.where(missing, 0, values).astype(np.int32),
+                         mask=missing)
+        return pa.DictionaryArray.from_arrays(
+            codes, pa.array([str(v) for v in var.values], type=pa.string()))
+    if var.is_string:
+        return pa.array([None if v is None or v != v else str(v)
+                         for v in values], type=pa.string())
+    return pa.array(values.astype(float), type=pa.float64())
+
+
+def parquet_columns(schema):
+    """Names, roles and annotations of columns of a Parquet file
+
+    Files not written by write_parquet have numeric columns as attributes
+    and other columns as metas.
+
+    :param schema: pa.Schema
+    :return: list of tuples (name, role, annotations); role is
+        "attribute", "class" or "meta"
+    """
+    metadata = schema.metadata or {}
+    if PARQUET_METADATA in metadata:
+        return [tuple(column)
+                for column in json.loads(metadata[PARQUET_METADATA])]
+    return [(field.name,
+             "attribute" if pa.types.is_integer(field.type) or
+             pa.types.is_floating(field.type) else "meta", {})
+            for field in schema]
+
+
+def _arrow_variable(name, column):
+    """Variable and values of a (chunked) Arrow column"""
+    if pa.types.is_dictionary(column.type):
+        categories = pd.unique(np.concatenate(
+            [chunk.dictionary.to_numpy(zero_copy_only=False)
+             for chunk in column.chunks] or [np.array([], dtype=object)]))
+        values = column.cast(pa.string()).to_numpy(zero_copy_only=False)
+        var = DiscreteVariable(name, values=[str(c) for c in categories])
+        col = pd.Categorical(values, categories=categories).codes \
+            .astype(float)
+        col[col < 0] = np.nan
+        return var, col
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+        return ContinuousVariable.make(name), \
+            column.to_numpy().astype(float)
+    values = column.cast(pa.string()).to_numpy(zero_copy_only=False)
+    values[pd.isnull(values)] = StringVariable.Unknown
+    return StringVariable.make(name), values.astype(object)
+
+
+def write_npz(file_name, data):
+    """Write a table into an uncompressed .npz archive
+
+    X (or the arrays of a CSR matrix), Y and W are stored as .npy members,
+    which can be memory-mapped; the domain and metas are pickled into a
+    separate member, together with the table's attributes.
+
+    :param file_name: str
+    :param data: Table
+    """
+    arrays = {}
+    if sp.issparse(data.X):
+        X = data.X.tocsr()
+        arrays.update({"X.data": X.data, "X.indices": X.indices,
+                       "X.indptr": X.indptr, "X.shape": np.array(X.shape)})
+    else:
+        arrays["X"] = data.X
+    arrays["Y"] = np.asarray(data.Y, dtype=float).reshape(len(data), -1)
+    if data.has_weights():
+        arrays["W"] = data.W
+    state = pickle.dumps((data.domain, data.metas, data.attributes),
+                         protocol=pickle.HIGHEST_PROTOCOL)
+    arrays["domain"] = np.frombuffer(state, dtype=np.uint8)
+    with open(file_name, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def load_npz(file_name, mmap_mode="r"):
+    """Arrays of an .npz archive, memory-mapped unless compressed
+
+    :param file_name: str
+    :param mmap_mode: str, see np.memmap
+    :return: dict of np.ndarray
+    """
+    arrays = {}
+    with zipfile.ZipFile(file_name) as archive, \
+            open(file_name, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") \
+                else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            # data of a stored member follows its local header
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = \
+                    np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = \
+                    np.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                raise ValueError("Object arrays cannot be memory-mapped")
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(
+                f, dtype=dtype, mode=mmap_mode, shape=shape,
+                order="F" if fortran else "C", offset=f.tell())
+    return arrays
+
+
+def _npz_matrix(arrays):
+    """X of arrays written by write_npz, without copying"""
+    if "X.shape" in arrays:
+        return sp.csr_matrix(
+            (arrays["X.data"], arrays["X.indices"], arrays["X.indptr"]),
+            shape=tuple(arrays["X.shape"]), copy=False)
+    return arrays["X"]
+
+
+def read_annotations(file_name, header=0, names=None):
+    """Read an annotation file and index its rows by the first column
+
+    Parsed files (and their indices) are kept until they are modified.
+
+    :param file_name: str
+    :param header: row number(s) of the header or None
+    :param names: list of column names or None
+    :return: tuple (pd.DataFrame, pd.Index of str); the frame is shared
+        and must not be modified
+    """
+    st = os.stat(file_name)
+    return _read_annotations(file_name, st.st_mtime_ns, st.st_size, header,
+                             None if names is None else tuple(names))
+
+
+@lru_cache(maxsize=4)
+def _read_annotations(file_name, mtime, size, header, names):
+    df = pd.read_csv(file_name, sep=separator_from_filename(file_name),
+                     header=header, names=names)
+    ids = df.iloc[:, 0].astype(str).values if df.shape[1] else []
+    return df, pd.Index(ids)
+
+
+def annotation_positions(ids, labels):
+    """Positions of labels in an annotation index
+
+    :param ids: pd.Index of str
+    :param labels: sequence of loaded row or column labels
+    :return: np.ndarray or None if ids are not unique or some labels
+        are missing
+    """
+    if not len(labels) or not ids.is_unique:
+        return None
+    positions = ids.get_indexer(pd.Index(labels).astype(str))
+    if np.any(positions < 0):
+        return None
+    return positions
+
+
+class DataCache:
+    """Persistent cache of parsed expression matrices
+
+    Every entry is a directory holding the data matrix (X.npy, or the
+    arrays of a CSR matrix in X.data.npy, X.indices.npy, X.indptr.npy and
+    X.shape.npy) and a pickled dictionary with the remaining values. The
+    least recently used entries are removed when the cache grows over
+    max_size bytes.
+    """
+    MAX_SIZE = 4 * 2 ** 30
+    # part of keys; increase when the layout of entries or their state
+    # changes, so entries of older versions are not read
+    FORMAT_VERSION = 2
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    @classmethod
+    def key(cls, file_name, params):
+        """Key of a file parsed with the given (hashable) parameters
+
+        :param file_name: str
+        :param params: tuple
+        :return: str
+        """
+        st = os.stat(file_name)
+        identity = (cls.FORMAT_VERSION, os.path.abspath(file_name),
+                    st.st_size, st.st_mtime_ns, params)
+        return hashlib.sha1(repr(identity).encode("utf-8")).hexdigest()
+
+    def get(self, key, mmap_mode=None):
+        """Return (X, state) stored under key or None
+
+        With mmap_mode (see np.load), X is backed by memory-mapped files
+        in the cache: an np.memmap or a CSR matrix of three of them.
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(path, "state.pkl"), "rb") as f:
+                state = pickle.load(f)
+            if os.path.exists(os.path.join(path, "X.npz")):
+                X = sp.load_npz(os.path.join(path, "X.npz"))
+            elif os.path.exists(os.path.join(path, "X.indptr.npy")):
+                data, indices, indptr, shape = (
+                    np.load(os.path.join(path, "X.{}.npy".format(name)),
+                            mmap_mode=mmap_mode)
+                    for name in ("data", "indices", "indptr", "shape"))
+                X = sp.csr_matrix((data, indices, indptr),
+                                  shape=tuple(shape), copy=False)
+            else:
+                X = np.load(os.path.join(path, "X.npy"), mmap_mode=mmap_mode)
+            os.utime(path)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return None
+        return X, state
+
+    def put(self, key, X, state, callback=None):
+        """Store X and state under key and evict old entries
+
+        :param callback: callable(float) or None, called with the fraction
+            of X written; it may raise an exception to stop writing
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        except OSError:
+            return
+        try:
+            if sp.issparse(X):
+                X = X.tocsr()
+                arrays = {"X.data.npy": X.data, "X.indices.npy": X.indices,
+                          "X.indptr.npy": X.indptr,
+                          "X.shape.npy": np.array(X.shape)}
+            else:
+                arrays = {"X.npy": X}
+            total = sum(array.nbytes for array in arrays.values()) or 1
+            written = 0
+            for name, array in arrays.items():
+                def progress(n_bytes, start=written):
+                    callback((start + n_bytes) / total)
+
+                save_array(os.path.join(tmp_path, name), array,
+                           progress if callback is not None else None)
+                written += array.nbytes
+            with open(os.path.join(tmp_path, "state.pkl"), "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        except (OSError, ValueError):
+            # write failed or the entry has been stored concurrently
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        except BaseException:
+            # stopped by the callback
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries exceeding max_size"""
+        entries = []
+        try:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.startswith(".") or not os.path.isdir(path):
+                    continue
+                size = sum(os.path.getsize(os.path.join(path, f))
+                           for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def save_array(file_name, array, callback=None, chunk_size=2 ** 24):
+    """Save an array into a .npy file in chunks of chunk_size bytes
+
+    :param file_name: str
+    :param array: np.ndarray
+    :param callback: callable(int) or None, called with the number of
+        bytes written after every chunk; it may raise an exception to
+        stop writing
+    :param chunk_size: int
+    """
+    array = np.asarray(array)
+    # the data of F-contiguous arrays is written in their (Fortran) order
+    flat = array.T if array.flags.f_contiguous and \
+        not array.flags.c_contiguous else array
+    if callback is None or not flat.flags.c_contiguous or \
+            array.dtype.hasobject:
+        np.save(file_name, array, allow_pickle=False)
+        if callback is not None:
+            callback(array.nbytes)
+        return
+    data = memoryview(flat.reshape(-1)).cast("B")
+    with open(file_name, "wb") as f:
+        np.lib.format.write_array_header_1_0(
+            f, np.lib.format.header_data_from_array_1_0(array))
+        for start in range(0, len(data), chunk_size):
+            f.write(data[start:start + chunk_size])
+            callback(min(start + chunk_size, len(data)))
+
+
+_data_cache = None
+
+
+def data_cache():
+    """Get the cache of parsed files shared by all loaders
+
+    :return: DataCache
+    """
+    global _data_cache
+    if _data_cache is None:
+        _data_cache = DataCache(
+            os.path.join(cache_dir(), "single_cell", "loaded_data"))
+    return _data_cache
+
+
+def count_lines(file_name):
+    """Count lines of a (possibly compressed) file
+
+    :param file_name: str
+    :return: int
+    """
+    n_lines, last = 0, b"\n"
+    with open_with_progress(file_name) as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            n_lines += block.count(b"\n")
+            last = block[-1:]
+    return n_lines + (last != b"\n")
+
+
+_DECOMPRESSORS = {
+    Compression.GZIP: lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    Compression.BZIP2: bz2.BZ2Decompressor,
+    Compression.XZ: lzma.LZMADecompressor,
+}
+
+
+def _read_compressed_head(f, ext, size, chunk_size=2 ** 10):
+    """Decompress (at least) size bytes from the start of a file
+
+    The compression ratio is measured on the second half of the data read
+    (at least four chunks) that follows the first line: the output of a
+    decompressor lags behind its input, and a long header compresses
+    differently than the values.
+
+    :param f: compressed file opened in binary mode
+    :param ext: str, compression extension
+    :param size: int
+    :param chunk_size: int, size of compressed chunks
+    :return: tuple (bytes, int, float), decompressed data, the number of
+        compressed bytes it was decompressed from and the ratio of
+        decompressed to compressed sizes
+    """
+    new_decompressor = _DECOMPRESSORS[ext]
+    decompressor = new_decompressor()
+    parts, n_out, consumed = [], 0, 0
+    progress = []
+    while n_out < size or len(progress) < 4:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        consumed += len(data)
+        while data:
+            out = decompressor.decompress(data)
+            parts.append(out)
+            n_out += len(out)
+            data = b""
+            if decompressor.eof:
+                # multi-member (e.g. BGZF) files
+                data = decompressor.unused_data
+                decompressor = new_decompressor()
+        progress.append((consumed, n_out))
+    data = b"".join(parts)
+    header_end = data.find(b"\n") + 1
+    start_in, start_out = next(
+        ((c, n) for c, n in progress
+         if 2 * c >= consumed and n > header_end), (consumed, n_out))
+    if start_in < consumed and start_out < n_out:
+        ratio = (n_out - start_out) / (consumed - start_in)
+    else:
+        ratio = n_out / max(consumed, 1)
+    return data, consumed, ratio
+
+
+def _read_head(f, ext, size, min_lines):
+    """Read (at least) size bytes from the start of a file, and more until
+    they include min_lines line ends or the whole file
+
+    :param f: file opened in binary mode
+    :param ext: str, compression extension or None
+    :param size: int
+    :param min_lines: int
+    :return: tuple (bytes, int, float), (decompressed) data, the number of
+        bytes it was read from and the compression ratio
+    """
+    while True:
+        f.seek(0)
+        if ext:
+            head, consumed, ratio = _read_compressed_head(f, ext, size)
+        else:
+            head = f.read(size)
+            consumed, ratio = len(head), 1
+        if head.count(b"\n") >= min_lines or len(head) < size:
+            return head, consumed, ratio
+        size *= 2
+
+
+def _read_lines_block(f, offset, size, blocked):
+    """Read a block at offset which includes at least two line ends
+    (unless the file ends), so it contains a complete line"""
+    if blocked:
+        offset = bgzf.find_block(f, offset)
+        block = b""
+        while offset is not None and block.count(b"\n") < 2:
+            data, offset = bgzf.read_block(f, offset)
+            block += data
+        return block
+    f.seek(offset)
+    block = f.read(size)
+    while block.count(b"\n") < 2:
+        more = f.read(len(block) or size)
+        if not more:
+            break
+        block += more
+    return block
+
+
+def probe_lines(file_name, n_blocks=8, block_size=2 ** 16, seed=42):
+    """Get the first line, a sample of other lines and their number
+
+    Files shorter than n_blocks * block_size bytes are read whole.
+    Otherwise the number of lines is estimated from the average line
+    length: uncompressed and BGZF files are sampled in n_blocks blocks at
+    random offsets. The size of a compressed file is extrapolated from
+    the compression ratio observed while reading its head, unless it is
+    known from a BGZF block index. The head and the blocks are read
+    further until they contain complete lines, so files with lines longer
+    than a block are sampled as well.
+
+    :param file_name: str
+    :param n_blocks: int
+    :param block_size: int
+    :param seed: int
+    :return: tuple (bytes, list of bytes, int, bool), the first line,
+        sampled lines, number of lines following the first line and
+        whether this number is exact
+    """
+    budget = n_blocks * block_size
+    ext = os.path.splitext(file_name)[1]
+    compressed = ext in Compression.all
+    blocked = ext == Compression.GZIP and bgzf.is_bgzf(file_name)
+    file_size = os.path.getsize(file_name)
+    with open(file_name, "rb") as f:
+        # the header and n_blocks lines
+        head, consumed, ratio = _read_head(
+            f, ext if compressed else None, budget, n_blocks + 1)
+        exact = consumed >= file_size
+        if compressed:
+            total_size = blocked and bgzf.uncompressed_size(file_name) or \
+                len(head) + (file_size - consumed) * ratio
+        else:
+            total_size = file_size
+
+        header_end = head.find(b"\n") + 1 or len(head)
+        header, head = head[:header_end], head[header_end:]
+        if exact:
+            lines = head.splitlines()
+            return header, lines, len(lines), True
+
+        body = head[:head.rfind(b"\n") + 1]
+        n_sampled, sample_size = body.count(b"\n"), len(body)
+        lines = body.splitlines()
+        if not compressed or blocked:
+            rstate = np.random.RandomState(seed)
+            high = max(consumed + 1, file_size - block_size)
+            for offset in np.sort(rstate.randint(consumed, high, n_blocks)):
+                block = _read_lines_block(f, offset, block_size, blocked)
+                start, end = block.find(b"\n") + 1, block.rfind(b"\n") + 1
+                if start < end:
+                    n_sampled += block.count(b"\n", start, end)
+                    sample_size += end - start
+                    lines.extend(block[start:end].splitlines())
+    n_lines = round((total_size - header_end) * n_sampled / sample_size) \
+        if sample_size else 0
+    return header, lines, n_lines, False
+
+
+def read_head(file_name, n_lines, line_size=2 ** 16, max_size=2 ** 26):
+    """Read the first lines of a (possibly compressed) file
+
+    Lines longer than line_size bytes are truncated. Compressed files are
+    only decompressed up to the last line read, or up to max_size bytes.
+
+    :param file_name: str
+    :param n_lines: int
+    :param line_size: int
+    :param max_size: int
+    :return: tuple (list of bytes, list of bool), lines without line
+        endings and whether they were truncated
+    """
+    lines, truncated, size = [], [], 0
+    with open_compressed(file_name, "rb") as f:
+        while len(lines) < n_lines and size < max_size:
+            line = rest = f.readline(line_size)
+            if not line:
+                break
+            size += len(line)
+            # skip the remainder of a long line
+            while rest and not rest.endswith(b"\n") and size < max_size:
+                rest = f.readline(line_size)
+                size += len(rest)
+            lines.append(line.rstrip(b"\r\n"))
+            truncated.append(not line.endswith(b"\n") and bool(rest))
+    return lines, truncated
+
+
+Preview = namedtuple(
+    "Preview",
+    ["table", "header_rows_count", "header_cols_count", "transposed"]
+)
+
+_BARCODE = re.compile(r"^[ACGTN]{8,}(-\d+)?$")
+_GENE_ID = re.compile(r"^ENS[A-Z]*G\d{6,}(\.\d+)?$")
+
+
+def _matching(labels, pattern):
+    """Return True if most of the labels match the pattern"""
+    labels = [label for label in labels if label]
+    return bool(labels) and \
+        sum(bool(pattern.match(label)) for label in labels) > len(labels) / 2
+
+
+def sample_mask(n, p, rstate, n_leading=4):
+    """Mask of sampled items
+
+    The first n_leading items are always kept and each of the others
+    is kept if a uniform draw from [0, 100) is at most p. All values are
+    drawn at once, yet in the same order as item by item.
+
+    :param n: int, number of items
+    :param p: float, percentage of sampled items
+    :param rstate: np.random.RandomState
+    :param n_leading: int
+    :return: np.ndarray of bool
+    """
+    mask = np.ones(n, dtype=bool)
+    if n > n_leading:
+        mask[n_leading:] = rstate.uniform(0, 100, n - n_leading) <= p
+    return mask
+
+
+class RowSampler:
+    """Mask of sampled items of unknown number, drawn as items are read
+
+    Used only when the number of items is not known yet; otherwise the
+    mask is drawn at once by sample_mask. `take` returns the mask of a
+    block of items. Values are drawn in blocks, in the same order as by
+    sample_mask, so the same items are kept as if their number had been
+    known in advance.
+
+    :param p: float, percentage of sampled items
+    :param rstate: np.random.RandomState
+    :param n_leading: int
+    """
+    BLOCK_SIZE = 2 ** 16
+
+    def __init__(self, p, rstate, n_leading=4):
+        self.p = p
+        self.rstate = rstate
+        self.n = 0  # number of items read so far
+        self._mask = np.ones(n_leading, dtype=bool)
+
+    def take(self, start, n):
+        """Mask of n items from the start-th on
+
+        :return: np.ndarray of bool
+        """
+        end = start + n
+        while end > len(self._mask):
+            size = max(self.BLOCK_SIZE, len(self._mask))
+            self._mask = np.concatenate(
+                (self._mask, self.rstate.uniform(0, 100, size) <= self.p))
+        self.n = max(self.n, end)
+        return self._mask[start:end]
+
+    def mask(self):
+        """Mask of the items read so far
+
+        :return: np.ndarray of bool
+        """
+        return self._mask[:self.n].copy()
+
+
+def _lines_mask(rows_mask, start, n):
+    """Mask of n lines from the start-th on; lines not covered by an
+    array mask are kept
+
+    :param rows_mask: np.ndarray or RowSampler
+    :return: np.ndarray of bool
+    """
+    if isinstance(rows_mask, RowSampler):
+        return rows_mask.take(start, n)
+    mask = np.ones(n, dtype=bool)
+    known = rows_mask[start:start + n]
+    mask[:len(known)] = known
+    return mask
+
+
+def load_to_file(loader, directory, cancelled=None, progress=None, key=None):
+    """Load data and store its matrix into a file in directory
+
+    Meant to run in a worker process: the data matrix is passed to the
+    parent through the file, so only the domain, metas and errors are
+    pickled.
+
+    :param loader: Loader
+    :param directory: str
+    :param cancelled: Event (e.g. from multiprocessing.Manager); loading
+        is aborted with KeyboardInterrupt once it is set
+    :param progress: Queue into which tuples (key, fraction of the file
+        read) are put as loading proceeds
+    :param key: identifies the sample in progress
+    :return: tuple ((Domain, str, np.ndarray) or None, dict)
+    """
+    reported = [0]
+
+    def callback(finished):
+        if cancelled is not None and cancelled.is_set():
+            raise KeyboardInterrupt()
+        if progress is not None and finished - reported[0] >= 0.01:
+            reported[0] = finished
+            progress.put((key, finished))
+
+    table = loader(callback=callback)
+    if table is None:
+        return None, loader.errors
+    suffix = ".npz" if sp.issparse(table.X) else ".npy"
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        if sp.issparse(table.X):
+            sp.save_npz(f, table.X, compressed=False)
+        else:
+            np.save(f, table.X)
+    return (table.domain, path, table.metas), loader.errors
+
+
+def table_from_file(domain, path, metas):
+    """Create a table from the result of load_to_file and remove the file
+
+    :param domain: Domain
+    :param path: str
+    :param metas: np.ndarray
+    :return: Table
+    """
+    try:
+        X = sp.load_npz(path) if path.endswith(".npz") else np.load(path)
+    finally:
+        os.remove(path)
+    return Table.from_numpy(domain, X, None, metas)
+
+
 def get_data_loader(file_name):
     """Get instance of data loader according to file extension
 
@@ -34,12 +1384,22 @@ def get_data_loader(file_name):
         _, ext = os.path.splitext(base)
     if ext == ".mtx":
         return MtxLoader(file_name)
+    elif ext == ".h5":
+        return H5Loader(file_name)
+    elif ext == ".h5ad":
+        return AnnDataLoader(file_name)
+    elif ext == ".loom":
+        return LoomLoader(file_name)
     elif ext == ".count":
         return CountLoader(file_name)
     elif ext == ".csv":
         return CsvLoader(file_name)
     elif ext in (".pkl", ".pickle"):
         return PickleLoader(file_name)
+    elif ext == ".parquet":
+        return ParquetLoader(file_name)
+    elif ext == ".npz":
+        return NpzLoader(file_name)
     else:
         return Loader(file_name)
 
@@ -49,10 +1409,31 @@ class Loader:
     files, if present) and creates Orange.data.Table out of its data
     """
     separator = "\t"
+    # files with a larger (estimated) share of zeros are read as sparse
+    SPARSITY_THRESHOLD = 0.5
+    # matrices of larger files are memory-mapped from the data cache
+    MEMORY_MAP_THRESHOLD = 2 ** 30
+    # memory (in bytes) of a dense block parsed at once when reading a
+    # sparse matrix
+    CHUNK_BYTES = 2 ** 27
+    # blocks read to estimate the number of rows and sparsity
+    PROBE_BLOCKS = 8
+    PROBE_BLOCK_SIZE = 2 ** 16
+    # size of a preview
+    PREVIEW_ROWS = 20
+    PREVIEW_COLS = 20
+    # with compact_metas, meta columns with at most this many distinct
+    # values are stored as categorical
+    MAX_CATEGORIES = 1000
+    # precision of values (sparse matrices only, dense X is always float64)
+    FLOAT64, FLOAT32, INTEGER = range(3)
 
     def __init__(self, file_name=""):
         # file parameters
         self._file_name = file_name
+        self._n_rows_future = None  # type: Optional[Future]
+        self._approximate = False
+        self._preview_head = None
         self.file_size = None
         self.n_rows = None
         self.n_cols = None
@@ -61,6 +1442,9 @@ class Loader:
         self._set_file_parameters()
 
         # reading parameters
+        self.sparse = None  # None: decide according to sparsity
+        self.use_cache = True
+        self.memory_map = None  # None: decide according to file size
         self._leading_cols = 0
         self._leading_rows = 0
         self._use_rows_mask = None
@@ -80,6 +1464,8 @@ class Loader:
         self.sample_cols_enabled = None
         self.sample_rows_p = None
         self.sample_cols_p = None
+        self.precision = None  # None: FLOAT64
+        self.compact_metas = None  # None: False
         self.row_annotations_enabled = True
         self.row_annotation_file = None
         self.col_annotations_enabled = True
@@ -89,6 +1475,67 @@ class Loader:
         self.errors = {}  # type: Dict[str, Tuple]
         self.__reset_error_messages()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # store the line count if it has been finished
+        state["_n_rows"] = self.n_rows
+        state["_approximate"] = self.approximate
+        state["_n_rows_future"] = None
+        state["_preview_head"] = None
+        return state
+
+    def __setstate__(self, state):
+        # loaders pickled by older versions
+        if "n_rows" in state:
+            state["_n_rows"] = state.pop("n_rows")
+        state.setdefault("_n_rows_future", None)
+        state.setdefault("_approximate", False)
+        state.setdefault("_preview_head", None)
+        state.setdefault("precision", None)
+        state.setdefault("compact_metas", None)
+        state.setdefault("sparse", None)  # None: decide according to sparsity
+        state.setdefault("use_cache", True)  # as in __init__
+        state.setdefault("memory_map", None)  # None: by file size
+        self.__dict__.update(state)
+
+    @property
+    def n_rows(self):
+        future = self._n_rows_future
+        if future is not None and future.done() and not future.exception():
+            return future.result()
+        return self._n_rows
+
+    @n_rows.setter
+    def n_rows(self, value):
+        self._n_rows = value
+
+    @property
+    def approximate(self):
+        """True if n_rows and sparsity are estimated from a part of file"""
+        future = self._n_rows_future
+        if future is not None and future.done() and not future.exception():
+            return False
+        return self._approximate
+
+    def count_rows(self):
+        """Count rows of the file in a background thread if n_rows is
+        only an estimate.
+
+        :return: Future with the exact number of rows or None
+        """
+        if self._n_rows_future is None and self._approximate:
+            future = Future()
+
+            def count(file_name=self._file_name):
+                try:
+                    future.set_result(count_lines(file_name) - 1)
+                except Exception as ex:  # pylint: disable=broad-except
+                    future.set_exception(ex)
+
+            self._n_rows_future = future
+            threading.Thread(target=count, daemon=True).start()
+        return self._n_rows_future
+
     @property
     def n_genes(self):
         return self.n_rows if self.transposed else self.n_cols
@@ -123,73 +1570,371 @@ class Loader:
 
     def _set_file_parameters(self):
         try:
-            with open_compressed(self._file_name, "rt", encoding="latin-1") as f:
-                line = next(csv.reader(f, delimiter=self.separator))
-                self.n_cols = len(line)
-                self.n_rows = sum(1 for _ in f)
+            header, lines, n_lines, exact = probe_lines(
+                self._file_name, self.PROBE_BLOCKS, self.PROBE_BLOCK_SIZE)
+            line = next(csv.reader([header.decode("latin-1")],
+                                   delimiter=self.separator))
+            self.n_cols = len(line)
+            self.n_rows = n_lines
+            self._approximate = not exact
         except Exception:
-            pass
+            return
 
         try:
-            self.__set_sparsity()
+            self.__set_sparsity([l.decode("latin-1") for l in lines])
         except Exception:
             pass
 
-    def __set_sparsity(self):
-        """Get approximate sparsity if number of columns is bigger than 100."""
-        if self.n_cols is not None and self.n_rows is not None:
-            max_c = 100
-            np.random.seed(42)
+    def __set_sparsity(self, lines):
+        """Get approximate sparsity from (at most 1000) sampled lines and
+        (at most 100) random columns."""
+        if self.n_cols is not None and lines:
+            max_c, max_r = 100, 1000
+            rstate = np.random.RandomState(42)
             use_cols = np.arange(1, self.n_cols - 1) if self.n_cols < max_c \
-                else np.random.randint(1, self.n_cols - 1, max_c)
+                else rstate.randint(1, self.n_cols - 1, max_c)
 
+            lines = lines[::int(np.ceil(len(lines) / max_r))]
             data = np.genfromtxt(
-                self._file_name, delimiter=self.separator,
-                skip_header=1, usecols=use_cols, max_rows=max_c)
+                lines, delimiter=self.separator, usecols=use_cols)
 
             non_zero_el = np.count_nonzero(data)
-            all_el = data.shape[0] * data.shape[1]
+            all_el = data.size
             self.sparsity = (all_el - non_zero_el) / all_el
 
-    def _load_data(self, skip_row=None, header_rows=None, header_cols=None,
-                   use_cols=None, **kwargs):
-        df = pd.read_csv(
-            self._file_name, sep=self.separator, index_col=header_cols,
-            header=header_rows, skiprows=skip_row, usecols=use_cols
+    def is_memory_mapped(self):
+        """Return True if X should be memory-mapped from the data cache"""
+        if self.memory_map is not None:
+            return self.memory_map
+        return self.file_size is not None and \
+            self.file_size >= self.MEMORY_MAP_THRESHOLD
+
+    def is_sparse(self):
+        """Return True if data should be read into a sparse matrix"""
+        if self.sparse is not None:
+            return self.sparse
+        return self.sparsity is not None and \
+            self.sparsity >= self.SPARSITY_THRESHOLD
+
+    def _with_precision(self, X):
+        """Convert values of a sparse matrix to the chosen precision.
+
+        With INTEGER, non-negative integer values (raw counts) are stored
+        as uint16 or uint32; other values fall back to float32. Dense
+        matrices are converted to float64, which Table requires, so that
+        cached and memory-mapped arrays are not copied into the table.
+
+        :param X: np.ndarray or sp.csr_matrix
+        :return: np.ndarray or sp.csr_matrix
+        """
+        if not sp.issparse(X):
+            return X if X.dtype == np.float64 else X.astype(np.float64)
+        if not self.precision:
+            return X
+        dtype = np.float32
+        if self.precision == Loader.INTEGER:
+            data = X.data
+            if not data.size:
+                dtype = np.uint16
+            elif data.min() >= 0 and np.all(np.mod(data, 1) == 0):
+                dtype = np.uint16 if data.max() < 2 ** 16 else np.uint32
+        if X.dtype != dtype:
+            X = X.astype(dtype)
+        return X
+
+    def _load_data(self, header_rows=None, header_cols=None, callback=None,
+                   **kwargs):
+        skip_rows = use_cols = None
+        # with an unknown number of rows, the rows mask is drawn for each
+        # chunk of parsed rows
+        sampler = self._use_rows_mask \
+            if isinstance(self._use_rows_mask, RowSampler) else None
+        if self._use_rows_mask is not None and sampler is None:
+            skip_rows = np.flatnonzero(~self._use_rows_mask)
+        if self._use_cols_mask is not None:
+            use_cols = np.flatnonzero(self._use_cols_mask)
+        read_csv_kwargs = dict(
+            sep=self.separator, index_col=header_cols, header=header_rows,
+            skiprows=skip_rows, usecols=use_cols
         )
-        if skip_row is not None:
-            self._use_rows_mask = np.array(self._use_rows_mask, dtype=bool)
+        # gene-by-cell files are parsed directly into cells in rows
+        direct = self.transposed and header_rows == 0 and header_cols == 0
+        with open_with_progress(self._file_name, callback) as f:
+            if direct:
+                X, columns, index = read_transposed(
+                    f, self.separator, self._use_rows_mask, use_cols,
+                    self.is_sparse())
+            elif self.is_sparse():
+                X, columns, index = self._read_sparse(
+                    f, sampler, **read_csv_kwargs)
+            elif sampler is not None:
+                df = pd.concat(list(
+                    self._read_chunks(f, sampler, **read_csv_kwargs)))
+                X, columns, index = df.values, df.columns, df.index
+            else:
+                df = pd.read_csv(f, **read_csv_kwargs)
+                X, columns, index = df.values, df.columns, df.index
+        if sampler is not None:
+            # the whole file has been read, so its length is now known
+            self._use_rows_mask = sampler.mask()
+            self.n_rows = sampler.n - 1
+            self._approximate = False
+
         if self.transposed:
-            df = df.transpose()
+            if not direct:
+                X, columns, index = X.T, index, columns
             self._use_rows_mask, self._use_cols_mask = \
                 self._use_cols_mask, self._use_rows_mask
             self.leading_rows, self.leading_cols = \
                 self.leading_cols, self.leading_rows
+        if sp.issparse(X):
+            X = X.tocsr()
+
+        attrs = [ContinuousVariable.make(str(g)) for g in columns]
+
+        return attrs, X, pd.DataFrame(index=index), index
+
+    def preview(self, n_rows=None, n_cols=None):
+        """Parse the first rows and columns of the file
+
+        Only the head of the file is read (and decompressed), so previews
+        of large files are fast. The head is read once; later previews
+        (e.g. with changed settings) are built from what has been read.
+        Headers and transposition are inferred from the head; the table
+        uses the loader's settings and the inferred values for the
+        settings which have not been set.
+
+        :param n_rows: int, number of file rows (default: PREVIEW_ROWS)
+        :param n_cols: int, number of file columns (default: PREVIEW_COLS)
+        :return: Preview or None if the file cannot be previewed
+        """
+        key = n_rows or self.PREVIEW_ROWS, n_cols or self.PREVIEW_COLS
+        if self._preview_head is None or self._preview_head[0] != key:
+            self._preview_head = key, self._read_preview(*key)
+        return self._build_preview(self._preview_head[1])
+
+    def _read_preview(self, n_rows, n_cols):
+        """Read the head of the file for previews
+
+        :return: data for _build_preview or None
+        """
+        lines, truncated = read_head(self._file_name, n_rows)
+        cells = []
+        for line, cut in zip(lines, truncated):
+            text = line.decode("utf-8", errors="replace")
+            row = next(csv.reader([text], delimiter=self.separator), [])
+            cells.append(row[:-1] if cut else row)
+        width = min(max(map(len, cells), default=0), n_cols)
+        if width == 0:
+            return None
+        cells = np.array([row[:width] + [""] * (width - len(row[:width]))
+                          for row in cells], dtype=object)
+        numeric = pd.to_numeric(
+            pd.Series(cells.ravel()), errors="coerce").values.reshape(
+                cells.shape)
+        non_numeric = np.isnan(numeric) & (cells != "")
+
+        # spin boxes in the widget allow at most three headers
+        header_rows = 0
+        while header_rows < min(3, len(cells) - 1) and \
+                non_numeric[header_rows].mean() > 0.5:
+            header_rows += 1
+        header_cols = 0
+        while header_cols < min(3, width - 1) and \
+                non_numeric[header_rows:, header_cols].mean() > 0.5:
+            header_cols += 1
+
+        transposed = None
+        row_labels = cells[header_rows:, 0] if header_cols else []
+        col_labels = cells[0, header_cols:] if header_rows else []
+        if _matching(row_labels, _GENE_ID) or \
+                _matching(col_labels, _BARCODE):
+            transposed = True
+        elif _matching(row_labels, _BARCODE) or \
+                _matching(col_labels, _GENE_ID):
+            transposed = False
+        return cells, numeric, header_rows, header_cols, transposed
+
+    def _build_preview(self, head):
+        """Build a preview with the current settings from the data read
+        by _read_preview
+
+        :return: Preview or None
+        """
+        if head is None:
+            return None
+        cells, numeric, header_rows, header_cols, transposed = head
+        table = self.__preview_table(
+            cells, numeric,
+            header_rows if self.header_rows_count is None
+            else self.header_rows_count,
+            header_cols if self.header_cols_count is None
+            else self.header_cols_count,
+            bool(transposed if self.transposed is None
+                 else self.transposed)
+        )
+        return Preview(table, header_rows, header_cols, transposed)
 
-        attrs = [ContinuousVariable.make(str(g)) for g in df.columns]
-
-        return attrs, df.values, df.iloc[:, :0], df.index
+    @staticmethod
+    def __preview_table(cells, numeric, header_rows, header_cols,
+                        transposed):
+        X = numeric[header_rows:, header_cols:]
+        names = cells[:header_rows, header_cols:]
+        labels = cells[header_rows:, :header_cols]
+        label_names = cells[0, :header_cols] if header_rows \
+            else [""] * header_cols
+        if transposed:
+            X, names, labels = X.T, labels.T, names.T
+            label_names = [""] * labels.shape[1]
+
+        attr_names = names[0] if len(names) else [""] * X.shape[1]
+        attrs = [ContinuousVariable(name or "Feature {}".format(i + 1))
+                 for i, name in enumerate(attr_names)]
+        metas = [StringVariable(name or "Label {}".format(i + 1))
+                 for i, name in enumerate(label_names)]
+        return Table.from_numpy(
+            Domain(attrs, metas=metas), X, None, labels.astype(object))
+
+    def _cache_params(self):
+        """Parameters which (together with the file) define parsed data"""
+        return (
+            type(self).__name__, self.separator,
+            self.header_rows_count, self.header_cols_count,
+            bool(self.transposed), self.is_sparse(),
+            self.sample_rows_p if self.sample_rows_enabled else None,
+            self.sample_cols_p if self.sample_cols_enabled else None,
+            self.precision or Loader.FLOAT64,
+        )
 
-    def __call__(self):
+    def _load_data_cached(self, header_cols_indices, callback=None,
+                          **kwargs):
+        """Call _load_data unless the file has already been parsed with
+        the same parameters and is stored in the data cache.
+
+        Memory-mapped matrices are always stored in the cache and mapped
+        from there (copy-on-write), so processes share their pages.
+        """
+        mmap_mode = "c" if self.is_memory_mapped() else None
+        cache, key = None, None
+        if self.use_cache or mmap_mode:
+            cache = data_cache()
+            try:
+                key = cache.key(self._file_name, self._cache_params())
+            except OSError:
+                cache = None
+
+        cached = cache.get(key, mmap_mode) if cache is not None else None
+        if cached is not None:
+            X, state = cached
+            self._use_rows_mask = state["use_rows_mask"]
+            self._use_cols_mask = state["use_cols_mask"]
+            self.leading_rows = state["leading_rows"]
+            self.leading_cols = state["leading_cols"]
+            attrs = []
+            for name, attributes in state["attributes"]:
+                var = ContinuousVariable.make(name)
+                var.attributes.update(attributes)
+                attrs.append(var)
+            return attrs, X, state["meta_df"], state["index"]
+
+        self._set_sampling_masks(header_cols_indices)
+        attrs, X, meta_df, meta_df_index = self._load_data(
+            callback=callback, **kwargs)
+        X = self._with_precision(X)
+        if cache is not None:
+            # the file has been read; the callback may still stop writing
+            progress = None if callback is None else lambda _: callback(1)
+            cache.put(key, X, {
+                "attributes": [(var.name, var.attributes) for var in attrs],
+                "index": meta_df_index,
+                "meta_df": meta_df,
+                "use_rows_mask": self._use_rows_mask,
+                "use_cols_mask": self._use_cols_mask,
+                "leading_rows": self.leading_rows,
+                "leading_cols": self.leading_cols,
+            }, callback=progress)
+            mapped = cache.get(key, mmap_mode) if mmap_mode else None
+            if mapped is not None:
+                X = mapped[0]
+        return attrs, X, meta_df, meta_df_index
+
+    def _chunk_rows(self, n_cols):
+        """Number of lines of n_cols values that fit into CHUNK_BYTES"""
+        return max(1, self.CHUNK_BYTES // (8 * max(n_cols, 1)))
+
+    def _read_chunks(self, f, sampler=None, **kwargs):
+        """Parse the file in chunks of at most CHUNK_BYTES of values
+
+        The number of lines in a chunk follows from the number of columns;
+        if it is not known in advance, it is taken from the first line.
+        With a sampler, only the sampled rows of each chunk are kept; the
+        sampler's mask is indexed by file lines, headers included.
+
+        :param f: file opened in binary mode
+        :param sampler: RowSampler or None
+        :return: iterator of pd.DataFrame
+        """
+        header = kwargs.get("header")
+        start = 0 if header is None else \
+            len(header) if isinstance(header, list) else header + 1
+        use_cols = kwargs.get("usecols")
+        n_cols = len(use_cols) if use_cols is not None else self.n_cols
+        reader = pd.read_csv(f, iterator=True, **kwargs)
+        found = False
+        while True:
+            try:
+                chunk = reader.get_chunk(
+                    1 if n_cols is None else self._chunk_rows(n_cols))
+            except StopIteration:
+                break
+            n_cols = chunk.shape[1]
+            if sampler is not None:
+                mask = sampler.take(start, len(chunk))
+                start += len(chunk)
+                chunk = chunk[mask]
+            # empty chunks keep the columns of files without sampled rows
+            if len(chunk) or not found:
+                found = True
+                yield chunk
+        if not found:
+            raise ValueError("No data found in {}".format(self._file_name))
+
+    def _read_sparse(self, f, sampler=None, **kwargs):
+        """Read the file in chunks (see _read_chunks) and keep only the
+        non-zero values of each chunk.
+
+        Peak memory is bounded by a single dense chunk and the sparse
+        result instead of the whole dense matrix.
+
+        :param f: file opened in binary mode
+        :param sampler: RowSampler or None
+        :return: tuple (sp.csr_matrix, pd.Index, pd.Index)
+        """
+        blocks, indices, columns = [], [], None
+        for chunk in self._read_chunks(f, sampler, **kwargs):
+            blocks.append(sp.csr_matrix(chunk.values, dtype=float))
+            indices.append(chunk.index)
+            columns = chunk.columns
+        X = sp.vstack(blocks, format="csr")
+        return X, columns, indices[0].append(indices[1:])
+
+    def __call__(self, callback=None):
+        """Load data
+
+        :param callback: callable(float), called with the fraction of the
+            file read so far; it may raise an exception to stop loading
+        :return: Table or None
+        """
         self.__reset_error_messages()
 
-        rst = np.random.RandomState(0x667)
-        if self.transposed:
-            skip_row, skip_col = self.__skip_col(rst), self.__skip_row(rst)
-        else:
-            skip_col, skip_row = self.__skip_col(rst), self.__skip_row(rst)
-
         header_rows = self.__header_rows()
         header_cols, header_cols_indices = self.__header_cols()
 
-        usecols, skip_col, skip_row = self.__update_reading_parameters(
-            skip_col, skip_row, header_cols_indices)
-
         try:
-            attrs, X, meta_df, meta_df_index = self._load_data(
-                skip_row=skip_row, skip_col=skip_col,
+            attrs, X, meta_df, meta_df_index = self._load_data_cached(
+                header_cols_indices, callback=callback,
                 header_rows=header_rows, header_cols=header_cols,
-                use_cols=usecols, transpose=self.transposed
+                transpose=self.transposed
             )
         except Exception as e:
             self.errors["reading_error"] = (e, None)
@@ -235,69 +1980,64 @@ class Loader:
         self.leading_cols = len(header_cols_indices)
         return header_cols, header_cols_indices
 
-    def __skip_row(self, rstate):
-        skip_row = None
-        if self.sample_rows_enabled:
-            p = self.sample_rows_p
-            if p < 100:
-                def skip_row(i, p=p):
-                    return i > 3 and rstate.uniform(0, 100) > p
-        return skip_row
-
-    def __skip_col(self, rstate):
-        skip_col = None
-        if self.sample_cols_enabled:
-            p = self.sample_cols_p
-            if p < 100:
-                def skip_col(i, p=p):
-                    return i > 3 and rstate.uniform(0, 100) > p
-        return skip_col
-
-    def __update_reading_parameters(self, skip_col, skip_row, header_cols):
+    def _file_shape(self):
+        """Number of lines (None if only estimated) and columns of the
+        file, addressed by masks"""
+        n_cols = pd.read_csv(
+            self._file_name, sep=self.separator, index_col=None,
+            nrows=1).shape[1]
+        return None if self.approximate else self.n_rows + 1, n_cols
+
+    def _set_sampling_masks(self, header_cols):
+        """Set masks of sampled file rows and columns (or None)
+
+        The first four rows and columns are always kept and each of
+        the remaining is kept if a uniform draw from [0, 100) is at most
+        the sampling percentage. Masks are drawn in one call per axis,
+        columns first. If the number of file rows is not known, the rows
+        mask is a RowSampler, drawn while the file is parsed.
+        """
         self._use_rows_mask = None
         self._use_cols_mask = None
-        usecols = None
-
-        if skip_col is not None:
-            ncols = pd.read_csv(
-                self._file_name, sep=self.separator, index_col=None,
-                nrows=1).shape[1]
-            self._use_cols_mask = np.array([
-                not skip_col(i) or i in header_cols
-                for i in range(ncols)
-            ], dtype=bool)
-            usecols = np.flatnonzero(self._use_cols_mask)
-
-        if skip_row is not None:
-            self._use_rows_mask = []  # record the used rows
-
-            def skip_row(i, test=skip_row):
-                r = test(i)
-                self._use_rows_mask.append(r)
-                return r
-        return usecols, skip_col, skip_row
+        rows_p, cols_p = None, None
+        if self.sample_rows_enabled and self.sample_rows_p < 100:
+            rows_p = self.sample_rows_p
+        if self.sample_cols_enabled and self.sample_cols_p < 100:
+            cols_p = self.sample_cols_p
+        if self.transposed:
+            rows_p, cols_p = cols_p, rows_p
+        if rows_p is None and cols_p is None:
+            return
+
+        n_rows, n_cols = self._file_shape()
+        rstate = np.random.RandomState(0x667)
+        if cols_p is not None:
+            self._use_cols_mask = sample_mask(n_cols, cols_p, rstate)
+            self._use_cols_mask[header_cols] = True
+        if rows_p is not None:
+            self._use_rows_mask = RowSampler(rows_p, rstate) \
+                if n_rows is None else sample_mask(n_rows, rows_p, rstate)
 
     def __update_metas(self, meta_df, meta_df_index, X):
-        row_annot_df = pd.read_csv(
-            self.row_annotation_file,
-            sep=separator_from_filename(self.row_annotation_file),
-            header=self._row_annot_header, names=self._row_annot_columns
+        row_annot_df, ids = read_annotations(
+            self.row_annotation_file, self._row_annot_header,
+            self._row_annot_columns
         )
-        if self._use_rows_mask is not None:
-            # NOTE: we account for column header/ row index
-            expected = len(self._use_rows_mask) - self.leading_rows
-        else:
-            expected = X.shape[0]
-        if len(row_annot_df) != expected:
-            self.errors["row_annot_mismatch"] = (expected, len(row_annot_df))
-            row_annot_df = None
+        positions = None
+        if meta_df_index is not None and \
+                not isinstance(meta_df_index, pd.RangeIndex):
+            # join on the first level of row labels found in annotations
+            for i in range(meta_df_index.nlevels):
+                positions = annotation_positions(
+                    ids, meta_df_index.get_level_values(i))
+                if positions is not None:
+                    row_annot_df = row_annot_df.iloc[positions]
+                    break
 
-        if row_annot_df is not None and self._use_rows_mask is not None:
-            # use the same sample indices
-            indices = np.flatnonzero(self._use_rows_mask[self.leading_rows:])
-            row_annot_df = row_annot_df.iloc[indices]
-            # if path.endswith(".count") and row_annot.endswith('.meta'):
-            #     assert np.all(row_annot_df.iloc[:, 0] == df.index)
+        if positions is None:
+            row_annot_df = self.__by_position(
+                row_annot_df, self._use_rows_mask, self.leading_rows,
+                X.shape[0], "row_annot_mismatch")
 
         if row_annot_df is not None and meta_df_index is not None:
             # Try to match the leading columns with the meta_df_index.
@@ -327,21 +2067,17 @@ class Loader:
         return meta_df, row_annot_df
 
     def __update_attributes(self, attrs, X):
-        col_annot_df = pd.read_csv(
-            self.col_annotation_file,
-            sep=separator_from_filename(self.col_annotation_file),
-            header=self._col_annot_header, names=self._col_annot_columns
+        col_annot_df, ids = read_annotations(
+            self.col_annotation_file, self._col_annot_header,
+            self._col_annot_columns
         )
-        if self._use_cols_mask is not None:
-            expected = len(self._use_cols_mask) - self.leading_cols
+        positions = annotation_positions(ids, [var.name for var in attrs])
+        if positions is not None:
+            col_annot_df = col_annot_df.iloc[positions]
         else:
-            expected = X.shape[1]
-        if len(col_annot_df) != expected:
-            self.errors["col_annot_mismatch"] = (expected, len(col_annot_df))
-            col_annot_df = None
-        if col_annot_df is not None and self._use_cols_mask is not None:
-            indices = np.flatnonzero(self._use_cols_mask[self.leading_cols:])
-            col_annot_df = col_annot_df.iloc[indices]
+            col_annot_df = self.__by_position(
+                col_annot_df, self._use_cols_mask, self.leading_cols,
+                X.shape[1], "col_annot_mismatch")
 
         if col_annot_df is not None:
             assert len(col_annot_df) == X.shape[1]
@@ -354,6 +2090,19 @@ class Loader:
                     {n: v for n, v in zip(names, values)})
         return attrs
 
+    def __by_position(self, annot_df, mask, leading, n, error):
+        """Select annotations of loaded rows (columns) by their position
+        in the file or return None if their number does not match"""
+        # NOTE: we account for column header/ row index
+        expected = len(mask) - leading if mask is not None else n
+        if len(annot_df) != expected:
+            self.errors[error] = (expected, len(annot_df))
+            return None
+        if mask is not None:
+            # use the same sample indices
+            annot_df = annot_df.iloc[np.flatnonzero(mask[leading:])]
+        return annot_df
+
     def __into_orange_table(self, attrs, X, meta_parts):
         if not attrs and X.shape[1]:
             attrs = Domain.from_numpy(X).attributes
@@ -363,9 +2112,12 @@ class Loader:
         if meta_parts:
             meta_parts = [df_.reset_index() if not df_.index.is_integer()
                           else df_ for df_ in meta_parts]
-            metas = [StringVariable.make(name)
-                     for name in chain(*(_.columns for _ in meta_parts))]
-            M = np.hstack(tuple(df_.values for df_ in meta_parts))
+            if self.compact_metas:
+                metas, M = self.__compact_metas(meta_parts)
+            else:
+                metas = [StringVariable.make(name)
+                         for name in chain(*(_.columns for _ in meta_parts))]
+                M = np.hstack(tuple(df_.values for df_ in meta_parts))
 
         domain = Domain(attrs, metas=metas)
         try:
@@ -377,6 +2129,19 @@ class Loader:
             self.errors["inadequate_headers"] = (rows, cols)
         return table
 
+    def __compact_metas(self, meta_parts):
+        columns = [compact_meta_column(name, df_.iloc[:, i].values,
+                                       self.MAX_CATEGORIES)
+                   for df_ in meta_parts
+                   for i, name in enumerate(df_.columns)]
+        metas = [var for var, _ in columns]
+        # all-discrete metas are stored in a float array
+        dtype = object if any(var.is_string for var in metas) else float
+        M = np.empty((len(meta_parts[0]), len(columns)), dtype=dtype)
+        for i, (_, col) in enumerate(columns):
+            M[:, i] = col
+        return metas, M
+
     def __reset_error_messages(self):
         self.errors = {"row_annot_mismatch": (),
                        "col_annot_mismatch": (),
@@ -452,21 +2217,50 @@ class MtxLoader(Loader):
         except ValueError:
             pass
 
-    def _load_data(self, skip_row=None, skip_col=None, **kwargs):
-        X = scipy.io.mmread(self._file_name)
+    def _file_shape(self):
+        return self.n_rows, self.n_cols
+
+    def _read_preview(self, n_rows, n_cols):
+        with open_compressed(self._file_name, "rb") as f:
+            header = _read_mtx_header(f)
+            if header is None:
+                return None
+            shape, _, field = header
+            block = f.read(2 ** 20)
+        pattern = field == "pattern"
+        entries = _parse_mtx_block(
+            block[:block.rfind(b"\n") + 1], 2 if pattern else 3)
+        rows = entries[:, 0].astype(int) - 1
+        cols = entries[:, 1].astype(int) - 1
+        data = np.ones(len(entries)) if pattern else entries[:, 2]
+        shape = min(shape[0], n_rows), min(shape[1], n_cols)
+        keep = (rows < shape[0]) & (cols < shape[1])
+        rows, cols, data = rows[keep], cols[keep], data[keep]
         if self.transposed:
-            X = X.T
-        if skip_row is not None:
-            self._use_rows_mask = np.array(
-                [not skip_row(i) for i in range(X.shape[0])]
-            )
-            X = X.tocsr()[np.flatnonzero(self._use_rows_mask)]
-        if skip_col is not None:
-            self._use_cols_mask = np.array(
-                [not skip_col(i) for i in range(X.shape[1])]
-            )
-            X = X.tocsc()[:, np.flatnonzero(self._use_cols_mask)]
-        X = X.todense(order="F")
+            rows, cols, shape = cols, rows, shape[::-1]
+        X = sp.csr_matrix((data, (rows, cols)), shape=shape)
+        attrs = [ContinuousVariable("Feature {}".format(i + 1))
+                 for i in range(shape[1])]
+        return Preview(Table.from_numpy(Domain(attrs), X),
+                       self.header_rows_count, self.header_cols_count,
+                       self.transposed)
+
+    def _build_preview(self, head):
+        # the settings of the preview cannot be changed
+        return head
+
+    def _load_data(self, callback=None, **kwargs):
+        X = read_mtx(self._file_name, transpose=self.transposed,
+                     callback=callback)
+        if self.transposed:
+            self._use_rows_mask, self._use_cols_mask = \
+                self._use_cols_mask, self._use_rows_mask
+        if self._use_rows_mask is not None:
+            X = X[np.flatnonzero(self._use_rows_mask)]
+        if self._use_cols_mask is not None:
+            X = X[:, np.flatnonzero(self._use_cols_mask)]
+        if not self.is_sparse():
+            X = X.toarray(order="F")
         if self._use_rows_mask is not None:
             meta_df = pd.DataFrame(
                 {}, index=np.flatnonzero(self._use_rows_mask))
@@ -475,6 +2269,403 @@ class MtxLoader(Loader):
         return [], X, meta_df, meta_df.index
 
 
+class H5Loader(Loader):
+    """Loader of 10x HDF5 gene-barcode matrices (Cell Ranger 2 and 3)
+
+    Genes are stored in file rows and cells in (CSC) columns; only the
+    columns of sampled cells are read.
+    """
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.header_rows_count = 0
+        self.header_cols_count = 0
+        self.FIXED_FORMAT = False
+        self.ENABLE_ANNOTATIONS = False
+        self.transposed = True
+        self.row_annotations_enabled = False
+        self.col_annotations_enabled = False
+        # the file is already binary
+        self.use_cache = False
+
+    def _set_file_parameters(self):
+        if h5py is None:
+            return
+        try:
+            with h5py.File(self._file_name, "r") as f:
+                group = _h5_matrix_group(f)
+                self.n_rows, self.n_cols = map(int, group["shape"][:2])
+                all_el = self.n_rows * self.n_cols
+                self.sparsity = (all_el - len(group["data"])) / all_el \
+                    if all_el else None
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _file_shape(self):
+        return self.n_rows, self.n_cols
+
+    def _read_preview(self, n_rows, n_cols):
+        attrs, X, barcodes = self._read(
+            np.arange(min(n_cols, self.n_cols or 0)),
+            np.arange(min(n_rows, self.n_rows or 0)))
+        domain = Domain(attrs, metas=[StringVariable.make("Barcodes")])
+        table = Table.from_numpy(domain, X, None, barcodes[:, None])
+        return Preview(table, self.header_rows_count,
+                       self.header_cols_count, self.transposed)
+
+    def _build_preview(self, head):
+        # the settings of the preview cannot be changed
+        return head
+
+    def _load_data(self, callback=None, **kwargs):
+        # masks of file rows (genes) and columns (cells)
+        genes_mask, cells_mask = self._use_rows_mask, self._use_cols_mask
+        self._use_rows_mask, self._use_cols_mask = cells_mask, genes_mask
+        cells = np.arange(self.n_cols) if cells_mask is None \
+            else np.flatnonzero(cells_mask)
+        genes = None if genes_mask is None else np.flatnonzero(genes_mask)
+        attrs, X, barcodes = self._read(cells, genes, callback)
+        meta_df = pd.DataFrame({"Barcodes": barcodes})
+        return attrs, X, meta_df, meta_df.index
+
+    def _read(self, cells, genes=None, callback=None):
+        """Read the given cells and genes (default: all genes)
+
+        :return: tuple (list of ContinuousVariable, matrix, np.ndarray),
+            genes, data and cell barcodes
+        """
+        if h5py is None:
+            raise ImportError("Reading HDF5 files requires h5py")
+        with h5py.File(self._file_name, "r") as f:
+            group = _h5_matrix_group(f)
+            n_genes = int(group["shape"][0])
+            data, indices, indptr = read_h5_columns(
+                group["data"], group["indices"], group["indptr"][:], cells,
+                callback=callback)
+            barcodes = _h5_strings(group["barcodes"])[cells]
+            if "features" in group:
+                ids = _h5_strings(group["features"]["id"])
+                names = _h5_strings(group["features"]["name"])
+            else:
+                ids = _h5_strings(group["genes"])
+                names = _h5_strings(group["gene_names"])
+
+        X = sp.csr_matrix((data.astype(float), indices, indptr),
+                          shape=(len(cells), n_genes))
+        if genes is not None:
+            X, ids, names = X[:, genes], ids[genes], names[genes]
+        if not self.is_sparse():
+            X = X.toarray()
+
+        attrs = [ContinuousVariable.make(str(gene_id)) for gene_id in ids]
+        for var, gene_id, name in zip(attrs, ids, names):
+            var.attributes.update({"Id": gene_id, "Gene": name})
+        return attrs, X, barcodes
+
+
+class RandomAccessLoader(Loader):
+    """Base loader of binary files whose rows and columns can be read
+    separately
+
+    Subclasses read the given file rows and columns with _read_table, so
+    sampled rows and columns are (mostly) never read.
+    """
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.header_rows_count = 0
+        self.header_cols_count = 0
+        self.FIXED_FORMAT = False
+        self.ENABLE_ANNOTATIONS = False
+        self.row_annotations_enabled = False
+        self.col_annotations_enabled = False
+        # the file is already binary and the cache would drop annotations
+        self.use_cache = False
+
+    def _file_shape(self):
+        return self.n_rows, self.n_cols
+
+    def _read_preview(self, n_rows, n_cols):
+        n_rows = min(n_rows, self.n_rows or 0)
+        n_cols = min(n_cols, self.n_cols or 0)
+        table = self._read_table(np.arange(n_rows), np.arange(n_cols))
+        return Preview(table, self.header_rows_count,
+                       self.header_cols_count, self.transposed)
+
+    def _build_preview(self, head):
+        # the settings of the preview cannot be changed
+        return head
+
+    def __call__(self, callback=None):
+        self.errors = {key: () for key in self.errors}
+        self._set_sampling_masks([])
+        rows_mask, cols_mask = self._use_rows_mask, self._use_cols_mask
+        try:
+            table = self._read_table(
+                np.arange(self.n_rows) if rows_mask is None
+                else np.flatnonzero(rows_mask),
+                None if cols_mask is None else np.flatnonzero(cols_mask),
+                callback)
+        except Exception as e:
+            self.errors["reading_error"] = (e, None)
+            return None
+        if self.transposed:
+            self._use_rows_mask, self._use_cols_mask = cols_mask, rows_mask
+        return table
+
+    def _read_table(self, rows, cols, callback=None):
+        """Read the given file rows and columns (None for all columns)
+
+        X is converted with _with_precision before the table is built.
+
+        :return: Table
+        """
+        raise NotImplementedError
+
+
+class HDF5Loader(RandomAccessLoader):
+    """Base loader of annotated matrices in HDF5 files"""
+    def _set_file_parameters(self):
+        if h5py is None:
+            return
+        try:
+            with h5py.File(self._file_name, "r") as f:
+                self.n_rows, self.n_cols, nnz = self._matrix_info(f)
+        except (OSError, ValueError, KeyError):
+            return
+        all_el = self.n_rows * self.n_cols
+        if nnz is not None and all_el:
+            self.sparsity = (all_el - nnz) / all_el
+
+    def _matrix_info(self, f):
+        """Return the number of file rows and columns, and of non-zero
+        values (or None if unknown)"""
+        raise NotImplementedError
+
+
+class ParquetLoader(RandomAccessLoader):
+    """Loader of Parquet files with cells in rows
+
+    Only the columns of sampled genes are read (and decoded in parallel);
+    row groups without sampled cells are skipped.
+    """
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.transposed = False
+
+    def _set_file_parameters(self):
+        if pq is None:
+            return
+        try:
+            f = pq.ParquetFile(self._file_name)
+        except (OSError, ValueError):
+            return
+        self.n_rows = f.metadata.num_rows
+        self.n_cols = sum(role == "attribute" for _, role, _ in
+                          parquet_columns(f.schema_arrow))
+
+    def _read_table(self, rows, cols, callback=None):
+        if pq is None:
+            raise ImportError("Reading Parquet files requires pyarrow")
+        f = pq.ParquetFile(self._file_name)
+        columns = parquet_columns(f.schema_arrow)
+        attrs = [column for column in columns if column[1] == "attribute"]
+        if cols is not None:
+            attrs = [attrs[i] for i in cols]
+        others = [column for column in columns if column[1] != "attribute"]
+        names = [name for name, _, _ in attrs + others]
+
+        attr_names = [name for name, _, _ in attrs]
+        other_names = [name for name, _, _ in others]
+
+        # X is converted one row group at a time, the rest is concatenated
+        bounds = np.cumsum([0] + [f.metadata.row_group(i).num_rows
+                                  for i in range(f.num_row_groups)])
+        groups = np.unique(np.searchsorted(bounds, rows, side="right") - 1)
+        x_parts, parts = [], []
+        for k, group in enumerate(groups):
+            part = f.read_row_group(int(group), columns=names,
+                                    use_threads=True)
+            in_group = rows[(rows >= bounds[group]) &
+                            (rows < bounds[group + 1])]
+            part = part.take(pa.array(in_group - bounds[group]))
+            x_parts.append(
+                _arrow_matrix(part, attr_names, self.is_sparse()))
+            parts.append(pa.Table.from_arrays(
+                [part.column(name) for name in other_names],
+                names=other_names))
+            if callback is not None:
+                callback((k + 1) / len(groups))
+        if parts:
+            table = pa.concat_tables(parts)
+            X = sp.vstack(x_parts, format="csr") if self.is_sparse() \
+                else np.vstack(x_parts)
+        else:
+            table = f.schema_arrow.empty_table()
+            X = _arrow_matrix(table, attr_names, self.is_sparse())
+
+        variables = {"attribute": [], "class": [], "meta": []}
+        values = {"class": [], "meta": []}
+        for name, role, annotations in attrs + others:
+            if role == "attribute":
+                var = ContinuousVariable.make(name)
+            else:
+                var, col = _arrow_variable(name, table.column(name))
+                values[role].append(col)
+            var.attributes.update(annotations)
+            variables[role].append(var)
+        Y = np.column_stack(values["class"]) if values["class"] else None
+        M = np.column_stack(values["meta"]).astype(object) \
+            if values["meta"] else None
+        domain = Domain(variables["attribute"], variables["class"],
+                        variables["meta"])
+        return Table.from_numpy(domain, self._with_precision(X), Y, M)
+
+
+# FileFormats are registered with Orange's File and Save widgets when they
+# are defined, so Parquet is offered only if it can be read
+if pa is not None:
+    class ParquetFormat(FileFormat):
+        """Reader and writer of Parquet files for Orange's File and Save
+        widgets"""
+        EXTENSIONS = (".parquet",)
+        DESCRIPTION = "Parquet file"
+        SUPPORT_SPARSE_DATA = True
+
+        def read(self):
+            loader = ParquetLoader(self.filename)
+            data = loader()
+            if data is None:
+                raise loader.errors["reading_error"][0]
+            return data
+
+        @classmethod
+        def write_file(cls, filename, data):
+            write_parquet(filename, data)
+
+
+class NpzLoader(RandomAccessLoader):
+    """Loader of tables written by write_npz
+
+    The arrays are memory-mapped (copy-on-write), so only the sampled
+    rows and columns are read. Without sampling, X of memory-mapped
+    loaders is returned as the mapped array itself. X stays sparse or
+    dense as stored unless `sparse` is set explicitly.
+    """
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.transposed = False
+
+    def _set_file_parameters(self):
+        try:
+            X = _npz_matrix(load_npz(self._file_name))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return
+        self.n_rows, self.n_cols = X.shape
+        all_el = self.n_rows * self.n_cols
+        if sp.issparse(X) and all_el:
+            self.sparsity = (all_el - X.nnz) / all_el
+
+    def _read_table(self, rows, cols, callback=None):
+        arrays = load_npz(self._file_name, mmap_mode="c")
+        domain, metas, attributes = pickle.loads(
+            arrays["domain"].tobytes())
+        X = _npz_matrix(arrays)
+        attrs = domain.attributes
+        if len(rows) < X.shape[0] or not self.is_memory_mapped():
+            X = X[rows]
+        if cols is not None:
+            X = X[:, cols]
+            attrs = [attrs[i] for i in cols]
+        # the stored format is kept unless the user chose one
+        if self.sparse is not None and sp.issparse(X) != self.sparse:
+            X = sp.csr_matrix(X) if self.sparse else X.toarray()
+        Y = np.asarray(arrays["Y"][rows])
+        W = np.asarray(arrays["W"][rows]) if "W" in arrays else None
+        if callback is not None:
+            callback(1)
+        domain = Domain(attrs, domain.class_vars, domain.metas)
+        table = Table.from_numpy(domain, self._with_precision(X), Y,
+                                 metas[rows], W)
+        table.attributes = attributes
+        return table
+
+
+class AnnDataLoader(HDF5Loader):
+    """Loader of AnnData (.h5ad) files with cells in rows
+
+    Columns of obs become metas and columns of var become annotations of
+    variables.
+    """
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.transposed = False
+
+    def _matrix_info(self, f):
+        X = f["X"]
+        if isinstance(X, h5py.Group):
+            n_rows, n_cols = _h5_attr(X, "shape", "h5sparse_shape")
+            return int(n_rows), int(n_cols), len(X["data"])
+        return X.shape[0], X.shape[1], None
+
+    def _read_table(self, rows, cols, callback=None):
+        if h5py is None:
+            raise ImportError("Reading HDF5 files requires h5py")
+        with h5py.File(self._file_name, "r") as f:
+            X = read_h5_matrix(f["X"], rows, cols, self.is_sparse(),
+                               callback=callback)
+            obs_index_name, obs_index, obs = read_h5_frame(f["obs"])
+            _, var_index, var = read_h5_frame(f["var"])
+        if cols is None:
+            cols = np.arange(len(var_index))
+        attrs = _frame_attributes(var_index, var, cols)
+        metas, M = _frame_metas(obs_index_name, obs_index, obs, rows)
+        return Table.from_numpy(Domain(attrs, metas=metas),
+                                self._with_precision(X), None, M)
+
+
+class LoomLoader(HDF5Loader):
+    """Loader of Loom files with genes in rows and cells in columns
+
+    Column attributes become metas and row attributes become annotations
+    of variables.
+    """
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.transposed = True
+
+    def _matrix_info(self, f):
+        n_rows, n_cols = f["matrix"].shape
+        return n_rows, n_cols, None
+
+    def _read_table(self, rows, cols, callback=None):
+        if h5py is None:
+            raise ImportError("Reading HDF5 files requires h5py")
+        with h5py.File(self._file_name, "r") as f:
+            # file rows are genes; cells are read as rows of the transpose
+            X = read_h5_matrix(f["matrix"], rows, cols, self.is_sparse(),
+                               callback=callback).T
+            genes = {name: f["row_attrs"][name][:]
+                     for name in f.get("row_attrs", {})}
+            cells = {name: f["col_attrs"][name][:]
+                     for name in f.get("col_attrs", {})}
+        X = X.tocsr() if sp.issparse(X) else np.ascontiguousarray(X)
+        if cols is None:
+            cols = np.arange(X.shape[0])
+
+        gene_key = next((key for key in ("Gene", "Accession") if key in genes),
+                        None)
+        names = genes.pop(gene_key) if gene_key else np.arange(self.n_rows)
+        names = np.array([v.decode("utf-8") if isinstance(v, bytes)
+                          else str(v) for v in names], dtype=object)
+        attrs = _frame_attributes(names, genes, rows)
+        cell_ids = cells.pop("CellID", np.arange(self.n_cols))
+        metas, M = _frame_metas(
+            "CellID", np.array([v.decode("utf-8") if isinstance(v, bytes)
+                                else str(v) for v in cell_ids], dtype=object),
+            cells, cols)
+        return Table.from_numpy(Domain(attrs, metas=metas),
+                                self._with_precision(X), None, M)
+
+
 class CountLoader(Loader):
     def __init__(self, file_name):
         super().__init__(file_name)
@@ -512,73 +2703,211 @@ class PickleLoader(Loader):
     def _set_file_parameters(self):
         pass
 
-    def _load_data(self):
+    def _read_preview(self, n_rows, n_cols):
+        # pickled tables cannot be read in part
+        return None
+
+    def _load_data(self, callback=None):
         random.seed(0)
-        reader = PickleReader(self._file_name)
-        table = reader.read()
+        with open_with_progress(self._file_name, callback) as f:
+            table = pickle.load(f)
+        if not isinstance(table, Table):
+            raise TypeError("file does not contain a data table")
         self.n_rows, self.n_cols = table.X.shape
-        attrs = self.__attributes(table.domain.attributes)
-        metas = table.domain.metas + table.domain.class_vars
-        domain = Domain(attrs, metas=metas)
-        return table.transform(domain)[self.__row_indices()]
-
-    def __call__(self):
-        return self._load_data()
+        cols = self.__col_indices()
+        rows = self.__row_indices()
+        domain = table.domain
+        if rows is None and cols is None and not domain.class_vars:
+            return table
+        # index the arrays directly, so only the sampled data is copied
+        rows = slice(None) if rows is None else np.array(rows)
+        attrs = domain.attributes
+        X = table.X[rows]
+        if cols is not None:
+            attrs = [attrs[i] for i in cols]
+            X = X[:, cols]
+        M = table.metas[rows]
+        if domain.class_vars:
+            Y = table.Y[rows].reshape(M.shape[0], -1)
+            M = np.hstack((M, Y.astype(object)))
+        W = table.W[rows] if table.has_weights() else None
+        domain = Domain(attrs, metas=domain.metas + domain.class_vars)
+        return Table.from_numpy(domain, X, None, M, W)
+
+    def __call__(self, callback=None):
+        return self._load_data(callback)
 
     def __row_indices(self):
-        indices = range(self.n_rows)
         if self.sample_rows_enabled:
             p = self.sample_rows_p
             if p < 100 and self.n_rows > 3:
-                return random.sample(indices, int(self.n_rows * p / 100))
-        return indices
+                return random.sample(range(self.n_rows),
+                                     int(self.n_rows * p / 100))
+        return None
 
-    def __attributes(self, attributes):
+    def __col_indices(self):
         if self.sample_cols_enabled:
             p = self.sample_cols_p
             if p < 100 and self.n_cols > 3:
-                return random.sample(attributes, int(self.n_cols * p / 100))
-        return attributes
+                return random.sample(range(self.n_cols),
+                                     int(self.n_cols * p / 100))
+        return None
 
 
 class Concatenate:
     INTERSECTION, UNION = range(2)
+    # key of Table.attributes with masks of genes missing from samples
+    MISSING_GENES = "missing_genes"
 
     @classmethod
     def concatenate(cls, concat_type, data_collection):
+        """Concatenate samples and add a source meta variable
+
+        The domain is computed once over all samples and each data matrix
+        is copied into the result only once. The result is sparse if any
+        sample is sparse. Genes missing from a sample are unknown (NaN) in
+        dense results. Sparse results keep them implicit (zero), so they
+        do not grow with the number of missing genes; instead,
+        attributes[MISSING_GENES] maps the names of samples with missing
+        genes to boolean masks over the attributes.
+
+        :param concat_type: int, INTERSECTION or UNION
+        :param data_collection: list of (Table, str)
+        :return: Table
+        """
         if not data_collection:
             return None
 
-        concat_data, source_var = cls.append_source_name(*data_collection[0])
-        for data, source_name in data_collection[1:]:
-            attrs1 = concat_data.domain.attributes
-            attrs2 = data.domain.attributes
+        tables = [data for data, _ in data_collection]
+        source_var = DiscreteVariable(
+            "source", values=[name for _, name in data_collection])
+        if len(tables) == 1:
+            attributes = tables[0].domain.attributes
+            metas = tables[0].domain.metas + (source_var,)
+        else:
+            attributes, metas = cls.__variables(concat_type, tables)
+            metas = sorted(metas + [source_var], key=cls.__key)
+        domain = Domain(attributes, metas=metas)
+
+        X, missing = cls.__concatenate_x(tables, attributes)
+        lengths = [len(data) for data in tables]
+        M = np.empty((sum(lengths), len(metas)), dtype=object)
+        for j, var in enumerate(metas):
+            if var is source_var:
+                M[:, j] = np.repeat(
+                    np.arange(len(tables), dtype=float), lengths)
+            else:
+                M[:, j] = np.concatenate(
+                    [cls.__meta_column(data, var) for data in tables])
+        table = Table.from_numpy(domain, X, None, M)
+        if missing:
+            table.attributes[cls.MISSING_GENES] = {
+                name: missing[i] for i, (_, name)
+                in enumerate(data_collection) if i in missing}
+        return table
+
+    @staticmethod
+    def __key(var):
+        return var.name if isinstance(var.name, str) else ""
+
+    @classmethod
+    def __variables(cls, concat_type, tables):
+        attrs = set(tables[0].domain.attributes)
+        metas = {}
+        for data in tables:
             if concat_type == cls.INTERSECTION:
-                attrs = set(attrs1).intersection(attrs2)
+                attrs.intersection_update(data.domain.attributes)
             elif concat_type == cls.UNION:
-                attrs = set(attrs1 + attrs2)
-            metas = set(concat_data.domain.metas + data.domain.metas)
-
-            def key(var):
-                return var.name if isinstance(var.name, str) else ""
-
-            domain = Domain(sorted(attrs, key=key),
-                            metas=sorted(metas, key=key))
-            concat_data_t = concat_data.transform(domain)
-            data_t = data.transform(domain)
-            source_var.values.append(source_name)
-            data_t[:, source_var] = np.full(
-                (len(data), 1), len(source_var.values) - 1, dtype=object
-            )
-            concat_data = Table.concatenate((concat_data_t, data_t), axis=0)
-        return concat_data
+                attrs.update(data.domain.attributes)
+            for var in data.domain.metas:
+                metas.setdefault(var.name, []).append(var)
+        metas = [cls.__merge_metas(variables) for variables in metas.values()]
+        return sorted(attrs, key=cls.__key), sorted(metas, key=cls.__key)
+
+    @staticmethod
+    def __merge_metas(variables):
+        """A meta variable for the same-named metas of samples
+
+        Discrete metas get the union of values (sorted, if the values of
+        all are sorted); metas of different types become a string meta.
+        """
+        first = variables[0]
+        if all(var is first for var in variables):
+            return first
+        if all(var.is_discrete for var in variables):
+            if all(list(var.values) == list(first.values)
+                   for var in variables):
+                return first
+            values = list(dict.fromkeys(
+                chain.from_iterable(var.values for var in variables)))
+            if all(list(var.values) == sorted(var.values)
+                   for var in variables):
+                values = sorted(values)
+            return DiscreteVariable(first.name, values=values)
+        if all(var.is_continuous for var in variables):
+            return first
+        return StringVariable.make(first.name)
 
     @staticmethod
-    def append_source_name(data, name):
-        source_var = DiscreteVariable("source", values=[name])
-        metas = data.domain.metas + (source_var,)
-        domain = Domain(data.domain.attributes, metas=metas)
-        data = data.transform(domain)
-        data[:, source_var] = np.full((len(data), 1), 0, dtype=object)
-        return data, source_var
+    def __concatenate_x(tables, attributes):
+        """Concatenate data matrices of tables over the attributes
+
+        :return: tuple (X, dict of masks of missing attributes of sparse
+            results by indices of tables)
+        """
+        index = {var: i for i, var in enumerate(attributes)}
+        mappings = []
+        for data in tables:
+            columns = [(j, index[var])
+                       for j, var in enumerate(data.domain.attributes)
+                       if var in index]
+            selected, target = np.array(columns, dtype=int).reshape(-1, 2).T
+            mappings.append((selected, target))
+
+        if any(sp.issparse(data.X) for data in tables):
+            blocks, missing = [], {}
+            for i, (data, (selected, target)) in \
+                    enumerate(zip(tables, mappings)):
+                X = sp.csr_matrix(data.X)[:, selected]
+                blocks.append(sp.csr_matrix(
+                    (X.data, target[X.indices], X.indptr),
+                    shape=(len(data), len(attributes))))
+                if len(target) < len(attributes):
+                    mask = np.ones(len(attributes), dtype=bool)
+                    mask[target] = False
+                    missing[i] = mask
+            X = sp.vstack(blocks, format="csr")
+            X.sort_indices()
+            return X, missing
+
+        X = np.full((sum(len(data) for data in tables), len(attributes)),
+                    np.nan)
+        start = 0
+        for data, (selected, target) in zip(tables, mappings):
+            X[start:start + len(data), target] = data.X[:, selected]
+            start += len(data)
+        return X, {}
 
+    @staticmethod
+    def __meta_column(data, var):
+        """Values of var in data, with codes of discrete metas mapped to
+        the values of var"""
+        source = next((v for v in data.domain.metas if v.name == var.name),
+                      None)
+        if source is None:
+            return np.full(len(data), "" if var.is_string else np.nan,
+                           dtype=object)
+        column = data.metas[:, data.domain.metas.index(source)]
+        if source is var or source.is_string or var.is_continuous or \
+                var.is_discrete and list(source.values) == list(var.values):
+            return column
+        values = column.astype(float)
+        known = ~np.isnan(values)
+        if var.is_discrete:
+            lookup = np.array([var.values.index(value)
+                               for value in source.values], dtype=float)
+            values[known] = lookup[values[known].astype(int)]
+            return values.astype(object)
+        strings = np.full(len(values), "", dtype=object)
+        strings[known] = [source.str_val(v) for v in values[known]]
+        return strings
@@ -5,6 +5,7 @@ from types import SimpleNamespace, FunctionType
 from typing import Optional, Sequence, Tuple, Dict, Iterator
 
 import numpy as np
+import scipy.sparse as sp
 from scipy import stats
 
 from AnyQt.QtCore import Qt, QSize, QPointF, QRectF, QLineF, QTimer
@@ -310,7 +311,7 @@ class OWFilter(widget.OWWidget):
         self.clear()
         self.data = data
         if data is not None:
-            if np.any(data.X < 0):
+            if has_negative(data.X):
                 self.Warning.invalid_range()
             self._setup(data, self.filter_type())
 
@@ -389,17 +390,16 @@ class OWFilter(widget.OWWidget):
                     axis_label = "Number of cells a gene is expressed in"
 
             if measure == TotalCounts:
-                counts = np.nansum(data.X, axis=axis)
+                counts = total_counts(data.X, axis=axis)
             else:
-                mask = (data.X != 0) & (np.isfinite(data.X))
-                counts = np.count_nonzero(mask, axis=axis)
+                counts = detection_counts(data.X, axis=axis)
             x = counts
             if x.size:
                 span = np.ptp(x)
             self._counts = counts
             self.Warning.sampling_in_effect.clear()
         elif filter_type == Data:
-            x = data.X.ravel()
+            x = data.X.data if sp.issparse(data.X) else data.X.ravel()
             x = x[np.isfinite(x)]
             x = x[x != 0]
             self._counts = x
@@ -588,16 +588,20 @@ class OWFilter(widget.OWWidget):
             elif self.filter_type() == Data:
                 dmin, dmax = self.limit_lower, self.limit_upper
                 data = data.copy()
-                assert data.X.base is None
+                assert data.X.base is None or sp.issparse(data.X)
+                # threshold values in place, so X keeps its type and dtype
+                values = data.X.data if sp.issparse(data.X) else data.X
                 mask = None
                 if self.limit_lower_enabled:
-                    mask = data.X < dmin
+                    mask = values < dmin
                 if self.limit_upper_enabled:
                     if mask is not None:
-                        mask |= data.X > dmax
+                        mask |= values > dmax
                     else:
-                        mask = data.X < dmax
-                data.X[mask] = 0.0
+                        mask = values < dmax
+                values[mask] = 0
+                if sp.issparse(data.X):
+                    data.X.eliminate_zeros()
             else:
                 assert False
 
@@ -648,6 +652,47 @@ def block_signals(qobj):
         qobj.blockSignals(b)
 
 
+def has_negative(X):
+    """Return True if X (dense or sparse) contains negative values"""
+    if np.issubdtype(X.dtype, np.unsignedinteger):
+        return False
+    values = X.data if sp.issparse(X) else X
+    return bool(np.any(values < 0))
+
+
+def total_counts(X, axis):
+    """Sum of non-nan values of X along axis.
+
+    Sparse matrices are summed without densifying, so the sums of integer
+    counts remain integers.
+
+    :param X: np.ndarray or sp.spmatrix
+    :param axis: int
+    :return: np.ndarray
+    """
+    if not sp.issparse(X):
+        return np.nansum(X, axis=axis)
+    if np.issubdtype(X.dtype, np.floating):
+        X = X.copy()
+        X.data[np.isnan(X.data)] = 0
+    return np.asarray(X.sum(axis=axis)).ravel()
+
+
+def detection_counts(X, axis):
+    """Number of non-zero finite values of X along axis.
+
+    :param X: np.ndarray or sp.spmatrix
+    :param axis: int
+    :return: np.ndarray
+    """
+    if not sp.issparse(X):
+        return np.count_nonzero((X != 0) & np.isfinite(X), axis=axis)
+    X = X.tocsr()
+    expressed = (X.data != 0) & np.isfinite(X.data)
+    X = sp.csr_matrix((expressed, X.indices, X.indptr), shape=X.shape)
+    return np.asarray(X.sum(axis=axis)).ravel()
+
+
 class ViolinPlot(pg.PlotItem):
     """
     A violin plot item with interactive data boundary selection.
@@ -1,17 +1,20 @@
 import os
 import sys
+import copy
+import concurrent.futures
+from functools import partial
 
 from typing import List
 
 from serverfiles import sizeformat
 
-from AnyQt.QtCore import Qt, QFileInfo, QTimer, Signal
+from AnyQt.QtCore import Qt, QFileInfo, QTimer, QThread, Signal
 from AnyQt.QtGui import QStandardItemModel, QStandardItem
 from AnyQt.QtWidgets import (
     QSizePolicy, QGridLayout, QHBoxLayout, QFormLayout,
     QLabel, QComboBox, QSpinBox, QCheckBox, QPushButton,
     QStyle, QApplication, QFileDialog, QFileIconProvider,
-    QWidget
+    QWidget, QTableView
 )
 from AnyQt.QtCore import pyqtSlot as Slot
 
@@ -19,6 +22,7 @@ from Orange.data import Table
 from Orange.widgets import widget, gui, settings
 from Orange.widgets.utils.filedialogs import RecentPath
 from Orange.widgets.utils.buttons import VariableTextPushButton
+from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher
 
 from orangecontrib.single_cell.widgets.load_data import get_data_loader, Loader
 
@@ -28,10 +32,21 @@ Formats = [
     "Tab separated file (*.tsv *.tab)",
     "Comma separated file (*.csv)",
     "10x gene-barcode matrix (matrix.mtx)",
+    "10x HDF5 gene-barcode matrix (*.h5)",
+    "AnnData file (*.h5ad)",
+    "Loom file (*.loom)",
     "Pickled Python object file (*.pkl *.pickle)",
+    "Parquet file (*.parquet)",
+    "Binary table (*.npz)",
     "Any tab separated file (*.*)"
 ]
 
+Precisions = [
+    "Double precision (float64)",
+    "Single precision (float32)",
+    "Integer counts",
+]
+
 AnnotationFormats = [
     "Meta file (*.meta)",
     "Tab separated file (*.tsv *.tab)",
@@ -84,11 +99,43 @@ def insert_recent_path(model, path, relpaths=[]):
     return 0
 
 
+def fill_preview_model(model, table, max_rows=10, max_cols=8):
+    # type: (QStandardItemModel, Table, int, int) -> None
+    """Fill the model with labels and values of the first rows and columns
+    of the table (or clear it if table is None)"""
+    model.clear()
+    if table is None:
+        return
+    metas = table.domain.metas[:max_cols]
+    attrs = table.domain.attributes[:max_cols - len(metas)]
+    model.setHorizontalHeaderLabels([var.name for var in metas + attrs])
+    for row in table[:max_rows]:
+        items = [QStandardItem(str(row[var])) for var in metas]
+        for var in attrs:
+            item = QStandardItem("{:g}".format(row[var]))
+            item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            items.append(item)
+        model.appendRow(items)
+
+
 def samepath(p1, p2):
     return (os.path.normpath(os.path.normcase(p1)) ==
             os.path.normpath(os.path.normcase(p2)))
 
 
+class Task:
+    future = None
+    watcher = None
+    loader = None
+    cancelled = False
+
+    def cancel(self):
+        """Stop the task without waiting for it: the worker stops at the
+        next call of the callback and its result is never used"""
+        self.cancelled = True
+        self.future.cancel()
+
+
 class RunaroundSettingsHandler(settings.SettingsHandler):
     def pack_data(self, widget):
         widget._saveState()
@@ -141,6 +188,8 @@ class OWLoadData(widget.OWWidget):
     _sample_cols_enabled = settings.Setting(False)  # type: bool
     _sample_cols_p = settings.Setting(10.0)  # type: bool
     _sample_rows_p = settings.Setting(10.0)  # type: bool
+    _precision = settings.Setting(Loader.FLOAT64)  # type: int
+    _compact_metas = settings.Setting(False)  # type: bool
 
     settingsHandler = RunaroundSettingsHandler()
 
@@ -153,6 +202,13 @@ class OWLoadData(widget.OWWidget):
         super().__init__()
         self._current_path = ""
         self._data_loader = Loader()
+        self._row_count_watchers = []  # type: List[FutureWatcher]
+        # (watcher, loader, settings filled by setup_gui) of head reads
+        self._preview_watchers = []
+        # the loader whose head has been read for previews
+        self._previewed_loader = None
+        self._executor = ThreadExecutor()
+        self._task = None
         icon_open_dir = self.style().standardIcon(QStyle.SP_DirOpenIcon)
 
         # Top grid with file selection combo box
@@ -187,6 +243,17 @@ class OWLoadData(widget.OWWidget):
         label.setFont(f)
         grid.addWidget(label, 1, 1, 1, 3)
 
+        self.preview_view = view = QTableView(
+            editTriggers=QTableView.NoEditTriggers,
+            selectionMode=QTableView.NoSelection,
+            wordWrap=False, visible=False, maximumHeight=150
+        )
+        view.setFont(f)
+        view.setModel(QStandardItemModel(view))
+        view.verticalHeader().hide()
+        view.horizontalHeader().setDefaultSectionSize(70)
+        grid.addWidget(view, 2, 1, 1, 3)
+
         self.controlArea.layout().addLayout(grid)
 
         box = gui.widgetBox(
@@ -261,6 +328,23 @@ class OWLoadData(widget.OWWidget):
         grid.addWidget(suffix, 1, 2)
         grid.setColumnStretch(3, 10)
 
+        box = gui.widgetBox(self.controlArea, "Values")
+        self.precision_combo = QComboBox(
+            toolTip="Storage of sparse data; integer counts fall back "
+                    "to single precision for non-integer values"
+        )
+        self.precision_combo.addItems(Precisions)
+        self.precision_combo.setCurrentIndex(self._precision)
+        self.precision_combo.activated[int].connect(self.set_precision)
+        box.layout().addWidget(self.precision_combo)
+        self.compact_metas_cb = cb = QCheckBox(
+            "Categorical annotations", checked=self._compact_metas,
+            toolTip="Store annotations with few distinct values as "
+                    "categorical variables"
+        )
+        cb.toggled.connect(self.set_compact_metas)
+        box.layout().addWidget(cb)
+
         self.annotation_files_box = box = gui.widgetBox(
             self.controlArea, "Cell && Gene Annotation Files"
         )
@@ -412,6 +496,22 @@ class OWLoadData(widget.OWWidget):
             if commit:
                 self._invalidate()
 
+    def set_precision(self, precision, commit=True):
+        if self._precision != precision:
+            self._precision = precision
+            self.precision_combo.setCurrentIndex(precision)
+            self._data_loader.precision = precision
+            if commit:
+                self._invalidate()
+
+    def set_compact_metas(self, enabled, commit=True):
+        if self._compact_metas != enabled:
+            self._compact_metas = enabled
+            self.compact_metas_cb.setChecked(enabled)
+            self._data_loader.compact_metas = enabled
+            if commit:
+                self._invalidate()
+
     def set_header_rows_count(self, n, commit=True):
         if self._header_rows_count != n:
             self._header_rows_count = n
@@ -473,11 +573,102 @@ class OWLoadData(widget.OWWidget):
         self._current_path = path
         self.recent_combo.setCurrentIndex(0)
 
-        self._data_loader = get_data_loader(path)
+        self._data_loader = loader = get_data_loader(path)
+        unset = [name for name in
+                 ("header_rows_count", "header_cols_count", "transposed")
+                 if getattr(loader, name) is None]
         self._update_summary()
+        self._count_rows()
         self.setup_gui()
+        self._start_preview(unset)
         self._invalidate()
 
+    def _start_preview(self, unset):
+        """Read the head of the current file in the background
+
+        Settings in `unset`, which the loader leaves to the widget, get
+        the values inferred from the head unless they are changed before
+        it is read.
+        """
+        loader = self._data_loader
+        defaults = {name: getattr(loader, name) for name in unset}
+        watcher = FutureWatcher(self._executor.submit(loader.preview))
+        watcher.done.connect(self._previewed)
+        self._preview_watchers.append((watcher, loader, defaults))
+
+    @Slot(concurrent.futures.Future)
+    def _previewed(self, future):
+        done = [(loader, defaults)
+                for watcher, loader, defaults in self._preview_watchers
+                if watcher.future() is future]
+        self._preview_watchers = [item for item in self._preview_watchers
+                                  if item[0].future() is not future]
+        try:
+            preview = future.result()
+        except Exception:  # pylint: disable=broad-except
+            preview = None
+        for loader, defaults in done:
+            if loader is self._data_loader:
+                self._previewed_loader = loader
+            if preview is not None and \
+                    self._apply_suggestions(loader, preview, defaults):
+                self._suggestions_applied(loader)
+            elif loader is self._data_loader:
+                self._update_preview()
+
+    @staticmethod
+    def _apply_suggestions(loader, preview, defaults):
+        """Use header and transposition settings inferred from the head
+        of the file for settings which still have the default values.
+
+        :return: True if any setting has been changed
+        """
+        changed = False
+        for name, default in defaults.items():
+            value = getattr(preview, name)
+            if value is not None and value != default and \
+                    getattr(loader, name) == default:
+                setattr(loader, name, value)
+                changed = True
+        return changed
+
+    def _suggestions_applied(self, loader):
+        """Show settings of the loader, changed after its head was read"""
+        if loader is self._data_loader:
+            self.setup_gui()
+            self._invalidate()
+
+    def _update_preview(self):
+        """Show the preview of the current file if its head has been read;
+        the head is not read again when settings change."""
+        preview = None
+        if self._current_path and \
+                self._data_loader is self._previewed_loader:
+            try:
+                preview = self._data_loader.preview()
+            except Exception:  # pylint: disable=broad-except
+                pass
+        table = preview.table if preview is not None else None
+        fill_preview_model(self.preview_view.model(), table)
+        self.preview_view.setVisible(table is not None)
+
+    def _count_rows(self):
+        """Count rows of the current file in the background if the summary
+        only shows an estimate."""
+        future = self._data_loader.count_rows()
+        if future is None or future.done() or \
+                any(w.future() is future for w in self._row_count_watchers):
+            return
+        watcher = FutureWatcher(future)
+        watcher.done.connect(self._rows_counted)
+        self._row_count_watchers.append(watcher)
+
+    @Slot(concurrent.futures.Future)
+    def _rows_counted(self, future):
+        self._row_count_watchers = [w for w in self._row_count_watchers
+                                    if w.future() is not future]
+        self._update_summary()
+
     def setup_gui(self):
         """ Use loader predefined values. If the value is None, set
         loader's parameter to widget's setting value.
@@ -518,6 +709,16 @@ class OWLoadData(widget.OWWidget):
         else:
             loader.sample_cols_p = self._sample_cols_p
 
+        if loader.precision is not None:
+            self.set_precision(loader.precision, False)
+        else:
+            loader.precision = self._precision
+
+        if loader.compact_metas is not None:
+            self.set_compact_metas(loader.compact_metas, False)
+        else:
+            loader.compact_metas = self._compact_metas
+
         if loader.row_annotation_file is not None:
             index = insert_recent_path(
                 self.row_annotations_combo.model(),
@@ -553,11 +754,12 @@ class OWLoadData(widget.OWWidget):
         size = self._data_loader.file_size
         ncols = self._data_loader.n_cols
         nrows = self._data_loader.n_rows
+        approx = "~" if self._data_loader.approximate else ""
         text = []
         if size is not None:
             text += [sizeformat(size)]
         if nrows is not None:
-            text += ["{:n} rows".format(nrows)]
+            text += ["{}{:n} rows".format(approx, nrows)]
         if nrows is not None:
             text += ["{:n} columns".format(ncols)]
 
@@ -628,6 +830,8 @@ class OWLoadData(widget.OWWidget):
             self._invalidate()
 
     def _invalidate(self):
+        self.cancel()
+        self._update_preview()
         self.set_modified(True)
 
     def set_modified(self, modified):
@@ -647,10 +851,52 @@ class OWLoadData(widget.OWWidget):
         path = self._current_path
         if not path:
             return
-        self.Outputs.data.send(self._data_loader())
+        if self._task is not None:
+            self.cancel()
+        assert self._task is None
+
+        # the worker reads a copy, so the loader can be changed meanwhile
+        self._task = task = Task()
+        task.loader = copy.copy(self._data_loader)
+
+        def callback(finished):
+            if task.cancelled:
+                raise KeyboardInterrupt()
+            self.progressBarSet(finished * 100)
+
+        self.progressBarInit()
+        task.future = self._executor.submit(
+            partial(task.loader, callback=callback))
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self._task_finished)
+
+    @Slot(concurrent.futures.Future)
+    def _task_finished(self, f):
+        assert self.thread() is QThread.currentThread()
+        assert self._task is not None
+        assert self._task.future is f
+        assert f.done()
+
+        loader = self._task.loader
+        self._task = None
+        self.progressBarFinished()
+
+        self._data_loader.errors = loader.errors
+        self.Outputs.data.send(f.result())
         self.show_error_messages()
         self.set_modified(False)
 
+    def cancel(self):
+        """
+        Cancel the current task (if any).
+        """
+        if self._task is not None:
+            self._task.cancel()
+            # disconnect the `_task_finished` slot
+            self._task.watcher.done.disconnect(self._task_finished)
+            self._task = None
+            self.progressBarFinished()
+
     def show_error_messages(self):
         self.Error.row_annotation_mismatch.clear()
         self.Error.col_annotation_mismatch.clear()
@@ -666,6 +912,7 @@ class OWLoadData(widget.OWWidget):
             self.Error.reading_error()
 
     def onDeleteWidget(self):
+        self.cancel()
         super().onDeleteWidget()
 
     def _saveState(self):
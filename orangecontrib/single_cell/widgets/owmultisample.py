@@ -1,11 +1,18 @@
 import os
 import numbers
+import queue
+import shutil
+import tempfile
+import threading
+import concurrent.futures
+import multiprocessing
+from concurrent.futures import Future
 from collections import namedtuple
 from typing import Dict, Tuple, List, Optional
 from serverfiles import sizeformat
 
 from AnyQt.QtCore import (
-    Qt, QItemSelectionModel, pyqtSlot as Slot, QModelIndex, Signal
+    Qt, QItemSelectionModel, QTimer, pyqtSlot as Slot, QModelIndex, Signal
 )
 from AnyQt.QtGui import (
     QStandardItemModel, QStandardItem, QIcon, QBrush, QColor
@@ -16,12 +23,61 @@ from AnyQt.QtWidgets import (
 )
 from Orange.widgets import gui
 from Orange.widgets.settings import Setting
+from Orange.widgets.utils.concurrent import FutureWatcher
 from Orange.widgets.widget import Msg
 
-from orangecontrib.single_cell.widgets.load_data import Concatenate, Loader
+from orangecontrib.single_cell.widgets.load_data import (
+    Concatenate, Loader, load_to_file, table_from_file
+)
 import orangecontrib.single_cell.widgets.owloaddata as owloaddata
 
 LoaderObjectRole = next(gui.OrangeUserRole)
+StatusRole = next(gui.OrangeUserRole)
+
+
+class LoadTask:
+    """Samples loaded in the background, in a process pool or a thread
+
+    :param stop: Event which stops the workers once it is set
+    :param progress: Queue through which the workers report progress
+    """
+    cancelled = False
+
+    def __init__(self, stop, progress):
+        self.directory = tempfile.mkdtemp(prefix="orange-single-cell-")
+        # (row, loader, source name, future) in the order of samples
+        self.samples = []  # type: List[Tuple[int, Loader, str, Future]]
+        self.watchers = []  # type: List[FutureWatcher]
+        self.stop = stop
+        self.progress = progress
+        # fraction of the file read by row
+        self.finished = {}  # type: Dict[int, float]
+
+    @property
+    def n_done(self):
+        return sum(future.done() for *_, future in self.samples)
+
+    def update_progress(self):
+        """Read the progress reported by workers since the last call
+
+        :return: float, the fraction of all samples loaded
+        """
+        while True:
+            try:
+                row, finished = self.progress.get_nowait()
+            except queue.Empty:
+                break
+            self.finished[row] = finished
+        return sum(1 if future.done() else self.finished.get(row, 0)
+                   for row, *_, future in self.samples) / len(self.samples)
+
+    def cancel(self):
+        self.cancelled = True
+        self.stop.set()
+        for *_, future in self.samples:
+            future.cancel()
+        # workers that are still running fail to write their results
+        shutil.rmtree(self.directory, ignore_errors=True)
 
 
 class FileDelegate(QStyledItemDelegate):
@@ -30,6 +86,9 @@ class FileDelegate(QStyledItemDelegate):
         data = index.data(Qt.DisplayRole)
         if isinstance(data, str):
             option.text = os.path.split(data)[1]
+            status = index.data(StatusRole)
+            if status:
+                option.text += " ({})".format(status)
 
 
 class SizeDelegate(QStyledItemDelegate):
@@ -136,6 +195,11 @@ class OWMultiSample(owloaddata.OWLoadData):
     class Information(owloaddata.OWLoadData.Information):
         file_in_list = Msg("File {} already in the list.")
 
+    class Warning(owloaddata.OWLoadData.Warning):
+        missing_genes_zero = Msg(
+            "Genes missing from some samples are zero in the sparse "
+            "output.")
+
     HEADER_SCHEMA = (
         ("selected", ""),
         ("name", "File"),
@@ -161,6 +225,12 @@ class OWMultiSample(owloaddata.OWLoadData):
     _sample_cols_enabled = False
     _sample_cols_p = 10.0
     _sample_rows_p = 10.0
+    _precision = 0
+    _compact_metas = False
+
+    # load samples in a process pool if together they are larger than this;
+    # smaller selections are loaded in a single background thread
+    PARALLEL_MIN_SIZE = 2 ** 26
 
     samples = Setting([])  # type: List[Tuple[str, str, bool]
     loaders = Setting({})  # type: Dict[str, Loader]
@@ -170,6 +240,12 @@ class OWMultiSample(owloaddata.OWLoadData):
     resizing_enabled = True
 
     def __init__(self):
+        self.__task = None  # type: Optional[LoadTask]
+        self.__executor = None
+        self.__manager = None
+        self.__thread_executor = None
+        self.__progress_timer = QTimer(interval=250)
+        self.__progress_timer.timeout.connect(self.__update_progress)
 
         self._header_labels = hls = [label for _, label in self.HEADER_SCHEMA]
         header = namedtuple("header", [tag for tag, _ in self.HEADER_SCHEMA])
@@ -223,12 +299,39 @@ class OWMultiSample(owloaddata.OWLoadData):
     def _update_view_cells_genes(self):
         row = self.view.currentIndex().row()
         if row > -1:
-            cell_item = self.view.model().item(row, self._Header.cells)
-            cell_item.setData(self._data_loader.n_cells, Qt.DisplayRole)
-            gene_item = self.view.model().item(row, self._Header.genes)
-            gene_item.setData(self._data_loader.n_genes, Qt.DisplayRole)
+            self.__update_cells_genes(row, self._data_loader)
             self.repaint()
 
+    def __update_cells_genes(self, row, loader):
+        tooltip = "Estimated from a part of the file" \
+            if loader.approximate else ""
+        cell_item = self.view.model().item(row, self._Header.cells)
+        cell_item.setData(loader.n_cells, Qt.DisplayRole)
+        cell_item.setToolTip(tooltip)
+        gene_item = self.view.model().item(row, self._Header.genes)
+        gene_item.setData(loader.n_genes, Qt.DisplayRole)
+        gene_item.setToolTip(tooltip)
+
+    def _rows_counted(self, future):
+        super()._rows_counted(future)
+        model = self.view.model()
+        for row in range(model.rowCount()):
+            loader = model.item(row).data(LoaderObjectRole)
+            if loader is not None and loader.count_rows() is future:
+                self.__update_cells_genes(row, loader)
+
+    def _suggestions_applied(self, loader):
+        model = self.view.model()
+        for row in range(model.rowCount()):
+            if model.item(row).data(LoaderObjectRole) is loader:
+                self.__update_cells_genes(row, loader)
+        if loader is self._data_loader:
+            self.setup_gui()
+        self.commit()
+
+    def _update_preview(self):
+        """Samples are not previewed"""
+
     def _view_clicked(self, index):
         if index.column() == self._Header.remove:
             self.remove_item(index)
@@ -338,12 +441,16 @@ class OWMultiSample(owloaddata.OWLoadData):
     def __cells_item(self):
         item = QStandardItem()
         item.setData(self._data_loader.n_cells, Qt.DisplayRole)
+        if self._data_loader.approximate:
+            item.setToolTip("Estimated from a part of the file")
         item.setEditable(False)
         return item
 
     def __genes_item(self):
         item = QStandardItem()
         item.setData(self._data_loader.n_genes, Qt.DisplayRole)
+        if self._data_loader.approximate:
+            item.setToolTip("Estimated from a part of the file")
         item.setEditable(False)
         return item
 
@@ -391,6 +498,7 @@ class OWMultiSample(owloaddata.OWLoadData):
     def set_current_loader(self, loader, path):
         self._data_loader = loader
         self._current_path = path
+        self._count_rows()
         self.setup_gui()
 
     def set_current_path(self, path, checked=True, source_name=""):
@@ -430,24 +538,139 @@ class OWMultiSample(owloaddata.OWLoadData):
         if not self.view or not self.view.model():
             return
 
+        self.cancel()
         self.clear_messages()
         self.write_settings()
 
+        samples = [(index, self.loaders.get(path), source_name)
+                   for index, (path, checked, source_name)
+                   in enumerate(self.samples) if checked]
+        if not samples:
+            self.__send_output([])
+            return
+        size = sum(loader.file_size or 0 for _, loader, _ in samples)
+        self.__start_load(
+            samples, len(samples) > 1 and size >= self.PARALLEL_MIN_SIZE)
+
+    def __start_load(self, samples, parallel):
+        if not parallel:
+            if self.__thread_executor is None:
+                self.__thread_executor = \
+                    concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            executor = self.__thread_executor
+            task = LoadTask(threading.Event(), queue.Queue())
+        else:
+            if self.__executor is None:
+                # forking a process with Qt's threads may deadlock
+                context = multiprocessing.get_context("spawn")
+                self.__executor = concurrent.futures.ProcessPoolExecutor(
+                    mp_context=context)
+                self.__manager = context.Manager()
+            executor = self.__executor
+            task = LoadTask(self.__manager.Event(), self.__manager.Queue())
+        self.__task = task
+        for index, loader, source_name in samples:
+            future = executor.submit(
+                load_to_file, loader, task.directory,
+                task.stop, task.progress, index)
+            task.samples.append((index, loader, source_name, future))
+            self.__set_status(index, "loading")
+        self.progressBarInit()
+        for *_, future in task.samples:
+            watcher = FutureWatcher(future)
+            watcher.done.connect(self._sample_loaded)
+            task.watchers.append(watcher)
+        self.__progress_timer.start()
+
+    def __update_progress(self):
+        task = self.__task
+        if task is None:
+            self.__progress_timer.stop()
+            return
+        self.progressBarSet(100 * task.update_progress())
+        for index, *_, future in task.samples:
+            if not future.done() and index in task.finished:
+                self.__set_status(index, "loading, {:.0f} %".format(
+                    100 * task.finished[index]))
+
+    @Slot(concurrent.futures.Future)
+    def _sample_loaded(self, future):
+        task = self.__task
+        if task is None or \
+                not any(f is future for *_, f in task.samples):
+            return
+        for index, *_, f in task.samples:
+            if f is future:
+                self.__set_status(index, None)
+        self.progressBarSet(100 * task.update_progress())
+        if task.n_done < len(task.samples):
+            return
+
+        self.__task = None
+        self.__progress_timer.stop()
+        self.progressBarFinished()
+        try:
+            self.__send_output(self.__collect_results(task))
+        finally:
+            shutil.rmtree(task.directory, ignore_errors=True)
+
+    @staticmethod
+    def __collect_results(task):
+        for index, loader, source_name, future in task.samples:
+            table = None
+            try:
+                parts, loader.errors = future.result()
+                if parts is not None:
+                    table = table_from_file(*parts)
+            except Exception as e:  # pylint: disable=broad-except
+                loader.errors["reading_error"] = (e, None)
+            yield index, loader, table, source_name
+
+    def __send_output(self, loaded):
         data_collection = []
-        for index, (path, checked, source_name) in enumerate(self.samples):
-            if checked:
-                loader = self.loaders.get(path)
-                table = loader()
-                if any(loader.errors.values()):
-                    self.select_item(index)
-                    self.show_error_messages()
-                    break
-                else:
-                    data_collection.append((table, source_name))
+        for index, loader, table, source_name in loaded:
+            if any(loader.errors.values()):
+                self.select_item(index)
+                self.show_error_messages()
+                break
+            else:
+                data_collection.append((table, source_name))
 
         data = Concatenate.concatenate(self.output_type, data_collection)
+        self.Warning.missing_genes_zero(
+            shown=data is not None and
+            Concatenate.MISSING_GENES in data.attributes)
         self.Outputs.data.send(data)
 
+    def __set_status(self, row, status):
+        item = self.view.model().item(row, self._Header.name)
+        if item is not None:
+            item.setData(status, StatusRole)
+
+    def cancel(self):
+        """
+        Cancel the current task (if any).
+        """
+        super().cancel()
+        if self.__task is not None:
+            task, self.__task = self.__task, None
+            task.cancel()
+            self.__progress_timer.stop()
+            for watcher in task.watchers:
+                watcher.done.disconnect(self._sample_loaded)
+            for index, *_ in task.samples:
+                self.__set_status(index, None)
+            self.progressBarFinished()
+
+    def onDeleteWidget(self):
+        self.cancel()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__manager.shutdown()
+        if self.__thread_executor is not None:
+            self.__thread_executor.shutdown(wait=False)
+        super().onDeleteWidget()
+
     def write_settings(self):
         self.samples = []
         self.loaders = {}
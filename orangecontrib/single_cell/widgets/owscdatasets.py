@@ -1,17 +1,107 @@
 import os
 import sys
+import json
+import tempfile
+import concurrent.futures
+from urllib.parse import quote
+
 import Orange.widgets.data.owdatasets
+from serverfiles import ServerFiles
 
 from AnyQt.QtWidgets import QApplication
 from AnyQt.QtGui import QStandardItemModel, QStandardItem
-from AnyQt.QtCore import Qt
+from AnyQt.QtCore import Qt, Slot, QThread
 
 from Orange.widgets.gui import IndicatorItemDelegate
+from Orange.widgets.utils.concurrent import ThreadExecutor, FutureWatcher
 
 from orangecontrib.bioinformatics.ncbi.taxonomy import shortname, common_taxids
 from orangecontrib.bioinformatics.ncbi.gene import NCBI_ID
 from orangecontrib.bioinformatics.widgets.utils.data import GENE_AS_ATTRIBUTE_NAME, TAX_ID, GENE_ID_ATTRIBUTE
 
+from orangecontrib.single_cell.download import download
+from orangecontrib.single_cell.widgets.load_data import NpzLoader, write_npz
+
+
+def download_dataset(index_url, file_path, local_cache_path, callback=None):
+    """Download a data set into the local cache
+
+    Interrupted downloads are resumed (see download.download). The data
+    set's info is stored next to it, as serverfiles does, so the data set
+    is listed as local, and it is converted into its memory-mappable copy.
+
+    :return: str, local path of the data set
+    """
+    info = ServerFiles(server=index_url).info(*file_path)
+    path = os.path.join(local_cache_path, *file_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    url = index_url.rstrip("/") + "/" + "/".join(quote(p) for p in file_path)
+    download(url, path, callback=callback)
+    with open(path + ".info", "w") as f:
+        json.dump(info, f)
+    convert_dataset(path)
+    return path
+
+
+def binary_path(path):
+    """Path of the memory-mappable copy of a downloaded data set"""
+    return os.path.splitext(path)[0] + ".npz"
+
+
+def convert_dataset(path):
+    """Write the memory-mappable .npz copy of a downloaded data set
+
+    :return: Table, the data set read from path
+    """
+    data = Orange.data.Table(path)
+    fd, tmp_path = tempfile.mkstemp(suffix=".npz",
+                                    dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        write_npz(tmp_path, data)
+        os.replace(tmp_path, binary_path(path))
+    except Exception:  # pylint: disable=broad-except
+        # the data set is still usable without its binary copy
+        pass
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return data
+
+
+def open_dataset(path, taxid, callback=None):
+    """Open a downloaded data set
+
+    The data set is mapped from its .npz copy; data sets without an
+    up-to-date copy (e.g. downloaded by older versions) are converted
+    first.
+    """
+    npz_path = binary_path(path)
+    if not os.path.exists(npz_path) or \
+            os.path.getmtime(npz_path) < os.path.getmtime(path):
+        data = convert_dataset(path)
+    else:
+        loader = NpzLoader(npz_path)
+        loader.memory_map = True
+        data = loader(callback)
+        if data is None:
+            raise loader.errors["reading_error"][0]
+    data.attributes[TAX_ID] = taxid
+    data.attributes[GENE_AS_ATTRIBUTE_NAME] = True  # Will all data sets have gene names in columns?
+    data.attributes[GENE_ID_ATTRIBUTE] = NCBI_ID
+    return data
+
+
+class Task:
+    future = None
+    watcher = None
+    cancelled = False
+
+    def cancel(self):
+        """Stop the task without waiting for it: the worker stops at the
+        next call of the callback and its result is never used"""
+        self.cancelled = True
+        self.future.cancel()
 
 
 class OWscDataSets(Orange.widgets.data.owdatasets.OWDataSets):
@@ -34,13 +124,113 @@ class OWscDataSets(Orange.widgets.data.owdatasets.OWDataSets):
         ['tags',         {'label': 'Tags'}]
     ]
 
+    def __init__(self):
+        # the base class may output a data set while initializing
+        self._task = None
+        self._load_executor = ThreadExecutor()
+        super().__init__()
+
     def load_data(self, path):
-        info = self.selected_dataset()
-        data = Orange.data.Table(path)
-        data.attributes[TAX_ID] = info.taxid
-        data.attributes[GENE_AS_ATTRIBUTE_NAME] = True  # Will all data sets have gene names in columns?
-        data.attributes[GENE_ID_ATTRIBUTE] = NCBI_ID
-        return data
+        return open_dataset(path, self.selected_dataset().taxid)
+
+    def commit(self):
+        di = self.selected_dataset()
+        if di is None or di.islocal and not getattr(di, "outdated", False):
+            super().commit()
+            return
+        self.cancel()
+        self.error()
+        self._task = task = Task()
+
+        def callback(finished):
+            if task.cancelled:
+                raise KeyboardInterrupt()
+            if finished is not None:
+                self.progressBarSet(finished * 100)
+
+        self.progressBarInit()
+        self.setStatusMessage("Fetching...")
+        task.future = self._load_executor.submit(
+            download_dataset, self.INDEX_URL, di.file_path,
+            self.local_cache_path, callback)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self._download_finished)
+
+    @Slot(concurrent.futures.Future)
+    def _download_finished(self, f):
+        assert self.thread() is QThread.currentThread()
+        assert self._task is not None
+        assert self._task.future is f
+        assert f.done()
+
+        self._task = None
+        self.progressBarFinished()
+        self.setStatusMessage("")
+        try:
+            path = f.result()
+        except Exception as ex:  # pylint: disable=broad-except
+            self.error(str(ex))
+            path = None
+        self.update_cached_state()
+        self.load_and_output(path)
+
+    def load_and_output(self, path):
+        self.cancel()
+        if path is None:
+            super().load_and_output(path)
+            return
+
+        self._task = task = Task()
+        taxid = self.selected_dataset().taxid
+
+        def callback(finished):
+            if task.cancelled:
+                raise KeyboardInterrupt()
+            self.progressBarSet(finished * 100)
+
+        self.progressBarInit()
+        self.setStatusMessage("Opening...")
+        task.future = self._load_executor.submit(
+            open_dataset, path, taxid, callback)
+        task.watcher = FutureWatcher(task.future)
+        task.watcher.done.connect(self._task_finished)
+
+    @Slot(concurrent.futures.Future)
+    def _task_finished(self, f):
+        assert self.thread() is QThread.currentThread()
+        assert self._task is not None
+        assert self._task.future is f
+        assert f.done()
+
+        self._task = None
+        self.progressBarFinished()
+        self.setStatusMessage("")
+        self.error()
+        try:
+            data = f.result()
+        except Exception as ex:  # pylint: disable=broad-except
+            self.error(str(ex))
+            data = None
+        self.Outputs.data.send(data)
+        self.current_output = self.selected_id
+        self.update_cached_state()
+
+    def cancel(self):
+        """
+        Cancel the current task (if any).
+        """
+        if self._task is not None:
+            self._task.cancel()
+            # disconnect the slot of the running task, so its result is
+            # discarded
+            self._task.watcher.done.disconnect()
+            self._task = None
+            self.progressBarFinished()
+
+    def onDeleteWidget(self):
+        self.cancel()
+        self._load_executor.shutdown(wait=False)
+        super().onDeleteWidget()
 
     def assign_delegates(self):
         self.view.setItemDelegateForColumn(
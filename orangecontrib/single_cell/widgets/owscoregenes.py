@@ -12,7 +12,7 @@ from functools import partial
 from itertools import chain
 
 import numpy as np
-from scipy.sparse import issparse
+from scipy.sparse import issparse, csr_matrix
 
 from AnyQt.QtGui import QFontMetrics
 from AnyQt.QtWidgets import (
@@ -77,6 +77,24 @@ class UnsupervisedScorer(score.Scorer):
         return self.score_data(data, feature)
 
 
+def _mean_var(X):
+    """
+    Column means and variances of a dense or sparse matrix.
+    Sparse matrices are not densified; their non-zero values are
+    accumulated per column in float64 (np.bincount converts the weights),
+    which costs a float64 copy of the non-zero values only.
+    """
+    if not issparse(X):
+        return X.mean(axis=0), np.var(X, axis=0)
+    X = csr_matrix(X)
+    n, m = X.shape
+    sums = np.bincount(X.indices, weights=X.data, minlength=m)
+    squares = np.bincount(X.indices, minlength=m,
+                          weights=np.square(X.data, dtype=np.float64))
+    means = sums / n
+    return means, np.clip(squares / n - means ** 2, 0, None)
+
+
 class MeanScorer(UnsupervisedScorer):
     """
     Simple scorer returning mean of the features.
@@ -88,7 +106,7 @@ class MeanScorer(UnsupervisedScorer):
     def score_data(self, data, feature):
         weights = np.nan + np.zeros((len(data.domain.attributes)))
         conts = np.array([a.is_continuous for a in data.domain.attributes])
-        weights[conts] = data.X[:,conts].mean(axis = 0)
+        weights[conts] = _mean_var(data.X[:, conts])[0]
 
         if feature:
             return weights[0]
@@ -99,13 +117,13 @@ class VarianceScorer(UnsupervisedScorer):
     """
     Simple scorer returning variance of the features.
     """
-    supports_sparse_data = False
+    supports_sparse_data = True
     friendly_name = "Variance"
 
     def score_data(self, data, feature):
         weights = np.nan + np.zeros((len(data.domain.attributes)))
         conts = np.array([a.is_continuous for a in data.domain.attributes])
-        weights[conts] = np.var(data.X[:, conts], axis=0)
+        weights[conts] = _mean_var(data.X[:, conts])[1]
 
         if feature:
             return weights[0]
@@ -116,15 +134,14 @@ class DispersionScorer(UnsupervisedScorer):
     """
     Simple scorer returning approximate dispersion (variance / mean) of the features.
     """
-    supports_sparse_data = False
+    supports_sparse_data = True
     friendly_name = "Dispersion"
 
     def score_data(self, data, feature):
         weights = np.nan + np.zeros((len(data.domain.attributes)))
         conts = np.array([a.is_continuous for a in data.domain.attributes])
 
-        means = data.X[:, conts].mean(axis = 0)
-        variances = np.var(data.X[:, conts], axis=0)
+        means, variances = _mean_var(data.X[:, conts])
         means[means == 0] = 1
         weights[conts] = variances / means
 
@@ -138,15 +155,15 @@ class VariationCoefficientScorer(UnsupervisedScorer):
     Simple scorer returning coefficient of variation.
     http://www.statisticshowto.com/how-to-find-a-coefficient-of-variation/
     """
-    supports_sparse_data = False
+    supports_sparse_data = True
     friendly_name = "Coef. of Variation"
 
     def score_data(self, data, feature):
         weights = np.nan + np.zeros((len(data.domain.attributes)))
         conts = np.array([a.is_continuous for a in data.domain.attributes])
 
-        means = data.X[:, conts].mean(axis = 0)
-        stds = data.X[:, conts].std(axis=0)
+        means, variances = _mean_var(data.X[:, conts])
+        stds = np.sqrt(variances)
         means[means == 0] = 1
         weights[conts] = stds / means
 